@@ -1,37 +1,155 @@
 # grok.py — FINAL v5: channel blocking + saner per-user context
 from sopel import plugin
 from sopel.config import types
-from collections import deque
+from collections import deque, OrderedDict
+import asyncio
+import concurrent.futures
 import sqlite3
+import contextlib
+import functools
+import hashlib
+import json
+import itertools
 import os
+import sys
 import datetime
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
 import re
 import threading
 import random
 import logging
+import weakref
 import queue
+import zlib
+
+try:
+    # Optional: RE2 guarantees linear-time matching for the intent heuristics
+    import re2
+except ImportError:
+    re2 = None
+
+try:
+    # Optional: zstd (with a dictionary trained on our own history) for stored text
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    # Optional: vectorized relevance ranking of stored per-user history
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    # Optional: native asyncio HTTP client for the API engine (else requests in threads)
+    import httpx
+except ImportError:
+    httpx = None
 
 # Tunables / constants
+# xAI endpoint (api_base in [grok] overrides it, e.g. for a proxy or a local mock)
+API_BASE = 'https://api.x.ai/v1'
 MAX_SEND_LEN = 440
 SEND_DELAY = 1.0
 CHANNEL_RATE_LIMIT = 4
 REVIEW_COOLDOWN = 30
 USER_SAFETY_SECONDS = 2
+# API engine: requests run as coroutines on one event loop thread; at most
+# API_CONCURRENCY are in flight (api_concurrency overrides), API_QUEUE_MAXSIZE more
+# may wait for a slot before new ones are turned away as busy
 API_QUEUE_MAXSIZE = 50
-API_WORKER_COUNT = 3
+API_CONCURRENCY = 16
+# Shared keep-alive HTTP session: pooled connections per host, transport-level retries
+# (connect errors, and 429/503 which the API sends before doing any work)
+HTTP_POOL_SIZE = API_CONCURRENCY
+HTTP_RETRIES = 2
+HTTP_RETRY_BACKOFF = 0.5
+HTTP_RETRY_STATUSES = (429, 503)
+# Connection warmth: open a few connections at startup, and ping GET /models when no request
+# has been made for HTTP_KEEPALIVE seconds (checked every HTTP_KEEPALIVE_CHECK)
+HTTP_KEEPALIVE = 45
+HTTP_KEEPALIVE_CHECK = 15
+HTTP_WARM_TIMEOUT = (5, 10)
+HTTP_PREWARM_CONNECTIONS = 3
 
 # History and review mode limits
 MAX_HISTORY_PER_USER = 20
 MAX_HISTORY_ENTRIES = 50
-REVIEW_CHAR_BUDGET = 2000
+CHANNEL_LOG_SIZE = 500
+# Background "recent channel conversation" block sent with normal mentions
+BG_CHAR_BUDGET = 1500
+BG_MAX_LINES = 40
 REVIEW_MAX_ENTRIES = 200
+# Prompt token budgets per request mode (system prompts and the question included),
+# filled by _PromptBudget using the local _estimate_tokens heuristic
+PROMPT_TOKEN_BUDGETS = {'chat': 2000, 'search': 1500, 'time': 800, 'review': 1000}
+PROMPT_MESSAGE_OVERHEAD = 4
+TOKEN_ESTIMATE_CACHE_SIZE = 4096
 MAX_REPLY_LENGTH = 1400
 TRUNCATED_REPLY_LENGTH = 1390
-
-# Bounded queue and worker threads to process API requests without unbounded threads
-API_TASK_QUEUE = queue.Queue(maxsize=API_QUEUE_MAXSIZE)
+# Output token cap per request mode, derived from what IRC will show: a reply is cut
+# at MAX_REPLY_LENGTH chars, at about REPLY_CHARS_PER_TOKEN chars per token, with
+# per-mode headroom for text the clean-up removes (citation markers and link markup
+# in search replies). REASONING_MODELS may count their reasoning against the cap,
+# so they get REPLY_REASONING_TOKENS more.
+REPLY_CHARS_PER_TOKEN = 3.5
+REPLY_TOKEN_HEADROOM = {'chat': 1.2, 'search': 1.5, 'time': 1.2, 'review': 1.2}
+REPLY_REASONING_TOKENS = 400
+REASONING_MODELS = ('grok-4-1-fast-reasoning', 'grok-4-fast-reasoning')
+
+# SQLite connection pool: long-lived connections shared by the handler and engine threads
+DB_POOL_SIZE = 5
+DB_BUSY_TIMEOUT = 5.0
+DB_MMAP_SIZE = 64 * 1024 * 1024
+DB_STATEMENT_CACHE = 256
+# Write-behind batching for conversation turns: commit every N rows or M seconds
+DB_WRITE_BATCH = 64
+DB_WRITE_INTERVAL = 0.05
+DB_WRITE_QUEUE_MAXSIZE = 10000
+# History retention (overridable in [grok]); enforced by prune_history in small batches
+RETENTION_KEEP_PER_NICK = 500
+RETENTION_INTERVAL = 600
+RETENTION_BATCH = 500
+RETENTION_MAX_BATCHES = 20
+RETENTION_PAUSE = 0.05
+VACUUM_STEP_PAGES = 512
+# Migration 5 converts a DB to auto_vacuum=INCREMENTAL only up to this many pages;
+# larger ones need vacuum_on_start, since the VACUUM blocks startup
+VACUUM_AUTO_MAX_PAGES = 2048
+# Stored history text compression (history_codec in [grok])
+CODEC_ZLIB_LEVEL = 6
+CODEC_ZSTD_LEVEL = 6
+ZSTD_DICT_SIZE = 16 * 1024
+ZSTD_DICT_SAMPLES = 5000
+ZSTD_DICT_MIN_SAMPLES = 500
+# Full-text channel log index (channel_index in [grok])
+CHANNEL_INDEX_DAYS = 30
+CHANNEL_INDEX_TOP_K = 12
+# Read-through cache of per-nick recent turns and prefs (overridable in [grok])
+DB_CACHE_SIZE = 1024
+# Relevance-ranked per-user history (history_retrieval in [grok]): the newest POOL
+# stored turns are scored against the question and the best K are sent
+HISTORY_RETRIEVAL_POOL = 200
+HISTORY_RETRIEVAL_K = 8
+HISTORY_RETRIEVAL_KEEP_LAST = 2
+HISTORY_HASH_BUCKETS = 1 << 14
+
+# Stored Responses API chains (response_chaining in [grok]): idle TTL, follow-ups per chain
+RESPONSE_CHAIN_IDLE = 3600
+RESPONSE_CHAIN_MAX_TURNS = 20
+
+# Caps for the per-key runtime maps (overridable in [grok], see GrokSection)
+HISTORY_MAX_CONVERSATIONS = 256
+HISTORY_IDLE_HOURS = 24
+STATE_MAX_KEYS = 4096
+EMOTE_MEMORY_SECONDS = 86400
+STATE_SWEEP_SECONDS = 60
+
+# Intent heuristics only look at this many chars (head, plus tail for end checks)
+HEURISTIC_MAX_LINE_LEN = 400
 
 # Emote reply mapping (used by both CTCP and secondary emote detection)
 EMOTE_REPLY_MAP = {
@@ -78,26 +196,6 @@ EMOTE_REPLY_MAP = {
 }
 
 
-def _api_worker_loop():
-    while True:
-        try:
-            task = API_TASK_QUEUE.get()
-            if task is None:
-                break
-            try:
-                _api_worker(*task)
-            except Exception:
-                logging.getLogger('Grok').exception('API worker loop task failed')
-            finally:
-                API_TASK_QUEUE.task_done()
-        except Exception:
-            logging.getLogger('Grok').exception('API worker loop crashed')
-
-
-# Start worker threads
-# Worker threads will be started after helper functions are defined (see bottom of file)
-
-
 class GrokSection(types.StaticSection):
     api_key = types.SecretAttribute('api_key')
     model = types.ChoiceAttribute(
@@ -121,6 +219,72 @@ class GrokSection(types.StaticSection):
         choices=['heuristic', 'off', 'model'],
         default='heuristic',
     )
+    # Regex engine for the intent heuristics: 'auto' uses RE2 when the optional
+    # google-re2 package is installed, 're2' warns if it is missing.
+    regex_engine = types.ChoiceAttribute(
+        'regex_engine',
+        choices=['auto', 're', 're2'],
+        default='auto',
+    )
+    # Caps for in-memory runtime state. Conversation logs idle for history_idle_hours
+    # (or least recently used past history_max_conversations) are dropped from memory,
+    # spilling to SQLite first when history_spill is on so they can be restored.
+    history_max_conversations = types.ValidatedAttribute(
+        'history_max_conversations', parse=int, default=HISTORY_MAX_CONVERSATIONS,
+    )
+    history_idle_hours = types.ValidatedAttribute('history_idle_hours', parse=float, default=HISTORY_IDLE_HOURS)
+    history_spill = types.BooleanAttribute('history_spill', default=True)
+    # Cap for each rate-limit / emote memory map
+    state_max_keys = types.ValidatedAttribute('state_max_keys', parse=int, default=STATE_MAX_KEYS)
+    # Retention for grok_user_history, enforced by a background job every 10 minutes:
+    # keep the newest history_keep_per_nick rows per nick (never fewer than 20), drop
+    # rows older than history_max_age_days, then the oldest rows while the DB holds
+    # more than history_max_db_mb of data. 0 disables the age / size limits.
+    history_keep_per_nick = types.ValidatedAttribute(
+        'history_keep_per_nick', parse=int, default=RETENTION_KEEP_PER_NICK,
+    )
+    history_max_age_days = types.ValidatedAttribute('history_max_age_days', parse=float, default=0)
+    history_max_db_mb = types.ValidatedAttribute('history_max_db_mb', parse=float, default=0)
+    # Needed for the retention job to shrink the DB file: convert a DB too large for
+    # migration 5 to auto_vacuum=INCREMENTAL with one VACUUM at the next startup
+    # (blocks startup for its duration and needs about the DB's size in free disk)
+    vacuum_on_start = types.BooleanAttribute('vacuum_on_start', default=False)
+    # Compression for newly stored history text. zstd needs the optional zstandard
+    # package (falls back to zlib) and trains a shared dictionary from stored history
+    # once enough rows exist. Each row records its codec, so switching is always safe.
+    history_codec = types.ChoiceAttribute('history_codec', choices=['none', 'zlib', 'zstd'], default='none')
+    # Persist channel lines (not PMs) to a full-text index kept for channel_index_days,
+    # so "who said ..." questions and questions naming a nick are answered from the
+    # best-matching lines instead of only the recent in-memory window.
+    channel_index = types.BooleanAttribute('channel_index', default=True)
+    channel_index_days = types.ValidatedAttribute('channel_index_days', parse=float, default=CHANNEL_INDEX_DAYS)
+    # Nicks whose recent turns / prefs are cached in memory; prewarm loads them for
+    # nicks seen joining or in NAMES, ahead of their first mention
+    db_cache_size = types.ValidatedAttribute('db_cache_size', parse=int, default=DB_CACHE_SIZE)
+    db_cache_prewarm = types.BooleanAttribute('db_cache_prewarm', default=False)
+    # Send the history_retrieval_k stored turns most relevant to the question (always
+    # including the last two) instead of the newest 20. Needs numpy, else recency.
+    history_retrieval = types.BooleanAttribute('history_retrieval', default=True)
+    history_retrieval_k = types.ValidatedAttribute('history_retrieval_k', parse=int, default=HISTORY_RETRIEVAL_K)
+    # Send PM requests through the Responses API and chain each PM conversation with
+    # previous_response_id: follow-ups carry only the new question and the volatile
+    # context, instead of the full history. Responses are stored by xAI.
+    response_chaining = types.BooleanAttribute('response_chaining', default=False)
+    # Base URL of the xAI API
+    api_base = types.ValidatedAttribute('api_base', default=API_BASE)
+    # Transport-level retries per API call (connect errors, 429/503), on top of the
+    # worker's own attempts; 0 disables
+    http_retries = types.ValidatedAttribute('http_retries', parse=int, default=HTTP_RETRIES)
+    # Open the API connections in the background at startup, then keep one alive with
+    # a cheap GET /models after http_keepalive idle seconds (0 disables the pings)
+    http_prewarm = types.BooleanAttribute('http_prewarm', default=True)
+    http_keepalive = types.ValidatedAttribute('http_keepalive', parse=float, default=HTTP_KEEPALIVE)
+    # Stream replies and send each IRC line as soon as it fills, instead of waiting
+    # for the whole reply (sanitizing and addressing still apply)
+    stream_replies = types.BooleanAttribute('stream_replies', default=True)
+    # API requests in flight at once (each waits on the network as a coroutine, not a
+    # thread); the HTTP connection pool is sized to match
+    api_concurrency = types.ValidatedAttribute('api_concurrency', parse=int, default=API_CONCURRENCY)
     # Optional list of nicknames (nicks) who are banned from using Grok via PM
     banned_nicks = types.ListAttribute('banned_nicks', default=[])
     # Optional list of nicknames to ignore entirely (other bots, automated scripts)
@@ -132,18 +296,38 @@ def setup(bot):
     if not bot.config.grok.api_key:
         raise types.ConfigurationError('Grok API key required in [grok] section')
 
+    engine = getattr(bot.config.grok, 'regex_engine', 'auto')
+    if engine == 're2' and re2 is None:
+        _log(bot).warning('regex_engine = re2 but google-re2 is not installed; using re')
+    _set_regex_engine(engine)
+    if numpy is None and getattr(bot.config.grok, 'history_retrieval', True):
+        _log(bot).info('numpy is not installed; sending recent history instead of relevance-ranked history')
+    bot.memory.pop('grok_nick_matcher', None)
+
     bot.memory['grok_headers'] = {
         "Authorization": f"Bearer {bot.config.grok.api_key}",
         "Content-Type": "application/json",
     }
-    # Per-conversation rolling history & last-response time
-    # Keys: (channel, nick) -> deque(["nick: text", ...])
-    # Older versions may have used channel-only keys; we tolerate both when clearing.
-    bot.memory['grok_history'] = {}
-    bot.memory['grok_last'] = {}      # channel → timestamp
-    # Locks for per-channel memory access
-    bot.memory['grok_locks'] = {}
-    bot.memory['grok_locks_lock'] = threading.Lock()
+    old = bot.memory.pop('grok_engine', None)
+    if old is not None:
+        old.close()
+    bot.memory.pop('grok_http', None)
+    concurrency = max(1, getattr(bot.config.grok, 'api_concurrency', None) or API_CONCURRENCY)
+    retries = getattr(bot.config.grok, 'http_retries', None)
+    retries = HTTP_RETRIES if retries is None else retries
+    if httpx is not None:
+        # httpx logs every request at INFO
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        http = _AsyncHTTPClient(concurrency, retries)
+    else:
+        _log(bot).info('httpx is not installed; API requests will each hold a thread while in flight')
+        http = _HTTPClient(concurrency, retries)
+    api = _APIEngine(concurrency, API_QUEUE_MAXSIZE, http)
+    bot.memory['grok_http'] = http
+    bot.memory['grok_engine'] = api
+    if getattr(bot.config.grok, 'http_prewarm', True):
+        api.spawn(_warm_http(bot, min(concurrency, HTTP_PREWARM_CONNECTIONS)))
+    _init_state(bot)
     # Initialize a small SQLite DB for optional persistent per-user history
     try:
         # Allow override via environment for deployments
@@ -159,6 +343,11 @@ def setup(bot):
         bot.memory['grok_db_path'] = db_path
         # Touch the DB (creates file and tables if missing)
         _init_db(bot)
+        # Conversations spilled by a previous run are restored on their next line
+        try:
+            bot.memory['grok_history'].mark_spilled(_db_spilled_keys(bot))
+        except Exception:
+            _log(bot).exception('Failed to load spilled Grok history keys')
         # Load persistent admin ignore list
         try:
             _load_admin_ignored_into_memory(bot)
@@ -166,12 +355,20 @@ def setup(bot):
             bot.memory['grok_admin_ignored'] = set()
     except Exception:
         _log(bot).exception('Failed to initialize Grok DB')
-    
-    # Start API worker threads
+
+
+def shutdown(bot):
+    # Stop the API engine (and its HTTP client) first, waiting for replies already
+    # being sent or recorded, so none is still writing when the DB closes
+    engine = bot.memory.pop('grok_engine', None)
+    bot.memory.pop('grok_http', None)
+    if engine is not None:
+        engine.close()
+    # Commit queued writes, then close the pooled SQLite connections
     try:
-        _start_api_workers()
+        _close_db(bot)
     except Exception:
-        _log(bot).exception('Failed to start API worker threads')
+        _log(bot).exception('Failed to close Grok DB connections')
 
 
 def send(bot, channel, text):
@@ -203,14 +400,475 @@ def send(bot, channel, text):
             time.sleep(delay)
 
 
+class _LogRecord:
+    """One line in a _ChannelLog."""
+
+    __slots__ = ('ts', 'nick', 'text')
+
+    def __init__(self, ts, nick, text):
+        self.ts = ts
+        self.nick = nick
+        self.text = text
+
+
+class _ChannelLog:
+    """Append-only ring buffer of recent lines for one channel or PM conversation.
+
+    Records live in a fixed-size list indexed by a running sequence number; once
+    the ring wraps, the oldest records are overwritten. Per-nick views are deques
+    of sequence numbers into the ring (a user's own lines plus the bot's replies
+    to them), so nothing is copied or re-parsed to answer either kind of query.
+
+    The rendered background block (the newest lines within BG_CHAR_BUDGET and
+    BG_MAX_LINES) is kept up to date as lines are appended, trimming old lines
+    from the front, so `background()` never walks the log; it only joins the
+    (at most BG_MAX_LINES) prepared lines once after they change.
+    Callers must hold `lock` (the conversation's channel lock).
+
+    `pins` counts the requests using the log; a pinned log is never evicted.
+    """
+
+    __slots__ = ('lock', 'pins', '_records', '_capacity', '_next', '_views', '_bg', '_bg_chars', '_bg_text')
+
+    def __init__(self, capacity=CHANNEL_LOG_SIZE):
+        self.lock = threading.Lock()
+        self.pins = 0
+        self._capacity = capacity
+        self._clear()
+
+    def _clear(self):
+        self._records = [None] * self._capacity
+        self._next = 0      # sequence number of the next record
+        self._views = {}    # nick.lower() -> deque of sequence numbers
+        self._bg = deque()  # rendered "nick: text" lines, oldest-first
+        self._bg_chars = 0
+        self._bg_text = ''
+
+    def pin(self):
+        """Keep the log from being evicted until the matching `unpin()`."""
+        with self.lock:
+            self.pins += 1
+
+    def unpin(self):
+        with self.lock:
+            self.pins -= 1
+
+    @property
+    def busy(self):
+        """True while the log is pinned or its lock is held."""
+        return self.pins > 0 or self.lock.locked()
+
+    def _get(self, seq):
+        if seq < 0 or self._next - seq > self._capacity:
+            return None
+        return self._records[seq % self._capacity]
+
+    def append(self, nick, text, view=None, ts=None, index=True):
+        """Append a line by `nick`, indexed under `view` (default: `nick`)."""
+        seq = self._next
+        rec = _LogRecord(ts or time.time(), sys.intern(nick), text)
+        self._records[seq % self._capacity] = rec
+        self._next = seq + 1
+        self._bg_push(rec)
+        if index:
+            key = (view or nick).lower()
+            seqs = self._views.get(key)
+            if seqs is None:
+                seqs = self._views[key] = deque(maxlen=MAX_HISTORY_ENTRIES)
+            seqs.append(seq)
+        return seq
+
+    def add_line(self, nick, text):
+        """Append a user line, coalescing it with the newest record if that is theirs."""
+        last = self._get(self._next - 1)
+        if last is not None and last.nick == nick and last.text:
+            merged = f"{last.text} / {text}"
+            # Keep the rendered "nick: text" line under 400 chars
+            if len(nick) + 2 + len(merged) > 400:
+                merged = merged[:388 - len(nick)] + " […]"
+            shrunk = len(merged) < len(last.text)
+            last.text = merged
+            last.ts = time.time()
+            if shrunk:
+                # Truncation made the line shorter, so older lines may fit again
+                self._bg_rebuild()
+            else:
+                if self._bg:
+                    self._bg_chars -= len(self._bg.pop()) + 1
+                self._bg_push(last)
+            return
+        self.append(nick, text)
+
+    def recent(self):
+        """Yield live records newest-first."""
+        seq = self._next - 1
+        stop = max(self._next - self._capacity, 0)
+        while seq >= stop:
+            rec = self._records[seq % self._capacity]
+            if rec is not None and rec.text:
+                yield rec
+            seq -= 1
+
+    def view(self, nick):
+        """Return the records indexed under `nick`, oldest-first."""
+        out = []
+        for seq in self._views.get(nick.lower(), ()):
+            rec = self._get(seq)
+            if rec is not None and rec.text:
+                out.append(rec)
+        return out
+
+    def nicks(self):
+        """Return the (case-folded) nicks with lines in this log."""
+        return list(self._views)
+
+    def drop_view(self, nick):
+        """Forget every record indexed under `nick`."""
+        for seq in self._views.pop(nick.lower(), ()):
+            if self._get(seq) is not None:
+                self._records[seq % self._capacity] = None
+        # Removed lines may have been in the middle of the block
+        self._bg_rebuild()
+
+    def _bg_rebuild(self):
+        self._bg.clear()
+        self._bg_chars = 0
+        for rec in self.recent():
+            line = f"{rec.nick}: {rec.text}"
+            if (self._bg and self._bg_chars + len(line) + 1 > BG_CHAR_BUDGET) or len(self._bg) >= BG_MAX_LINES:
+                break
+            self._bg.appendleft(line)
+            self._bg_chars += len(line) + 1
+        self._bg_text = None
+
+    def _bg_push(self, rec):
+        # Each line costs len("nick: text") + 1, i.e. len(nick) + len(text) + 3
+        line = f"{rec.nick}: {rec.text}"
+        self._bg.append(line)
+        self._bg_chars += len(line) + 1
+        while len(self._bg) > BG_MAX_LINES or (self._bg_chars > BG_CHAR_BUDGET and len(self._bg) > 1):
+            self._bg_chars -= len(self._bg.popleft()) + 1
+        self._bg_text = None
+
+    def background(self):
+        """Return the rendered background block (newest lines, chronological)."""
+        if self._bg_text is None:
+            # Joined at most once per change, on the first read after it
+            self._bg_text = '\n'.join(self._bg)
+        return self._bg_text
+
+    def background_lines(self):
+        """Return the background block's "nick: text" lines, chronological."""
+        return list(self._bg)
+
+    def export(self):
+        """Return live records oldest-first as (ts, nick, text, view) tuples.
+
+        `view` is the nick the record is indexed under, or None if it has aged
+        out of every per-nick view; `replay` restores both.
+        """
+        indexed = {}
+        for key, seqs in self._views.items():
+            for seq in seqs:
+                indexed[seq] = key
+        out = []
+        for seq in range(max(self._next - self._capacity, 0), self._next):
+            rec = self._records[seq % self._capacity]
+            if rec is not None and rec.text:
+                out.append((rec.ts, rec.nick, rec.text, indexed.get(seq)))
+        return out
+
+    def replay(self, rows):
+        """Append rows produced by `export`, keeping their timestamps and views."""
+        for ts, nick, text, view in rows:
+            self.append(nick, text, view=view, ts=ts, index=view is not None)
+
+    def prepend(self, rows):
+        """Put rows produced by `export`, all older than this log's, before its records."""
+        if not rows:
+            return
+        current = self.export()
+        self._clear()
+        self.replay(rows)
+        self.replay(current)
+
+
+class _BoundedMap:
+    """Thread-safe LRU map with a size cap and an optional idle TTL.
+
+    Reads and writes move an entry to the most-recently-used end; inserting past
+    `maxsize` evicts from the other end. Idle entries are only dropped by
+    `expire()` (run from the periodic sweep), so per-line lookups never scan.
+    `on_evict(key, value)` is called for both, outside the map's lock. Values
+    for which `keep(value)` is true are skipped by both (the map may then
+    briefly hold more than `maxsize`).
+    """
+
+    def __init__(self, maxsize, ttl=None, on_evict=None, keep=None):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.keep = keep
+        self.evicted = 0    # dropped by the size cap
+        self.expired = 0    # dropped by the idle TTL
+        self._data = OrderedDict()  # key -> [value, last_used]
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            item[1] = time.monotonic()
+            self._data.move_to_end(key)
+            return item[0]
+
+    def __getitem__(self, key):
+        with self._lock:
+            item = self._data[key]
+            item[1] = time.monotonic()
+            self._data.move_to_end(key)
+            return item[0]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = [value, time.monotonic()]
+            self._data.move_to_end(key)
+            dropped = self._trim()
+        self._dropped(dropped)
+
+    def setdefault(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                item[1] = time.monotonic()
+                self._data.move_to_end(key)
+                return item[0]
+            self._data[key] = [default, time.monotonic()]
+            dropped = self._trim()
+        self._dropped(dropped)
+        return default
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        """Return a snapshot of the keys, least recently used first."""
+        with self._lock:
+            return list(self._data)
+
+    def _trim(self):
+        dropped = []
+        if self.keep is None:
+            while len(self._data) > self.maxsize:
+                dropped.append(self._data.popitem(last=False))
+                self.evicted += 1
+            return dropped
+        excess = len(self._data) - self.maxsize
+        for key, item in self._data.items():
+            if len(dropped) >= excess:
+                break
+            if not self.keep(item[0]):
+                dropped.append((key, item))
+        for key, _ in dropped:
+            del self._data[key]
+        self.evicted += len(dropped)
+        return dropped
+
+    def expire(self):
+        """Drop entries unused for longer than `ttl`; return how many went."""
+        if not self.ttl:
+            return 0
+        cutoff = time.monotonic() - self.ttl
+        dropped = []
+        with self._lock:
+            # Entries are in last-used order, so stop at the first live one
+            for key, item in self._data.items():
+                if item[1] > cutoff:
+                    break
+                if self.keep is not None and self.keep(item[0]):
+                    continue
+                dropped.append((key, item))
+            for key, _ in dropped:
+                del self._data[key]
+            self.expired += len(dropped)
+        self._dropped(dropped)
+        return len(dropped)
+
+    def _dropped(self, dropped):
+        if self.on_evict is None:
+            return
+        for key, item in dropped:
+            try:
+                self.on_evict(key, item[0])
+            except Exception:
+                logging.getLogger('Grok').exception('Eviction callback failed for %r', key)
+
+
+class _HistoryStore:
+    """Conversation logs indexed by key: channel name or "PM:<nick>".
+
+    Keys are case-folded so "#Chan" and "#chan" share one log. Each _ChannelLog
+    holds that conversation's lock and per-nick index, so channel-scoped work
+    (context building, review mode, resets) only ever touches one channel's
+    entries, however many channels and nicks the bot has seen.
+
+    Logs live in a _BoundedMap; a busy log (pinned by a request, or locked) is
+    never evicted. When one is evicted and a `spill` callback is set, its records
+    are handed to it (queued for the SQLite spill table) and the next `log()` for
+    that key returns a new log at once, while a background thread puts the rows
+    from `restore` in front of it.
+    """
+
+    def __init__(self, maxsize=HISTORY_MAX_CONVERSATIONS, ttl=None, spill=None, restore=None, drop=None):
+        self._logs = _BoundedMap(maxsize, ttl, on_evict=self._evicted, keep=lambda log: log.busy)
+        # Reentrant: creating a log may evict (and spill) another one
+        self._lock = threading.RLock()
+        self._spill = spill
+        self._restore = restore
+        self._drop = drop
+        self._spilled = set()   # keys with rows waiting in the spill table
+        self.spilled = 0
+        self.restored = 0
+
+    def get(self, key):
+        """Return the log for `key`, or None."""
+        return self._logs.get(key.lower())
+
+    def log(self, key):
+        """Return the log for `key`, creating (or restoring) it if needed."""
+        k = key.lower()
+        log = self._logs.get(k)
+        if log is None:
+            with self._lock:
+                log = self._logs.get(k)
+                if log is None:
+                    log = _ChannelLog()
+                    if k in self._spilled and self._restore is not None:
+                        self._spilled.discard(k)
+                        # Pinned until the rows are back, so it cannot be spilled half-restored
+                        log.pins += 1
+                        threading.Thread(
+                            target=self._restore_into, args=(k, log), name='grok-history-restore', daemon=True,
+                        ).start()
+                    self._logs[k] = log
+        return log
+
+    def _restore_into(self, key, log):
+        try:
+            rows = self._restore(key)
+            with log.lock:
+                log.prepend(rows)
+            self.restored += 1
+        except Exception:
+            logging.getLogger('Grok').exception('Failed to restore history for %s', key)
+        finally:
+            log.unpin()
+
+    def pop(self, key):
+        """Forget the log for `key` (spilled rows included) and return it (or None)."""
+        k = key.lower()
+        with self._lock:
+            if k in self._spilled:
+                self._spilled.discard(k)
+                if self._drop is not None:
+                    self._drop(k)
+            return self._logs.pop(k)
+
+    def drop_view(self, key, nick):
+        """Forget `nick`'s lines (and replies to them) in `key`, spilled rows included."""
+        k = key.lower()
+        log = self._logs.get(k)
+        if log is not None:
+            with log.lock:
+                log.drop_view(nick)
+        if k in self._spilled and self._drop is not None:
+            self._drop(k, nick.lower())
+
+    def mark_spilled(self, keys):
+        """Register keys that already have rows in the spill table."""
+        with self._lock:
+            self._spilled.update(k.lower() for k in keys)
+
+    def expire(self):
+        return self._logs.expire()
+
+    def _evicted(self, key, log):
+        if self._spill is None:
+            return
+        with log.lock:
+            rows = log.export()
+        if not rows or not self._spill(key, rows):
+            return
+        with self._lock:
+            self._spilled.add(key)
+            self.spilled += 1
+
+    def stats(self):
+        m = self._logs
+        return (
+            f"history {len(m)}/{m.maxsize} evicted={m.evicted} expired={m.expired} "
+            f"spilled={self.spilled} restored={self.restored}"
+        )
+
+    def __len__(self):
+        return len(self._logs)
+
+
+# Bounded per-key runtime maps besides grok_history: memory key -> idle TTL (seconds)
+_STATE_MAPS = {
+    'grok_last': CHANNEL_RATE_LIMIT,          # channel -> last reply time
+    'grok_review_last': REVIEW_COOLDOWN,      # channel -> last review time
+    'grok_user_last': USER_SAFETY_SECONDS,    # (channel, nick) -> last reply time
+    'grok_emote_last': EMOTE_MEMORY_SECONDS,  # (nick, verb) -> last emote reply
+    'grok_chains': RESPONSE_CHAIN_IDLE,       # (conversation, nick) -> response chain
+}
+
+
+def _init_state(bot):
+    """Create the bounded history store and rate-limit / emote maps from config."""
+    cfg = bot.config.grok
+    max_convs = getattr(cfg, 'history_max_conversations', None) or HISTORY_MAX_CONVERSATIONS
+    idle_hours = getattr(cfg, 'history_idle_hours', None)
+    if idle_hours is None:
+        idle_hours = HISTORY_IDLE_HOURS
+    spill = getattr(cfg, 'history_spill', True)
+    bot.memory['grok_history'] = _HistoryStore(
+        max_convs,
+        ttl=idle_hours * 3600 if idle_hours > 0 else None,
+        spill=(lambda key, rows: _db_spill_history(bot, key, rows)) if spill else None,
+        restore=lambda key: _db_restore_history(bot, key),
+        drop=lambda key, view=None: _db_drop_spilled(bot, key, view),
+    )
+    max_keys = getattr(cfg, 'state_max_keys', None) or STATE_MAX_KEYS
+    for name, ttl in _STATE_MAPS.items():
+        bot.memory[name] = _BoundedMap(max_keys, ttl)
+
+
+@plugin.interval(STATE_SWEEP_SECONDS)
+def sweep_state(bot):
+    """Drop idle entries from the bounded runtime maps (spilling idle history)."""
+    for name in ('grok_history',) + tuple(_STATE_MAPS):
+        m = bot.memory.get(name)
+        if m is None:
+            continue
+        try:
+            m.expire()
+        except Exception:
+            _log(bot).exception('Failed to expire %s', name)
+
+
 def _get_channel_lock(bot, channel):
-    # Ensure a Lock exists for the channel
-    with bot.memory['grok_locks_lock']:
-        lock = bot.memory['grok_locks'].get(channel)
-        if lock is None:
-            lock = threading.Lock()
-            bot.memory['grok_locks'][channel] = lock
-        return lock
+    """Return the lock guarding `channel`'s history and rate-limit state."""
+    return bot.memory['grok_history'].log(channel).lock
 
 
 def _log(bot):
@@ -327,13 +985,58 @@ def _is_channel_op(bot, trigger):
     return False
 
 
-def _init_db(bot):
-    path = bot.memory.get('grok_db_path')
-    if not path:
+def _vacuum_to_incremental(conn, max_pages=VACUUM_AUTO_MAX_PAGES):
+    """Switch the DB to auto_vacuum=INCREMENTAL with one VACUUM (a no-op once done).
+
+    Skipped when the DB has more than max_pages pages (None: no limit). Returns
+    the seconds the VACUUM took, or None if it did not run.
+    """
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return None
+    if max_pages is not None and conn.execute('PRAGMA page_count').fetchone()[0] > max_pages:
+        return None
+    started = time.time()
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    return time.time() - started
+
+
+def _convert_to_incremental(bot, conn):
+    """Run the VACUUM migration 5 skipped on a large DB, when vacuum_on_start is set."""
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
         return
-    conn = sqlite3.connect(path)
-    c = conn.cursor()
-    c.execute('''
+    if not getattr(bot.config.grok, 'vacuum_on_start', False):
+        _log(bot).info(
+            'Grok DB is not in incremental auto_vacuum mode, so retention cannot shrink the file; '
+            'set vacuum_on_start to convert it with one VACUUM'
+        )
+        return
+    size_mb = os.path.getsize(bot.memory['grok_db_path']) / 1e6
+    _log(bot).info('Grok DB: running a one-time VACUUM of %.1f MB (needs about as much free disk again)', size_mb)
+    seconds = _vacuum_to_incremental(conn, max_pages=None)
+    _log(bot).info('Grok DB converted to incremental auto_vacuum (VACUUM took %.2fs)', seconds or 0.0)
+
+
+def _create_channel_index(conn):
+    """Create the FTS5 channel log index; False when SQLite was built without FTS5."""
+    try:
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS grok_channel_fts "
+            "USING fts5(nick, text, channel UNINDEXED, ts UNINDEXED, tokenize='porter unicode61')"
+        )
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+# Schema migrations, applied in order by _migrate. PRAGMA user_version records how
+# many have run. Append new steps; never edit or reorder applied ones. A step is a
+# tuple of SQL statements, or an idempotent function for work that cannot run inside
+# a transaction.
+_MIGRATIONS = [
+    # 1: base tables (IF NOT EXISTS, so databases from before versioning adopt them as is)
+    (
+        '''
         CREATE TABLE IF NOT EXISTS grok_user_history (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             nick TEXT NOT NULL,
@@ -342,53 +1045,632 @@ def _init_db(bot):
             text TEXT,
             ts TEXT
         )
-    ''')
-
-    c.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS grok_admin_ignored_nicks (
             nick TEXT PRIMARY KEY,
             added_by TEXT,
             ts TEXT
         )
-    ''')
-
-    c.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS grok_user_prefs (
             nick TEXT PRIMARY KEY,
             tz_iana TEXT,
             tz_label TEXT,
             time_fmt TEXT
         )
-    ''')
-    conn.commit()
-    conn.close()
+        ''',
+        # Conversation logs evicted from memory, restored on the conversation's next line
+        '''
+        CREATE TABLE IF NOT EXISTS grok_history_spill (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conv TEXT NOT NULL,
+            ts REAL,
+            nick TEXT,
+            text TEXT,
+            view TEXT
+        )
+        ''',
+    ),
+    # 2: per-nick history reads (_db_get_recent) and deletes (_db_clear_user)
+    ('CREATE INDEX IF NOT EXISTS grok_user_history_nick_id ON grok_user_history (nick, id)',),
+    # 3: channel-scoped history queries
+    ('CREATE INDEX IF NOT EXISTS grok_user_history_source_id ON grok_user_history (source, id)',),
+    # 4: spill restore/delete by conversation
+    ('CREATE INDEX IF NOT EXISTS grok_history_spill_conv_id ON grok_history_spill (conv, id)',),
+    # 5: let the retention job hand freed pages back with incremental_vacuum. The
+    # VACUUM this needs only runs here on a small DB; _init_db runs it on larger ones
+    # when vacuum_on_start is set.
+    _vacuum_to_incremental,
+    # 6: per-row text codec (0 = plain text, else grok_codecs.id) and the codec table
+    (
+        'ALTER TABLE grok_user_history ADD COLUMN codec INTEGER NOT NULL DEFAULT 0',
+        '''
+        CREATE TABLE IF NOT EXISTS grok_codecs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            dict BLOB,
+            created TEXT
+        )
+        ''',
+    ),
+    # 7: full-text index of channel lines (nick, text; channel and ts stored unindexed).
+    # Recorded even without FTS5, so later steps still run; _init_db creates the
+    # table on a later start once SQLite has FTS5.
+    _create_channel_index,
+]
 
 
-def _db_conn(bot):
+def _init_db(bot):
     path = bot.memory.get('grok_db_path')
     if not path:
+        return
+    _close_db(bot)
+    pool = bot.memory['grok_db_pool'] = _DBPool(path)
+    with pool.connection() as conn:
+        _migrate(bot, conn)
+        _convert_to_incremental(bot, conn)
+    bot.memory['grok_db_writer'] = _DBWriter(pool)
+    name = getattr(bot.config.grok, 'history_codec', None) or 'none'
+    if name == 'zstd' and zstandard is None:
+        _log(bot).warning('history_codec = zstd but zstandard is not installed; using zlib')
+        name = 'zlib'
+    with pool.connection() as conn:
+        bot.memory['grok_codec'] = _TextCodec(conn, name)
+        has_fts = _ensure_channel_index(bot, conn)
+    bot.memory['grok_channel_index'] = has_fts
+    bot.memory.setdefault('grok_channel_index_stats', {'indexed': 0, 'dropped': 0, 'searches': 0, 'hits': 0})
+    _train_codec(bot)
+    bot.memory['grok_db_cache'] = _DBCache(getattr(bot.config.grok, 'db_cache_size', None) or DB_CACHE_SIZE)
+
+
+def _ensure_channel_index(bot, conn):
+    """Return whether channel lines can be indexed, creating the FTS5 table if missing."""
+    if not getattr(bot.config.grok, 'channel_index', True):
+        return False
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'grok_channel_fts'").fetchone():
+        return True
+    if _create_channel_index(conn):
+        _log(bot).info('Created the channel log index')
+        return True
+    _log(bot).warning('SQLite has no FTS5 support; channel log search disabled')
+    return False
+
+
+def _close_db(bot):
+    """Flush and stop the writer thread, then close the pooled connections."""
+    bot.memory.pop('grok_db_cache', None)
+    writer = bot.memory.pop('grok_db_writer', None)
+    if writer is not None:
+        writer.close()
+    pool = bot.memory.pop('grok_db_pool', None)
+    if pool is not None:
+        pool.close()
+
+
+def _migrate(bot, conn):
+    """Bring the schema up to date, one short transaction per migration.
+
+    Each step and its user_version bump commit together, so an interrupted run
+    resumes where it stopped. With WAL, readers are not blocked while an index
+    builds; other writers wait at most one step (bounded by the busy timeout).
+    """
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for target in range(version + 1, len(_MIGRATIONS) + 1):
+        step = _MIGRATIONS[target - 1]
+        started = time.time()
+        if callable(step):
+            step(conn)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have migrated since we read the version
+            if conn.execute('PRAGMA user_version').fetchone()[0] >= target:
+                conn.rollback()
+                continue
+            if not callable(step):
+                for sql in step:
+                    conn.execute(sql)
+            conn.execute(f'PRAGMA user_version = {target}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        _log(bot).info('Grok DB migrated to schema version %d (%.2fs)', target, time.time() - started)
+
+
+class _TextCodec:
+    """Compresses stored history text and decodes rows written with any codec.
+
+    Every row records the codec it was written with: 0 for plain text, otherwise
+    the id of a grok_codecs row ('zlib', or 'zstd' with an optional trained
+    dictionary). Rows are only compressed when that makes them smaller, and
+    decoding never depends on the current `history_codec` setting.
+    """
+
+    def __init__(self, conn, name='none'):
+        self.name = name
+        self._lock = threading.Lock()
+        self._decoders = {}
+        self._encoder = None
+        self._encoder_id = 0
+        self._has_dict = False
+        for codec_id, codec_name, zdict in conn.execute('SELECT id, name, dict FROM grok_codecs'):
+            self._add_decoder(codec_id, codec_name, zdict)
+        if name == 'none':
+            return
+        # Use the newest matching codec (for zstd: the newest trained dictionary)
+        row = conn.execute(
+            'SELECT id, dict FROM grok_codecs WHERE name = ? ORDER BY dict IS NULL, id DESC LIMIT 1', (name,),
+        ).fetchone()
+        if row is None:
+            row = (self._register(conn, name, None), None)
+        self._use(row[0], name, row[1])
+
+    def _register(self, conn, name, zdict):
+        cur = conn.execute(
+            'INSERT INTO grok_codecs (name, dict, created) VALUES (?, ?, ?)',
+            (name, zdict, datetime.datetime.utcnow().isoformat()),
+        )
+        conn.commit()
+        self._add_decoder(cur.lastrowid, name, zdict)
+        return cur.lastrowid
+
+    def _add_decoder(self, codec_id, name, zdict):
+        if name == 'zlib':
+            self._decoders[codec_id] = zlib.decompress
+        elif name == 'zstd' and zstandard is not None:
+            d = zstandard.ZstdDecompressor(dict_data=zstandard.ZstdCompressionDict(zdict) if zdict else None)
+            self._decoders[codec_id] = d.decompress
+
+    def _use(self, codec_id, name, zdict):
+        if name == 'zlib':
+            encoder = lambda data: zlib.compress(data, CODEC_ZLIB_LEVEL)
+        else:
+            c = zstandard.ZstdCompressor(
+                level=CODEC_ZSTD_LEVEL,
+                dict_data=zstandard.ZstdCompressionDict(zdict) if zdict else None,
+                write_content_size=True,
+            )
+            encoder = c.compress
+        with self._lock:
+            self._encoder = encoder
+            self._encoder_id = codec_id
+            self._has_dict = zdict is not None
+
+    @property
+    def needs_dictionary(self):
+        """True while zstd is in use without a trained dictionary."""
+        return self.name == 'zstd' and not self._has_dict
+
+    def encode(self, text):
+        """Return (value, codec id) to store for `text`."""
+        if self._encoder is None:
+            return text, 0
+        raw = text.encode('utf-8')
+        # Compressor objects are not safe for concurrent use
+        with self._lock:
+            packed = self._encoder(raw)
+            codec_id = self._encoder_id
+        if len(packed) >= len(raw):
+            return text, 0
+        return packed, codec_id
+
+    def decode(self, value, codec_id):
+        if not codec_id:
+            return value
+        decoder = self._decoders.get(codec_id)
+        if decoder is None:
+            return '[compressed text unavailable]'
+        return decoder(value).decode('utf-8')
+
+    def train(self, conn):
+        """Train and switch to a zstd dictionary from recent stored text (zstd only)."""
+        samples = [
+            self.decode(text, codec).encode('utf-8')
+            for text, codec in conn.execute(
+                'SELECT text, codec FROM grok_user_history ORDER BY id DESC LIMIT ?', (ZSTD_DICT_SAMPLES,))
+        ]
+        if len(samples) < ZSTD_DICT_MIN_SAMPLES:
+            return False
+        zdict = zstandard.train_dictionary(ZSTD_DICT_SIZE, samples).as_bytes()
+        self._use(self._register(conn, 'zstd', zdict), 'zstd', zdict)
+        return True
+
+
+class _DBPool:
+    """Small pool of long-lived, tuned SQLite connections shared across threads.
+
+    Connections are opened lazily with WAL journaling, synchronous=NORMAL, a
+    memory map and a larger statement cache, and returned to the pool after each
+    use instead of being closed. Addressed lines are handled on short-lived
+    threads, so a pool (rather than one connection per thread) is what lets
+    them reuse connections. Bursts beyond `size` get extra connections that
+    are closed on return.
+    """
+
+    def __init__(self, path, size=DB_POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._open = set()
+        self._closed = False
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE,
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+        with self._lock:
+            self._open.add(conn)
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._open.discard(conn)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a connection; any transaction left open is rolled back on return."""
+        if self._closed:
+            raise RuntimeError('DB pool is closed')
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+                if self._closed:
+                    raise RuntimeError('DB pool is closed')
+                self._idle.put_nowait(conn)
+            except Exception:
+                self._discard(conn)
+
+    def close(self):
+        """Close every connection (borrowed ones are closed when returned)."""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+class _DBWriter:
+    """Dedicated thread that batches queued writes into one transaction.
+
+    `put(sql, params)` only enqueues. The thread collects up to `batch` items or
+    waits at most `interval` seconds after the first one, then runs consecutive
+    statements with the same SQL through executemany and commits once.
+    `flush()` blocks until everything queued before it is committed.
+    """
+
+    def __init__(self, pool, batch=DB_WRITE_BATCH, interval=DB_WRITE_INTERVAL):
+        self._pool = pool
+        self._batch = batch
+        self._interval = interval
+        self._queue = queue.Queue(maxsize=DB_WRITE_QUEUE_MAXSIZE)
+        self._lock = threading.Lock()
+        self.pending = 0        # queued but not yet committed
+        self.commits = 0
+        self.rows = 0
+        self.errors = 0
+        self.commit_seconds = 0.0
+        self.max_commit_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name='grok-db-writer', daemon=True)
+        self._thread.start()
+
+    def put(self, sql, params):
+        """Queue one write; returns False (nothing queued) if the queue is full."""
+        with self._lock:
+            self.pending += 1
+        try:
+            self._queue.put_nowait((sql, params))
+        except queue.Full:
+            with self._lock:
+                self.pending -= 1
+            return False
+        return True
+
+    def flush(self, timeout=5.0):
+        """Wait until every write queued so far is committed."""
+        if not self._thread.is_alive():
+            return False
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=5.0):
+        """Commit what is queued and stop the thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            deadline = time.monotonic() + self._interval
+            # Markers (flush events, the stop sentinel) end the batch early
+            while isinstance(item, tuple) and len(batch) < self._batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+            self._write(batch)
+            if batch[-1] is None:
+                return
+
+    def _write(self, batch):
+        writes = [item for item in batch if isinstance(item, tuple)]
+        if writes:
+            started = time.perf_counter()
+            try:
+                with self._pool.connection() as conn:
+                    for sql, group in itertools.groupby(writes, key=lambda w: w[0]):
+                        conn.executemany(sql, [params for _, params in group])
+                    conn.commit()
+            except Exception:
+                self.errors += 1
+                logging.getLogger('Grok').exception('Grok DB writer failed to commit %d rows', len(writes))
+            else:
+                elapsed = time.perf_counter() - started
+                self.commits += 1
+                self.rows += len(writes)
+                self.commit_seconds += elapsed
+                self.max_commit_seconds = max(self.max_commit_seconds, elapsed)
+            with self._lock:
+                self.pending -= len(writes)
+        for item in batch:
+            if isinstance(item, threading.Event):
+                item.set()
+
+    def stats(self):
+        avg_ms = self.commit_seconds / self.commits * 1e3 if self.commits else 0.0
+        return (
+            f"DB writer: queued={self.pending} commits={self.commits} rows={self.rows} errors={self.errors} "
+            f"commit avg={avg_ms:.2f}ms max={self.max_commit_seconds * 1e3:.2f}ms"
+        )
+
+
+class _DBCache:
+    """Read-through cache of each nick's recent turns and time preferences.
+
+    `turns` maps nick -> deque of the newest MAX_HISTORY_PER_USER (role, text)
+    rows, `vectors` maps nick -> _TurnIndex over the newest HISTORY_RETRIEVAL_POOL
+    rows, `prefs` maps nick -> prefs dict ({} when none are set). Writers update
+    them under `lock` in the same step as queueing the DB write, and misses load
+    under it, so a cached entry always matches what the DB will hold.
+    """
+
+    def __init__(self, maxsize=DB_CACHE_SIZE):
+        self.lock = threading.Lock()
+        self.turns = _BoundedMap(maxsize)
+        self.vectors = _BoundedMap(maxsize)
+        self.prefs = _BoundedMap(maxsize)
+        self.turn_hits = 0
+        self.turn_misses = 0
+        self.pref_hits = 0
+        self.pref_misses = 0
+        self.prewarmed = 0
+
+    def stats(self):
+        def rate(hits, misses):
+            total = hits + misses
+            return f"{hits}/{total} ({hits / total * 100:.1f}%)" if total else "0/0"
+        return (
+            f"DB cache: turns {rate(self.turn_hits, self.turn_misses)} "
+            f"prefs {rate(self.pref_hits, self.pref_misses)} "
+            f"size={len(self.turns)}/{len(self.prefs)} prewarmed={self.prewarmed}"
+        )
+
+
+_TERM_RE = re.compile(r'\w\w+')
+
+
+def _hash_terms(text):
+    """Return the sorted hash buckets of `text`'s terms and their counts."""
+    mask = HISTORY_HASH_BUCKETS - 1
+    ids = numpy.fromiter((hash(t) & mask for t in _TERM_RE.findall(text.lower())), dtype=numpy.int64)
+    return numpy.unique(ids, return_counts=True)
+
+
+class _TurnIndex:
+    """A nick's newest stored turns plus hashed term vectors, for relevance ranking.
+
+    Each row is (role, text, bucket ids, counts), hashed once when it is added. A
+    query is scored by TF-IDF cosine against every row at once: the rows' sparse
+    vectors are concatenated (cached until the next append) and reduced per row
+    with bincount, so there is no per-turn Python loop.
+    """
+
+    def __init__(self, rows, maxlen=HISTORY_RETRIEVAL_POOL):
+        self.rows = deque(maxlen=maxlen)
+        self._flat = None
+        for role, text in rows:
+            self.append(role, text)
+
+    def append(self, role, text):
+        ids, counts = _hash_terms(text)
+        self.rows.append((role, text, ids, counts))
+        self._flat = None
+
+    def _vectors(self):
+        if self._flat is None:
+            rows = self.rows
+            ids = numpy.concatenate([r[2] for r in rows])
+            counts = numpy.concatenate([r[3] for r in rows])
+            row_of = numpy.repeat(numpy.arange(len(rows)), [len(r[2]) for r in rows])
+            df = numpy.bincount(ids, minlength=HISTORY_HASH_BUCKETS)
+            idf = numpy.log((len(rows) + 1) / (df + 1)) + 1.0
+            weights = counts * idf[ids]
+            norms = numpy.sqrt(numpy.bincount(row_of, weights=weights * weights, minlength=len(rows)))
+            self._flat = (ids, row_of, weights, idf, norms)
+        return self._flat
+
+    def select(self, query, k, keep_last=HISTORY_RETRIEVAL_KEEP_LAST):
+        """Return up to k chronological (role, text) turns: the last keep_last plus the best matches."""
+        rows = self.rows
+        n = len(rows)
+        if n <= k:
+            return [(r[0], r[1]) for r in rows]
+        keep = set(range(n - min(keep_last, k), n))
+        q_ids, q_counts = _hash_terms(query)
+        if len(q_ids) and len(keep) < k:
+            ids, row_of, weights, idf, norms = self._vectors()
+            query_vec = numpy.zeros(HISTORY_HASH_BUCKETS)
+            query_vec[q_ids] = q_counts * idf[q_ids]
+            dots = numpy.bincount(row_of, weights=weights * query_vec[ids], minlength=n)
+            scores = numpy.divide(dots, norms, out=numpy.zeros(n), where=norms > 0)
+            scores[sorted(keep)] = 0
+            # Best first; ties go to the newer turn
+            for i in (n - 1 - numpy.argsort(-scores[::-1], kind='stable')).tolist():
+                if len(keep) >= k or scores[i] <= 0:
+                    break
+                keep.add(i)
+                # Keep a question and its answer together
+                partner = i + 1 if rows[i][0] == 'user' else i - 1
+                if len(keep) < k and 0 <= partner < n and rows[partner][0] != rows[i][0]:
+                    keep.add(partner)
+        return [(rows[i][0], rows[i][1]) for i in sorted(keep)]
+
+
+def _db_conn(bot):
+    """Return a context manager borrowing a pooled connection."""
+    pool = bot.memory.get('grok_db_pool')
+    if pool is None:
         raise RuntimeError('DB path not set')
-    return sqlite3.connect(path, check_same_thread=False)
+    return pool.connection()
+
+
+def _db_flush(bot, pending_only=False):
+    """Wait for queued writes to be committed (before deletes or reads that need them)."""
+    writer = bot.memory.get('grok_db_writer')
+    if writer is not None and (writer.pending or not pending_only):
+        writer.flush()
+
+
+_ADD_TURN_SQL = 'INSERT INTO grok_user_history (nick, source, role, text, ts, codec) VALUES (?, ?, ?, ?, ?, ?)'
 
 
 def _db_add_turn(bot, nick, role, text, source=None):
+    codec = bot.memory.get('grok_codec')
+    stored, codec_id = codec.encode(text) if codec is not None else (text, 0)
+    row = (nick.lower(), source or '', role, stored, datetime.datetime.utcnow().isoformat(), codec_id)
+    # Nicks the retention job should check (None: it has not done its first full scan)
+    prune = bot.memory.get('grok_prune_nicks')
+    if prune is not None:
+        prune.add(row[0])
+    cache = bot.memory.get('grok_db_cache')
+    if cache is None:
+        _db_write_turn(bot, row)
+        return
+    with cache.lock:
+        if _db_write_turn(bot, row):
+            turns = cache.turns.get(row[0])
+            if turns is not None:
+                turns.append((role, text))
+            index = cache.vectors.get(row[0])
+            if index is not None:
+                index.append(role, text)
+
+
+def _db_write_turn(bot, row):
+    # Normally handed to the writer thread; written inline only if it is missing or backed up
+    writer = bot.memory.get('grok_db_writer')
+    if writer is not None and writer.put(_ADD_TURN_SQL, row):
+        return True
     try:
-        conn = _db_conn(bot)
+        with _db_conn(bot) as conn:
+            conn.execute(_ADD_TURN_SQL, row)
+            conn.commit()
+        return True
+    except Exception:
+        _log(bot).exception('Failed to write grok DB entry')
+        return False
+
+
+_SPILL_SQL = 'INSERT INTO grok_history_spill (conv, ts, nick, text, view) VALUES (?, ?, ?, ?, ?)'
+
+
+def _db_spill_history(bot, conv, rows):
+    """Queue an evicted conversation log's (ts, nick, text, view) rows for the spill table.
+
+    Eviction happens on the dispatch path, so the rows go through the DB writer;
+    returns False if none could be queued.
+    """
+    writer = bot.memory.get('grok_db_writer')
+    if writer is None:
+        return False
+    queued = 0
+    for ts, nick, text, view in rows:
+        if writer.put(_SPILL_SQL, (conv, ts, nick, text, view)):
+            queued += 1
+    if queued < len(rows):
+        _log(bot).warning('DB writer backed up; dropped %d of %d history rows for %s', len(rows) - queued, len(rows), conv)
+    return queued > 0
+
+
+def _db_restore_history(bot, conv):
+    """Return and delete the spilled rows for `conv`, oldest first."""
+    # Rows spilled moments ago may still be queued in the writer
+    _db_flush(bot, pending_only=True)
+    with _db_conn(bot) as conn:
         c = conn.cursor()
-        c.execute(
-            'INSERT INTO grok_user_history (nick, source, role, text, ts) VALUES (?, ?, ?, ?, ?)',
-            (nick.lower(), source or '', role, text, datetime.datetime.utcnow().isoformat()),
-        )
+        c.execute('SELECT ts, nick, text, view FROM grok_history_spill WHERE conv = ? ORDER BY id', (conv,))
+        rows = c.fetchall()
+        c.execute('DELETE FROM grok_history_spill WHERE conv = ?', (conv,))
         conn.commit()
-        conn.close()
+        return rows
+
+
+def _db_drop_spilled(bot, conv, view=None):
+    """Delete spilled rows for `conv` (only those indexed under `view`, if given)."""
+    try:
+        _db_flush(bot, pending_only=True)
+        with _db_conn(bot) as conn:
+            if view is None:
+                conn.execute('DELETE FROM grok_history_spill WHERE conv = ?', (conv,))
+            else:
+                conn.execute('DELETE FROM grok_history_spill WHERE conv = ? AND view = ?', (conv, view))
+            conn.commit()
     except Exception:
-        _log(bot).exception('Failed to write grok DB entry')
+        _log(bot).exception('Failed to delete spilled grok history')
+
+
+def _db_spilled_keys(bot):
+    with _db_conn(bot) as conn:
+        return [r[0] for r in conn.execute('SELECT DISTINCT conv FROM grok_history_spill')]
+
+
+# Code fences, and 4+ lines of box drawing chars (also used by _ReplyStream)
+_CODE_FENCE_RE = re.compile(r'```.*?```', re.DOTALL)
+_ASCII_ART_CHARS = frozenset('╔═║╠╣╚╗╩╦╭╮╰╯┃━┏┓┗┛┣┫')
+_ASCII_ART_RE = re.compile(r'(?:[%s].*\n){4,}' % ''.join(sorted(_ASCII_ART_CHARS)), re.MULTILINE)
 
 
 def sanitize_reply(bot, trigger, reply):
     """Sanitize model reply: remove code, ascii art, large blocks, pings, and truncate."""
     # Remove code fences first (DOTALL to match newlines)
-    new_reply = re.sub(r'```.*?```', ' (code removed) ', reply, flags=re.DOTALL)
+    new_reply = _CODE_FENCE_RE.sub(' (code removed) ', reply)
     if new_reply != reply:
         try:
             _log(bot).info('Grok reply had code fences removed (nick=%s)', trigger.nick)
@@ -401,7 +1683,7 @@ def sanitize_reply(bot, trigger, reply):
     reply = new_reply
 
     # Suppress large ASCII art blocks (4+ lines of box drawing chars)
-    if re.search(r'(?:[╔═║╠╣╚╗╩╦╭╮╰╯┃━┏┓┗┛┣┫].*\n){4,}', reply, re.MULTILINE):
+    if _ASCII_ART_RE.search(reply):
         try:
             _log(bot).info('Grok reply contained ASCII art and was suppressed (nick=%s)', trigger.nick)
         except Exception:
@@ -425,6 +1707,25 @@ def sanitize_reply(bot, trigger, reply):
     return reply
 
 
+# Engine used by _linear_compile: 'auto', 're' or 're2' (set from config in setup)
+_REGEX_ENGINE = 'auto'
+
+
+def _linear_compile(pattern, flags=0):
+    """Compile an intent-heuristic regex, preferring RE2 for linear-time matching.
+
+    Falls back to `re` when RE2 is not installed, disabled via `regex_engine`, or
+    cannot handle the pattern. Only `search`/`match`/`span`/`group` are used on the
+    result, which both engines support. Note RE2's \\w and \\b are ASCII-only.
+    """
+    if re2 is not None and _REGEX_ENGINE != 're':
+        try:
+            return re2.compile(('(?i)' if flags & re.IGNORECASE else '') + pattern)
+        except Exception:
+            logging.getLogger('Grok').debug('RE2 rejected pattern, using re: %r', pattern)
+    return re.compile(pattern, flags)
+
+
 # Regex to detect queries that need live web search
 _SEARCH_INTENT_RE = re.compile(
     r'\b(search|news|latest|recent|today|yesterday|tonight|this week|this month|'
@@ -437,7 +1738,7 @@ _SEARCH_INTENT_RE = re.compile(
 # Regex to detect simple time/date queries — these bypass rate-limiting so
 # repeated asks always get a fresh, up-to-date answer.
 _TIME_INTENT_RE = re.compile(
-    r'\b(what(?:\s+is|s|\u2019s)?\s+(the\s+)?(time|date|day)|'
+    r'\b(what(?:\s+is|s|’s)?\s+(the\s+)?(time|date|day)|'
     r'current\s+(time|date)|what\s+time|what\s+day|today(?:\s+is|\s+date)?|'
     r'whats?\s+today|day\s+is\s+it|time\s+is\s+it|date\s+is\s+it)\b',
     re.IGNORECASE,
@@ -472,116 +1773,909 @@ _FMT_SET_RE = re.compile(
 )
 
 
-def _call_responses_api(bot, messages, model, temp, max_toks):
-    """Call the xAI Responses API (/v1/responses) with web search tool.
-
-    Converts chat-completions-style messages to Responses API format and
-    extracts the reply text from the response.
-
-    Returns (reply_text, citations_list) or raises on failure.
-    """
-    # The Responses API accepts 'input' as an array of messages (same format)
-    # and 'tools' for server-side tools like web_search.
-    # System messages go into 'instructions'.
-    instructions_parts = []
-    input_messages = []
-    for msg in messages:
-        if msg.get('role') == 'system':
-            instructions_parts.append(msg['content'])
-        else:
-            input_messages.append(msg)
+# Detect review/opinion requests ("thoughts?", "what do you think", "summarize", ...)
+_REVIEW_INTENT_RE = re.compile(
+    r"\b(thoughts?|opinion|what do you think|summarize|give (me )?(your )?(take|opinion)|opine)\b",
+    re.IGNORECASE,
+)
 
-    payload = {
-        "model": model,
-        "input": input_messages,
-        "tools": [{"type": "web_search"}],
-        "temperature": temp,
-        "max_output_tokens": max_toks,
+# Words that every match of the corresponding intent regex must contain. The
+# message is split into words once; only intents with an anchor word present are
+# confirmed with their full regex, so most messages never run the individual
+# intent regexes at all. Format preferences are anchored on words starting with
+# "12" or "24" ("12h", "24-hour").
+_INTENT_ANCHORS = {
+    'search': (
+        'search', 'news', 'latest', 'recent', 'today', 'yesterday', 'tonight', 'week',
+        'month', 'current', 'happening', 'headline', 'headlines', 'score', 'result',
+        'results', 'standing', 'standings', 'stock', 'weather', 'forecast', 'breaking',
+        'update', 'election', 'poll', 'won', 'died', 'winning', 'dead', 'happen',
+    ),
+    'time': ('time', 'date', 'day', 'today'),
+    'review': ('thought', 'thoughts', 'opinion', 'think', 'summarize', 'take', 'opine'),
+    'tz': tuple(k.lower() for k in _TZ_ABBR_MAP),
+}
+_INTENT_ANCHOR_KINDS = {}
+for _kind, _words in _INTENT_ANCHORS.items():
+    for _w in _words:
+        _INTENT_ANCHOR_KINDS.setdefault(_w, set()).add(_kind)
+del _kind, _words, _w
+_INTENT_WORD_RE = re.compile(r'\w+')
+
+
+def _build_intent_confirm():
+    """Compile the per-intent confirmation regexes with the current engine."""
+    sources = {
+        'search': _SEARCH_INTENT_RE,
+        'time': _TIME_INTENT_RE,
+        'review': _REVIEW_INTENT_RE,
+        'tz': _TZ_SET_RE,
+        'fmt': _FMT_SET_RE,
     }
-    if instructions_parts:
-        payload["instructions"] = " ".join(instructions_parts)
+    return {kind: _linear_compile(rx.pattern, rx.flags) for kind, rx in sources.items()}
 
-    r = requests.post(
-        "https://api.x.ai/v1/responses",
-        headers=bot.memory['grok_headers'],
-        json=payload,
-        timeout=(10, 120),
-    )
-    r.raise_for_status()
-    data = r.json()
 
-    # Parse the Responses API output format:
-    # data.output is an array; we look for type=="message" items
-    reply = ''
-    for item in (data.get('output') or []):
-        if item.get('type') == 'message' and item.get('role') == 'assistant':
-            for content_part in (item.get('content') or []):
-                if content_part.get('type') == 'output_text':
-                    reply += content_part.get('text', '')
+_INTENT_CONFIRM_RE = _build_intent_confirm()
 
-    # Extract citations if present (annotations or top-level)
-    citations = []
-    for item in (data.get('output') or []):
-        if item.get('type') == 'message':
-            for content_part in (item.get('content') or []):
-                for ann in (content_part.get('annotations') or []):
-                    url = ann.get('url')
-                    if url:
-                        citations.append(url)
 
-    return reply.strip(), citations
+def _set_regex_engine(engine):
+    """Switch the intent heuristics to `engine` ('auto', 're' or 're2')."""
+    global _REGEX_ENGINE, _INTENT_CONFIRM_RE
+    _REGEX_ENGINE = engine
+    _INTENT_CONFIRM_RE = _build_intent_confirm()
 
 
-def _call_chat_completions_api(bot, messages, model, temp, max_toks):
-    """Call the xAI Chat Completions API (/v1/chat/completions).
+class _Intent:
+    """Result of `_classify_intent` for one user message.
 
-    Returns (reply_text, None) or raises on failure.
+    search/time/review/command are booleans; tz is the IANA zone the user asked
+    to save (or None) and fmt is '12'/'24' (or None). spans maps each detected
+    intent to the (start, end) of its match in the message.
     """
-    payload = {
+
+    __slots__ = ('search', 'time', 'review', 'tz', 'fmt', 'command', 'spans')
+
+    def __init__(self):
+        self.search = False
+        self.time = False
+        self.review = False
+        self.tz = None
+        self.fmt = None
+        self.command = False
+        self.spans = {}
+
+
+def _classify_intent(text):
+    """Classify a user message with a single word scan (see _INTENT_ANCHORS)."""
+    intent = _Intent()
+    # Bot commands like ".help", "/whatever", "!foo"
+    if text[:1] in ('.', '!', '/'):
+        intent.command = True
+        intent.spans['command'] = (0, 1)
+    if text.strip() == '^^':
+        intent.review = True
+        intent.spans['review'] = (0, len(text))
+
+    kinds = set()
+    for word in _INTENT_WORD_RE.findall(text.lower()):
+        hit = _INTENT_ANCHOR_KINDS.get(word)
+        if hit:
+            kinds |= hit
+        elif word[:2] in ('12', '24'):
+            kinds.add('fmt')
+    if not kinds:
+        return intent
+
+    # Anchors are found on the full text; the (potentially backtracking) confirm
+    # regexes only ever see a bounded slice of it
+    capped = text[:HEURISTIC_MAX_LINE_LEN]
+    confirm = _INTENT_CONFIRM_RE
+    for kind in kinds:
+        m = confirm[kind].search(capped)
+        if not m:
+            continue
+        intent.spans[kind] = m.span()
+        if kind == 'tz':
+            intent.tz = _TZ_ABBR_MAP.get(m.group(1).upper())
+            if not intent.tz:
+                del intent.spans[kind]
+        elif kind == 'fmt':
+            raw = m.group(1).lower().replace(' ', '').replace('-', '')
+            intent.fmt = '12' if raw.startswith('12') else '24'
+        else:
+            setattr(intent, kind, True)
+    return intent
+
+
+async def _in_thread(fn, *args, **kwargs):
+    """Run blocking `fn` on the event loop's executor and await its result."""
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+
+class _HTTPClientBase:
+    """Request accounting shared by the HTTP clients (shown by $grokstats).
+
+    API calls are timed as cold (made on a socket opened for them, including when
+    the pool reconnects a connection the server closed) or warm (on a reused one);
+    `awarm()` opens or refreshes connections without being counted as calls.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.last_used = time.monotonic()
+        self.cold = 0
+        self.cold_seconds = 0.0
+        self.warm_requests = 0
+        self.warm_seconds = 0.0
+        self.keepalives = 0
+        self.prewarmed = 0
+        self.opened = 0
+        self._conns = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def _is_new_conn(self, conn):
+        # `conn` is whatever the transport replaces on reconnect (socket or stream)
+        if conn is None:
+            return False
+        with self._lock:
+            if conn in self._conns:
+                return False
+            self._conns.add(conn)
+            self.opened += 1
+            return True
+
+    def _count(self, elapsed, new, retries, track):
+        self.last_used = time.monotonic()
+        self.retries += retries
+        if track:
+            self.requests += 1
+            if new:
+                self.cold += 1
+                self.cold_seconds += elapsed
+            else:
+                self.warm_requests += 1
+                self.warm_seconds += elapsed
+
+    async def apost(self, url, **kwargs):
+        return await self.arequest('POST', url, **kwargs)
+
+    async def aget(self, url, **kwargs):
+        return await self.arequest('GET', url, **kwargs)
+
+    def stats(self):
+        reuse = (1 - self.cold / self.requests) * 100 if self.requests else 0.0
+        cold_ms = self.cold_seconds / self.cold * 1e3 if self.cold else 0.0
+        warm_ms = self.warm_seconds / self.warm_requests * 1e3 if self.warm_requests else 0.0
+        return (
+            f"HTTP: requests={self.requests} reuse={reuse:.1f}% cold={self.cold} avg {cold_ms:.0f}ms "
+            f"warm={self.warm_requests} avg {warm_ms:.0f}ms connections opened={self.opened} "
+            f"prewarmed={self.prewarmed} keepalives={self.keepalives} retries={self.retries}"
+        )
+
+
+class _HTTPClient(_HTTPClientBase):
+    """Keep-alive `requests` session, the API engine's client when httpx is missing.
+
+    The adapter keeps up to `pool_size` idle connections per host, so each request
+    reuses an open TLS connection instead of resolving and handshaking for every
+    call. urllib3's connection pool is thread-safe and the session holds no cookies
+    or other per-request state, so one instance serves all the engine's executor
+    threads, which is where the awaitable methods run each blocking call.
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, retries=HTTP_RETRIES):
+        super().__init__()
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                connect=retries,
+                read=0,
+                status=retries,
+                status_forcelist=HTTP_RETRY_STATUSES,
+                allowed_methods=None,
+                backoff_factor=HTTP_RETRY_BACKOFF,
+                raise_on_status=False,
+            ),
+        )
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+    def _is_new(self, r):
+        # Called from a response hook, while the response still holds its connection
+        return self._is_new_conn(getattr(getattr(r.raw, 'connection', None), 'sock', None))
+
+    def request(self, method, url, track=True, **kwargs):
+        new = []
+        kwargs['hooks'] = {'response': lambda r, *a, **kw: new.append(self._is_new(r))}
+        start = time.perf_counter()
+        r = self.session.request(method, url, **kwargs)
+        history = getattr(getattr(r.raw, 'retries', None), 'history', None)
+        self._count(time.perf_counter() - start, bool(new and new[0]), len(history or ()), track)
+        return r
+
+    async def arequest(self, method, url, **kwargs):
+        return await _in_thread(self.request, method, url, **kwargs)
+
+    @contextlib.asynccontextmanager
+    async def astream(self, method, url, **kwargs):
+        """Send a request and yield the response as soon as its headers arrive."""
+        r = await self.arequest(method, url, stream=True, **kwargs)
+        try:
+            yield _StreamedResponse(r)
+        finally:
+            r.close()
+
+    def warm(self, url, headers, count=1):
+        """Open (or refresh) `count` pooled connections with concurrent GETs to `url`."""
+        def ping():
+            try:
+                self.request('GET', url, track=False, headers=headers, timeout=HTTP_WARM_TIMEOUT).close()
+                return True
+            except Exception:
+                return False
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(ping()), daemon=True) for _ in range(count)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(sum(HTTP_WARM_TIMEOUT) + 1)
+        return sum(results)
+
+    async def awarm(self, url, headers, count=1):
+        return await _in_thread(self.warm, url, headers, count)
+
+    def close(self):
+        self.session.close()
+
+    async def aclose(self):
+        self.close()
+
+
+class _AsyncHTTPClient(_HTTPClientBase):
+    """httpx.AsyncClient counterpart of _HTTPClient, used when httpx is installed.
+
+    Same pooling, retries (connect errors, and 429/503 with backoff) and accounting,
+    but a request waiting on the API is a suspended coroutine on the engine's loop
+    rather than a blocked thread. Errors are raised as the matching `requests`
+    exceptions, so callers handle either client the same way.
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, retries=HTTP_RETRIES):
+        super().__init__()
+        self.max_retries = retries
+        self.client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                retries=retries,
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            ),
+        )
+
+    async def _send(self, method, url, timeout, stream, track, kwargs):
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        request = self.client.build_request(method, url, timeout=timeout, **kwargs)
+        start = time.perf_counter()
+        retried = 0
+        while True:
+            try:
+                r = await self.client.send(request, stream=stream)
+            except httpx.TimeoutException as exc:
+                raise requests.exceptions.Timeout(str(exc)) from exc
+            except httpx.TransportError as exc:
+                raise requests.exceptions.ConnectionError(str(exc)) from exc
+            if r.status_code not in HTTP_RETRY_STATUSES or retried >= self.max_retries:
+                break
+            await r.aclose()
+            # Same schedule as urllib3: retry at once, then back off (or as told)
+            delay = HTTP_RETRY_BACKOFF * 2 ** retried if retried else 0.0
+            after = r.headers.get('retry-after', '')
+            if after.isdigit():
+                delay = max(delay, float(after))
+            retried += 1
+            await asyncio.sleep(delay)
+        # A streamed request is timed to its headers, like requests with stream=True
+        new = self._is_new_conn(r.extensions.get('network_stream'))
+        self._count(time.perf_counter() - start, new, retried, track)
+        return r
+
+    async def arequest(self, method, url, track=True, timeout=None, **kwargs):
+        return _AsyncResponse(await self._send(method, url, timeout, False, track, kwargs))
+
+    @contextlib.asynccontextmanager
+    async def astream(self, method, url, timeout=None, **kwargs):
+        """Send a request and yield the response as soon as its headers arrive."""
+        r = await self._send(method, url, timeout, True, True, kwargs)
+        try:
+            if r.status_code >= 400:
+                # Read the error body, for callers that log exc.response.text
+                await r.aread()
+            yield _AsyncResponse(r)
+        finally:
+            await r.aclose()
+
+    async def awarm(self, url, headers, count=1):
+        """Open (or refresh) `count` pooled connections with concurrent GETs to `url`."""
+        async def ping():
+            try:
+                await self.arequest('GET', url, track=False, headers=headers, timeout=HTTP_WARM_TIMEOUT)
+                return True
+            except Exception:
+                return False
+        return sum(await asyncio.gather(*(ping() for _ in range(count))))
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class _AsyncResponse:
+    """The parts of a `requests` response the API calls use, over an httpx response."""
+
+    def __init__(self, response):
+        self.raw = response
+        self.status_code = response.status_code
+
+    @property
+    def text(self):
+        return self.raw.text
+
+    def json(self):
+        return self.raw.json()
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(
+                f'{self.status_code} Error: {self.raw.reason_phrase} for url: {self.raw.url}', response=self,
+            )
+
+    async def aiter_lines(self):
+        """Yield the lines of a streamed body as they arrive."""
+        try:
+            async for line in self.raw.aiter_lines():
+                yield line
+        except httpx.TimeoutException as exc:
+            raise requests.exceptions.Timeout(str(exc)) from exc
+        except httpx.TransportError as exc:
+            raise requests.exceptions.ConnectionError(str(exc)) from exc
+
+
+class _StreamedResponse:
+    """A streamed `requests` response whose lines are read on the engine's executor."""
+
+    def __init__(self, response):
+        self.raw = response
+        self.status_code = response.status_code
+        # Server-sent events are always UTF-8 (requests assumes Latin-1 for text/*)
+        response.encoding = 'utf-8'
+
+    @property
+    def text(self):
+        return self.raw.text
+
+    def raise_for_status(self):
+        self.raw.raise_for_status()
+
+    async def aiter_lines(self):
+        """Yield the lines of the body as they arrive."""
+        lines = self.raw.iter_lines(chunk_size=None, decode_unicode=True)
+        while True:
+            line = await _in_thread(next, lines, None)
+            if line is None:
+                return
+            yield line
+
+
+class _APIEngine:
+    """Event loop thread that runs the API requests as coroutines.
+
+    `submit()` schedules a request from any thread and returns at once. At most
+    `concurrency` requests hold a slot (an API call in flight) at a time; the rest
+    wait for one, and once `backlog` are waiting new submissions are refused.
+    Blocking work (IRC sends, SQLite) runs on the loop's executor via `_in_thread`,
+    so it never stalls the other requests.
+    """
+
+    def __init__(self, concurrency=API_CONCURRENCY, backlog=API_QUEUE_MAXSIZE, http=None):
+        self.concurrency = concurrency
+        self.backlog = backlog
+        self.http = http
+        self.pending = 0
+        self.in_flight = 0
+        self.peak = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.acquired = 0
+        self.wait_seconds = 0.0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=concurrency * 2, thread_name_prefix='grok-api',
+        )
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self._executor)
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='grok-api-loop', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        # Made on the loop's own thread (older Pythons bind it to the current loop)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self.loop.call_soon(self._ready.set)
+        self.loop.run_forever()
+
+    def submit(self, coro_fn, *args):
+        """Schedule `coro_fn(*args)` on the loop; returns False if the backlog is full."""
+        with self._lock:
+            if self._closed or self.pending >= self.concurrency + self.backlog:
+                self.rejected += 1
+                return False
+            self.pending += 1
+            self.submitted += 1
+        asyncio.run_coroutine_threadsafe(coro_fn(*args), self.loop).add_done_callback(self._done)
+        return True
+
+    def _done(self, future):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+        if not future.cancelled() and future.exception() is not None:
+            logging.getLogger('Grok').error('API engine task failed', exc_info=future.exception())
+
+    def spawn(self, coro):
+        """Schedule a background coroutine (not counted against the backlog)."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Run `coro` on the loop from another thread and return its result."""
+        return self.spawn(coro).result(timeout)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Hold one of the `concurrency` request slots for the duration of the block."""
+        start = time.perf_counter()
+        async with self._slots:
+            self.wait_seconds += time.perf_counter() - start
+            self.acquired += 1
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    def close(self, timeout=5.0):
+        """Cancel outstanding requests, close the HTTP client and stop the loop thread.
+
+        Cancelling a request does not stop blocking work it already handed to the
+        executor (sending or recording a reply), so that is waited for too, up to
+        `timeout` seconds.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+        async def stop():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.http is not None:
+                await self.http.aclose()
+
+        try:
+            self.run(stop(), timeout)
+        except Exception:
+            logging.getLogger('Grok').exception('API engine did not stop cleanly')
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        # shutdown() has no timeout of its own, so wait for it on a helper thread
+        waiter = threading.Thread(target=self._executor.shutdown, name='grok-api-shutdown', daemon=True)
+        waiter.start()
+        waiter.join(timeout)
+        if waiter.is_alive():
+            logging.getLogger('Grok').warning('API engine: blocking jobs still running after %.0fs', timeout)
+        if not self._thread.is_alive():
+            self.loop.close()
+
+    def stats(self):
+        wait_ms = self.wait_seconds / self.acquired * 1e3 if self.acquired else 0.0
+        backend = 'httpx' if isinstance(self.http, _AsyncHTTPClient) else 'requests'
+        return (
+            f"API engine: backend={backend} in flight={self.in_flight}/{self.concurrency} peak={self.peak} "
+            f"pending={self.pending} submitted={self.submitted} rejected={self.rejected} "
+            f"avg slot wait={wait_ms:.0f}ms"
+        )
+
+
+async def _warm_http(bot, count):
+    """Open `count` API connections ahead of the first request (spawned on the engine)."""
+    http = bot.memory.get('grok_http')
+    if http is None:
+        return
+    try:
+        http.prewarmed += await http.awarm(_api_url(bot, '/models'), bot.memory['grok_headers'], count)
+    except Exception:
+        _log(bot).exception('Failed to pre-warm API connections')
+
+
+@plugin.interval(HTTP_KEEPALIVE_CHECK)
+def keepalive_http(bot):
+    """Ping the API on an idle connection so the next reply does not pay for a handshake."""
+    engine = bot.memory.get('grok_engine')
+    http = bot.memory.get('grok_http')
+    idle = getattr(bot.config.grok, 'http_keepalive', None)
+    if idle is None:
+        idle = HTTP_KEEPALIVE
+    if engine is None or http is None or idle <= 0 or time.monotonic() - http.last_used < idle:
+        return
+    try:
+        warm = http.awarm(_api_url(bot, '/models'), bot.memory['grok_headers'])
+        http.keepalives += engine.run(warm, sum(HTTP_WARM_TIMEOUT) + 1)
+    except Exception:
+        _log(bot).exception('API keepalive failed')
+
+
+def _http(bot):
+    """Return the API engine's shared HTTP client."""
+    return bot.memory['grok_http']
+
+
+def _api_url(bot, path):
+    return (getattr(bot.config.grok, 'api_base', None) or API_BASE).rstrip('/') + path
+
+
+def _api_headers(bot, conv_id=None):
+    headers = bot.memory['grok_headers']
+    if conv_id:
+        # Routes requests sharing a prompt prefix to the same server, so they hit its cache
+        headers = dict(headers, **{'x-grok-conv-id': conv_id})
+    return headers
+
+
+def _prompt_cache_id(trigger, is_pm):
+    """Return a stable, opaque id for one nick's conversation (sent as x-grok-conv-id)."""
+    key = f"{_conversation_key(trigger, is_pm)}\0{trigger.nick}".lower()
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+
+def _record_usage(bot, data, seconds):
+    """Count prompt-cache hits from a response's usage block (either API's field names)."""
+    usage = data.get('usage') if isinstance(data, dict) else None
+    if not isinstance(usage, dict):
+        return
+    details = usage.get('prompt_tokens_details') or usage.get('input_tokens_details') or {}
+    prompt = usage.get('prompt_tokens') or usage.get('input_tokens') or 0
+    cached = details.get('cached_tokens') or 0
+    stats = bot.memory.setdefault('grok_cache_stats', {
+        'calls': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'output_tokens': 0,
+        'hit_calls': 0, 'hit_seconds': 0.0, 'miss_seconds': 0.0,
+    })
+    stats['calls'] += 1
+    stats['prompt_tokens'] += prompt
+    stats['cached_tokens'] += cached
+    stats['output_tokens'] += usage.get('completion_tokens') or usage.get('output_tokens') or 0
+    if cached:
+        stats['hit_calls'] += 1
+        stats['hit_seconds'] += seconds
+    else:
+        stats['miss_seconds'] += seconds
+
+
+async def _sse_events(response):
+    """Yield the JSON payload of each server-sent event in a streamed response."""
+    data = []
+    done = False
+    async for line in response.aiter_lines():
+        # After [DONE], read on to the end of the body so the connection is reusable
+        if done:
+            continue
+        if line.startswith('data:'):
+            data.append(line[6:] if line.startswith('data: ') else line[5:])
+        elif not line and data:
+            payload, data = '\n'.join(data), []
+            if payload == '[DONE]':
+                done = True
+                continue
+            yield json.loads(payload)
+
+
+async def _call_responses_api(bot, messages, model, temp, max_toks, conv_id=None, search=True, chain_key=None,
+                              stream=None):
+    """Call the xAI Responses API (/v1/responses), with the web search tool if `search`.
+
+    Converts chat-completions-style messages to Responses API format and
+    extracts the reply text from the response. With a `stream` (_ReplyStream) the
+    response is streamed, each text delta fed to it as it arrives.
+
+    With a `chain_key` (response_chaining, PMs only), the call continues that
+    conversation's stored response chain: it sends previous_response_id with only
+    the system messages that changed since the chain's last request and the new
+    question. A chain the API
+    rejects is dropped and the request resent in full, starting a new one.
+
+    Returns (reply_text, citations_list) or raises on failure.
+    """
+    # The Responses API accepts 'input' as an array of messages (same format)
+    # and 'tools' for server-side tools like web_search.
+    # The leading (static) system messages go into 'instructions'; later ones stay
+    # in place in 'input' so the volatile parts remain after the cacheable prefix.
+    # Chained calls keep them all in 'input': instructions are not carried over by
+    # previous_response_id, input messages are stored with the chain.
+    instructions_parts = []
+    input_messages = []
+    for msg in messages:
+        if msg.get('role') == 'system' and not input_messages and chain_key is None:
+            instructions_parts.append(msg['content'])
+        else:
+            input_messages.append(msg)
+
+    payload = {
+        "model": model,
+        "input": input_messages,
+        "temperature": temp,
+        "max_output_tokens": max_toks,
+    }
+    if search:
+        payload["tools"] = [{"type": "web_search"}]
+    if instructions_parts:
+        payload["instructions"] = " ".join(instructions_parts)
+
+    chains = bot.memory.get('grok_chains') if chain_key is not None else None
+    if chains is None:
+        data = await _post_responses(bot, payload, conv_id, stream)
+    else:
+        data = await _post_chained(bot, chains, chain_key, payload, conv_id, stream)
+
+    # Parse the Responses API output format:
+    # data.output is an array; we look for type=="message" items
+    reply = ''
+    for item in (data.get('output') or []):
+        if item.get('type') == 'message' and item.get('role') == 'assistant':
+            for content_part in (item.get('content') or []):
+                if content_part.get('type') == 'output_text':
+                    reply += content_part.get('text', '')
+
+    if data.get('status') == 'incomplete' and (data.get('incomplete_details') or {}).get('reason') == 'max_output_tokens':
+        _record_token_cap(bot, max_toks)
+
+    # Extract citations if present (annotations or top-level)
+    citations = []
+    for item in (data.get('output') or []):
+        if item.get('type') == 'message':
+            for content_part in (item.get('content') or []):
+                for ann in (content_part.get('annotations') or []):
+                    url = ann.get('url')
+                    if url:
+                        citations.append(url)
+
+    if stream is not None:
+        reply = stream.raw
+    return reply.strip(), citations
+
+
+async def _post_responses(bot, payload, conv_id, stream=None):
+    start = time.perf_counter()
+    if stream is None:
+        r = await _http(bot).apost(
+            _api_url(bot, '/responses'),
+            headers=_api_headers(bot, conv_id),
+            json=payload,
+            timeout=(10, 120),
+        )
+        r.raise_for_status()
+        data = r.json()
+    else:
+        # The final response object (id, output with citations, usage) comes with
+        # response.completed (or response.incomplete at the token cap); response.created
+        # already carries the id
+        data = {}
+        async with _http(bot).astream(
+            'POST',
+            _api_url(bot, '/responses'),
+            headers=_api_headers(bot, conv_id),
+            json=dict(payload, stream=True),
+            timeout=(10, 120),
+        ) as r:
+            r.raise_for_status()
+            async for event in _sse_events(r):
+                kind = event.get('type')
+                if kind == 'response.output_text.delta':
+                    if not await stream.feed(event.get('delta') or ''):
+                        break
+                elif isinstance(event.get('response'), dict) and kind in (
+                        'response.created', 'response.completed', 'response.incomplete'):
+                    data = event['response']
+    _record_usage(bot, data, time.perf_counter() - start)
+    return data
+
+
+async def _post_chained(bot, chains, chain_key, payload, conv_id, stream=None):
+    """Send `payload` as a follow-up in the key's response chain (or start one).
+
+    A chain remembers the system messages of its last request only (not every one
+    it has seen), so a follow-up resends the ones that changed and the question.
+    """
+    stats = bot.memory.setdefault('grok_chain_stats', {
+        'chained': 0, 'full': 0, 'resets': 0, 'bytes_sent': 0, 'bytes_full': 0,
+        'tokens_chained': 0, 'tokens_full': 0,
+    })
+    payload = dict(payload, store=True)
+    messages = payload['input']
+    full_bytes = len(json.dumps(payload))
+    chain = chains.get(chain_key)
+    if chain is not None and (chain['turns'] >= RESPONSE_CHAIN_MAX_TURNS or not messages or messages[-1].get('role') != 'user'):
+        chain = None
+    data = None
+    if chain is not None:
+        # Earlier turns are already in the chain; only new context and the question go
+        delta = [m for m in messages[:-1] if m.get('role') == 'system' and hash(m['content']) not in chain['seen']]
+        chained = dict(payload, input=delta + messages[-1:], previous_response_id=chain['id'])
+        try:
+            data = await _post_responses(bot, chained, conv_id, stream)
+        except requests.exceptions.HTTPError as exc:
+            status = exc.response.status_code if exc.response is not None else None
+            if status is None or not 400 <= status < 500:
+                raise
+            _log(bot).info('Response chain for %s rejected (HTTP %s); resending in full', chain_key, status)
+            chains.pop(chain_key)
+            stats['resets'] += 1
+            chain = None
+        else:
+            stats['chained'] += 1
+            stats['bytes_sent'] += len(json.dumps(chained))
+            stats['tokens_chained'] += (data.get('usage') or {}).get('input_tokens') or 0
+    if data is None:
+        data = await _post_responses(bot, payload, conv_id, stream)
+        stats['full'] += 1
+        stats['bytes_sent'] += full_bytes
+        stats['tokens_full'] += (data.get('usage') or {}).get('input_tokens') or 0
+    stats['bytes_full'] += full_bytes
+    if data.get('id') and data.get('status') == 'completed':
+        seen = {hash(m['content']) for m in messages if m.get('role') == 'system'}
+        chains[chain_key] = {'id': data['id'], 'seen': seen, 'turns': chain['turns'] + 1 if chain is not None else 0}
+    else:
+        # A stream cut off after response.created (or a capped reply) leaves no
+        # finished response to follow up on, so the next request goes in full
+        chains.pop(chain_key)
+    return data
+
+
+def _drop_chains(bot, conv, nick=None):
+    """Forget the response chains of a conversation (or of one nick in it)."""
+    chains = bot.memory.get('grok_chains')
+    if chains is None:
+        return
+    for key in chains.keys():
+        if key[0] == conv and (nick is None or key[1] == nick.lower()):
+            chains.pop(key)
+
+
+async def _call_chat_completions_api(bot, messages, model, temp, max_toks, conv_id=None, stream=None):
+    """Call the xAI Chat Completions API (/v1/chat/completions).
+
+    With a `stream` (_ReplyStream) the completion is streamed, each text delta fed
+    to it as it arrives.
+
+    Returns (reply_text, None) or raises on failure.
+    """
+    payload = {
         "model": model,
         "messages": messages,
         "temperature": temp,
         "max_tokens": max_toks,
     }
-    r = requests.post(
-        "https://api.x.ai/v1/chat/completions",
-        headers=bot.memory['grok_headers'],
+    start = time.perf_counter()
+    if stream is not None:
+        usage = {}
+        async with _http(bot).astream(
+            'POST',
+            _api_url(bot, '/chat/completions'),
+            headers=_api_headers(bot, conv_id),
+            json=dict(payload, stream=True, stream_options={"include_usage": True}),
+            timeout=(5, 90),
+        ) as r:
+            r.raise_for_status()
+            async for chunk in _sse_events(r):
+                # With include_usage the last chunk carries the usage block (and no choices)
+                usage = chunk if chunk.get('usage') else usage
+                choices = chunk.get('choices') or []
+                text = (choices[0].get('delta') or {}).get('content') if choices else None
+                if choices and choices[0].get('finish_reason') == 'length':
+                    _record_token_cap(bot, max_toks)
+                if text and not await stream.feed(text):
+                    break
+        _record_usage(bot, usage, time.perf_counter() - start)
+        return stream.raw.strip(), None
+
+    r = await _http(bot).apost(
+        _api_url(bot, '/chat/completions'),
+        headers=_api_headers(bot, conv_id),
         json=payload,
         timeout=(5, 90),
     )
     r.raise_for_status()
     data = r.json()
+    _record_usage(bot, data, time.perf_counter() - start)
 
     choices = (data.get('choices') if isinstance(data, dict) else []) or []
     if not choices:
         return '', None
+    if choices[0].get('finish_reason') == 'length':
+        _record_token_cap(bot, max_toks)
     reply = (choices[0].get('message', {}).get('content', '') or '').strip()
     return reply, None
 
 
-def _api_worker(bot, trigger, messages, review_mode, is_pm, bot_nick, chan_lock, search_mode=False):
-    """Background worker to call the API and send a reply without blocking the main handler."""
+def _reply_token_budget(mode, model):
+    """Output token cap for a reply in `mode`: what IRC will show of it, plus headroom."""
+    tokens = int(MAX_REPLY_LENGTH / REPLY_CHARS_PER_TOKEN * REPLY_TOKEN_HEADROOM[mode])
+    if model in REASONING_MODELS:
+        tokens += REPLY_REASONING_TOKENS
+    return tokens
+
+
+async def _api_worker(bot, trigger, messages, review_mode, is_pm, bot_nick, search_mode=False, mode='chat',
+                      history=None):
+    """Call the API for one addressed line on the API engine and send the reply.
+
+    Only the API call itself holds one of the engine's slots; retry backoff and the
+    (blocking) reply delivery happen outside it. With stream_replies the reply is
+    sent line by line while it streams in, so that part runs inside the slot.
+    `history` is the conversation log, pinned by the handler and unpinned here.
+    """
     try:
+        engine = bot.memory['grok_engine']
+        started = time.perf_counter()
+        streaming = getattr(bot.config.grok, 'stream_replies', True)
+        stream = None
         attempts = 3
         backoff = 1.0
         reply = None
         citations = None
         temp = 0.95 if not review_mode else 0.85
-        max_toks = 900 if not review_mode else 500
         model = bot.config.grok.model
+        max_toks = _reply_token_budget(mode, model)
+        conv_id = _prompt_cache_id(trigger, is_pm)
+        chain_key = None
+        # Only PMs are chained: a channel's context block changes with nearly every
+        # line, so a chain would store a new snapshot per turn and soon be billed for
+        # more input tokens than a full resend
+        if is_pm and getattr(bot.config.grok, 'response_chaining', False):
+            chain_key = (_conversation_key(trigger, is_pm), trigger.nick.lower())
+        use_responses = search_mode or chain_key is not None
 
         for attempt in range(1, attempts + 1):
+            # A failed attempt is only retried if its stream sent nothing, so start afresh
+            if streaming:
+                stream = _ReplyStream(bot, trigger, review_mode, bot_nick, started)
             try:
-                if search_mode:
-                    # Use the Responses API with web_search tool
-                    reply, citations = _call_responses_api(
-                        bot, messages, model, temp, max_toks,
-                    )
-                else:
-                    # Use the regular chat completions API
-                    reply, citations = _call_chat_completions_api(
-                        bot, messages, model, temp, max_toks,
-                    )
+                async with engine.slot():
+                    try:
+                        if use_responses:
+                            # Use the Responses API (with the web_search tool for search queries)
+                            reply, citations = await _call_responses_api(
+                                bot, messages, model, temp, max_toks, conv_id, search_mode, chain_key, stream,
+                            )
+                        else:
+                            # Use the regular chat completions API
+                            reply, citations = await _call_chat_completions_api(
+                                bot, messages, model, temp, max_toks, conv_id, stream,
+                            )
+                    except Exception:
+                        if stream is None or not stream.lines:
+                            raise
+                        # Part of the reply is already in the channel; end it there
+                        _log(bot).warning(
+                            'Reply stream to %s broke off after %d lines', trigger.sender, stream.lines, exc_info=True,
+                        )
+                        reply = stream.raw
                 break
             except requests.exceptions.Timeout:
                 try:
@@ -590,12 +2684,12 @@ def _api_worker(bot, trigger, messages, review_mode, is_pm, bot_nick, chan_lock,
                 except Exception:
                     pass
                 if attempt < attempts:
-                    time.sleep(backoff + random.random() * 0.5)
+                    await asyncio.sleep(backoff + random.random() * 0.5)
                     backoff *= 2
                 else:
                     _log(bot).exception('Grok API final attempt timed out')
                     try:
-                        bot.say("Grok is timing out right now; please try again later.", trigger.sender)
+                        await _in_thread(bot.say, "Grok is timing out right now; please try again later.", trigger.sender)
                     except Exception:
                         pass
                     return
@@ -611,20 +2705,23 @@ def _api_worker(bot, trigger, messages, review_mode, is_pm, bot_nick, chan_lock,
                 except Exception:
                     pass
                 # If search failed, fall back to chat completions without search
-                if search_mode:
+                if use_responses:
                     _log(bot).warning(
                         'Responses API failed (body=%s), falling back to chat completions',
                         resp_text,
                     )
-                    search_mode = False
+                    use_responses = search_mode = False
+                    # The chain will not include this exchange
+                    if chain_key is not None:
+                        bot.memory['grok_chains'].pop(chain_key)
                     continue
                 if attempt < attempts:
-                    time.sleep(backoff + random.random() * 0.5)
+                    await asyncio.sleep(backoff + random.random() * 0.5)
                     backoff *= 2
                 else:
                     _log(bot).exception('Grok API final attempt failed (HTTP error): %s', resp_text)
                     try:
-                        bot.say("Grok is having trouble right now; please try again later.", trigger.sender)
+                        await _in_thread(bot.say, "Grok is having trouble right now; please try again later.", trigger.sender)
                     except Exception:
                         pass
                     return
@@ -634,17 +2731,19 @@ def _api_worker(bot, trigger, messages, review_mode, is_pm, bot_nick, chan_lock,
                     metrics['errors'] = metrics.get('errors', 0) + 1
                 except Exception:
                     pass
-                if search_mode:
+                if use_responses:
                     _log(bot).warning('Responses API exception, falling back to chat completions')
-                    search_mode = False
+                    use_responses = search_mode = False
+                    if chain_key is not None:
+                        bot.memory['grok_chains'].pop(chain_key)
                     continue
                 if attempt < attempts:
-                    time.sleep(backoff + random.random() * 0.5)
+                    await asyncio.sleep(backoff + random.random() * 0.5)
                     backoff *= 2
                 else:
                     _log(bot).exception('Grok API final attempt failed')
                     try:
-                        bot.say("Grok is timing out right now; please try again later.", trigger.sender)
+                        await _in_thread(bot.say, "Grok is timing out right now; please try again later.", trigger.sender)
                     except Exception:
                         pass
                     return
@@ -652,96 +2751,396 @@ def _api_worker(bot, trigger, messages, review_mode, is_pm, bot_nick, chan_lock,
         if not reply:
             _log(bot).warning('Grok API returned empty reply')
             return
+        if stream is not None:
+            reply = await stream.finish()
+            if reply:
+                await _in_thread(_record_reply, bot, trigger, reply, is_pm, bot_nick)
+            return
+        await _in_thread(_deliver_reply, bot, trigger, reply, review_mode, is_pm, bot_nick, started)
 
-        # Sanitization
-        reply = sanitize_reply(bot, trigger, reply)
+    except Exception:
+        _log(bot).exception('Grok API worker failed for %s', trigger.sender)
+    finally:
+        if history is not None:
+            history.unpin()
 
-        # Remove newlines to prevent multi-line responses (IRC doesn't support them)
-        # Replace with space to maintain readability
-        reply = ' '.join(line.strip() for line in reply.splitlines() if line.strip())
 
-        # Strip citation markers like [1], [2] etc from the reply text
-        reply = re.sub(r'\s*\[\d+\]', '', reply)
+def _clean_reply(bot, trigger, reply):
+    """Sanitize API reply text and make it one line without citation markers."""
+    # Sanitization
+    reply = sanitize_reply(bot, trigger, reply)
 
-        # Per-user safety: avoid sending if user spoke very recently
-        try:
-            user_last = bot.memory.setdefault('grok_user_last', {}).setdefault(trigger.sender, {})
-            last_user = user_last.get(trigger.nick, 0)
-            if time.time() - last_user < USER_SAFETY_SECONDS:
-                return
-            user_last[trigger.nick] = time.time()
-        except Exception:
-            pass
+    # Remove newlines to prevent multi-line responses (IRC doesn't support them)
+    # Replace with space to maintain readability
+    reply = ' '.join(line.strip() for line in reply.splitlines() if line.strip())
 
-        if review_mode:
-            prefixes = ["Hmm...", "TBH,", "I'd say:", "Quick thought:", "Short take:"]
-            pref = random.choice(prefixes)
-            reply = f"{pref} {reply}"
+    # Strip citation markers like [1], [2] etc from the reply text
+    return re.sub(r'\s*\[\d+\]', '', reply)
 
-        try:
-            reply = re.sub(rf'^\s*{re.escape(bot_nick)}[,:>\s]+', '', reply, flags=re.IGNORECASE)
-        except Exception:
-            pass
 
-        if trigger.nick.lower() not in reply.lower() and not _is_owner(bot, trigger):
-            final_reply = f"{trigger.nick}: {reply}"
-        else:
-            final_reply = reply
+def _address_reply(bot, trigger, reply, review_mode, bot_nick):
+    """Return (text to send, text to record) for a cleaned reply, or None to drop it."""
+    # Per-user safety: avoid sending if user spoke very recently
+    try:
+        user_last = bot.memory['grok_user_last']
+        last_user = user_last.get((trigger.sender, trigger.nick), 0)
+        if time.time() - last_user < USER_SAFETY_SECONDS:
+            return None
+        user_last[(trigger.sender, trigger.nick)] = time.time()
+    except Exception:
+        pass
 
-        send(bot, trigger.sender, final_reply)
+    if review_mode:
+        prefixes = ["Hmm...", "TBH,", "I'd say:", "Quick thought:", "Short take:"]
+        pref = random.choice(prefixes)
+        reply = f"{pref} {reply}"
 
-        # Append to history and DB under lock
-        try:
-            with chan_lock:
-                per_conv_key = ("PM", trigger.nick.lower()) if is_pm else (trigger.sender, trigger.nick)
-                history = bot.memory['grok_history'].setdefault(per_conv_key, deque(maxlen=50))
-                history.append(f"{bot_nick}: {reply}")
-        except Exception:
-            pass
-        try:
-            _db_add_turn(bot, trigger.nick, 'assistant', reply, 'PM' if is_pm else trigger.sender)
-        except Exception:
-            pass
+    try:
+        matcher = _nick_matcher(bot)
+        if matcher.nick != bot_nick:
+            # Nick changed while the request was in flight; strip the nick we used
+            matcher = _NickMatcher(bot_nick)
+        reply = matcher.address_prefix.sub('', reply, count=1)
+    except Exception:
+        pass
+
+    if trigger.nick.lower() not in reply.lower() and not _is_owner(bot, trigger):
+        return f"{trigger.nick}: {reply}", reply
+    return reply, reply
 
+
+def _record_reply(bot, trigger, reply, is_pm, bot_nick):
+    """Add a sent reply to the conversation log and the DB.
+
+    Replies are not added to the channel index: recall searches what people said,
+    and feeding the bot's own answers back as search results would repeat its mistakes.
+    """
+    # Append to history and DB under lock
+    try:
+        log = bot.memory['grok_history'].log(_conversation_key(trigger, is_pm))
+        with log.lock:
+            log.append(bot_nick, reply, view=trigger.nick)
     except Exception:
-        _log(bot).exception('Grok API worker failed for %s', trigger.sender)
+        pass
+    try:
+        _db_add_turn(bot, trigger.nick, 'assistant', reply, 'PM' if is_pm else trigger.sender)
+    except Exception:
+        pass
+
+
+def _record_reply_stats(bot, streamed, first_line, last_line):
+    """Count a delivered reply and the seconds from pickup to its first and last line."""
+    stats = bot.memory.setdefault('grok_reply_stats', {
+        'streamed': 0, 'streamed_first': 0.0, 'streamed_last': 0.0,
+        'buffered': 0, 'buffered_first': 0.0, 'buffered_last': 0.0,
+    })
+    kind = 'streamed' if streamed else 'buffered'
+    stats[kind] += 1
+    stats[kind + '_first'] += first_line
+    stats[kind + '_last'] += last_line
 
 
+def _output_stats(bot):
+    return bot.memory.setdefault('grok_output_stats', {
+        'replies': 0, 'tokens': 0, 'discarded': 0, 'stopped': 0, 'capped': 0,
+    })
+
+
+def _record_output_stats(bot, raw, shown, stopped=False):
+    """Count the tokens of a delivered reply that were generated but never shown.
+
+    Both counts are local estimates (_estimate_tokens) of the text received and the
+    cleaned text sent; `stopped` marks a stream closed once IRC could show no more.
+    """
+    stats = _output_stats(bot)
+    generated = _estimate_tokens(raw)
+    stats['replies'] += 1
+    stats['tokens'] += generated
+    stats['discarded'] += max(generated - _estimate_tokens(shown), 0)
+    if stopped:
+        stats['stopped'] += 1
+
+
+def _record_token_cap(bot, max_toks):
+    """Count a reply the API ended at the output token cap."""
+    _output_stats(bot)['capped'] += 1
+    _log(bot).info('Grok reply hit the output token cap (%d)', max_toks)
+
+
+def _deliver_reply(bot, trigger, reply, review_mode, is_pm, bot_nick, started):
+    """Clean up an API reply, send it and record it (blocking; runs on the engine's executor)."""
+    cleaned = _clean_reply(bot, trigger, reply)
+    addressed = _address_reply(bot, trigger, cleaned, review_mode, bot_nick)
+    if addressed is None:
+        return
+    _record_output_stats(bot, reply, cleaned)
+    final_reply, reply = addressed
+    first_line = time.perf_counter() - started
+    send(bot, trigger.sender, final_reply)
+    _record_reply_stats(bot, False, first_line, time.perf_counter() - started)
+    _record_reply(bot, trigger, reply, is_pm, bot_nick)
+
+
+# A cut point in streamed text: whitespace before a word that is not (or may not
+# yet be) a citation marker
+_STREAM_CUT_RE = re.compile(r'\s+(?=[^\s\[]|\[(?!\d*(?:\]|$)))')
+
+
+class _ReplyStream:
+    """Send a reply to IRC line by line while the API is still streaming it.
+
+    Text deltas are settled at whitespace, holding back an open code fence, a run of
+    box-drawing lines and a possible citation marker. Each settled segment gets the
+    same clean-up as a whole reply; its words are packed into MAX_SEND_LEN lines like
+    send() does, and a line goes out as soon as the next word no longer fits. The
+    first line is addressed like a buffered reply, judged on the text it holds.
+
+    `feed()` returns False once no more text is wanted: the reply was dropped (its
+    nick spoke again), cut at MAX_REPLY_LENGTH, or ASCII art was suppressed. Art
+    found before the first line went out replaces the reply with sanitize_reply's
+    notice, as when buffered; found later, the lines before it are sent and the
+    notice follows on a line of its own, not recorded as part of the reply.
+    """
+
+    def __init__(self, bot, trigger, review_mode, bot_nick, started):
+        self.bot = bot
+        self.trigger = trigger
+        self.review_mode = review_mode
+        self.bot_nick = bot_nick
+        self.started = started
+        self.raw = ''
+        self.lines = 0
+        self.closed = False
+        self._pending = ''
+        self._clean = ''
+        self._taken = 0
+        self._words = []
+        self._record = []
+        self._addressed = False
+        self._first_line = None
+        self._last_send = 0.0
+        self._notice = None
+
+    async def feed(self, text):
+        """Take the next delta of reply text and send any lines it completes."""
+        if self.closed:
+            return False
+        self.raw += text
+        self._pending += text
+        cut = self._settled_end(self._pending)
+        if cut:
+            self._settle(self._pending[:cut])
+            self._pending = self._pending[cut:]
+        await self._send(self._take_lines(final=False))
+        return not self.closed
+
+    async def finish(self):
+        """Send what is left once the API stream has ended; returns the text to record."""
+        stopped = self.closed
+        self._settle('' if self.closed else self._pending, final=True)
+        self._pending = ''
+        self.closed = True
+        await self._send(self._take_lines(final=True))
+        if self._notice is not None:
+            await self._send([self._notice])
+        if self.lines:
+            _record_reply_stats(self.bot, True, self._first_line, time.perf_counter() - self.started)
+            _record_output_stats(self.bot, self.raw, self._clean, stopped)
+        return ' '.join(self._record)
+
+    @staticmethod
+    def _settled_end(text):
+        # A code fence may still be removed as a whole: never cut inside one, and
+        # hold back an unclosed one
+        fences = [m.span() for m in _CODE_FENCE_RE.finditer(text)]
+        limit = text.find('```', fences[-1][1] if fences else 0)
+        if limit < 0:
+            limit = len(text)
+        # A trailing run of box-drawing lines may still become suppressed ASCII art
+        # (the unfinished last line belongs to the run while the line before it does);
+        # once four are complete, settle through them so the art is caught whole
+        lines = text[:limit].split('\n')
+        run = 0
+        for line in reversed(lines[:-1]):
+            if not _ASCII_ART_CHARS.intersection(line):
+                break
+            run += 1
+        if run >= 4:
+            return limit - len(lines[-1])
+        if run or _ASCII_ART_CHARS.intersection(lines[-1]):
+            limit -= sum(len(line) + 1 for line in lines[len(lines) - run - 1:]) - 1
+        for m in reversed(list(_STREAM_CUT_RE.finditer(text, 0, limit))):
+            if not any(start < m.start() < end for start, end in fences):
+                return m.start()
+        return 0
+
+    def _settle(self, text, final=False):
+        if text.strip() and _ASCII_ART_RE.search(text):
+            self.closed = True
+            notice = _clean_reply(self.bot, self.trigger, text)
+            if self._addressed:
+                self._notice = notice
+            else:
+                # Nothing sent yet: the notice is the whole reply
+                self._clean, self._taken, self._words = notice, 0, []
+            text = ''
+        if text.strip():
+            cleaned = _clean_reply(self.bot, self.trigger, text)
+            if cleaned:
+                self._clean = f'{self._clean} {cleaned}' if self._clean else cleaned
+        # Words past TRUNCATED_REPLY_LENGTH wait until it is known whether the reply
+        # ends within MAX_REPLY_LENGTH or gets cut there, as in sanitize_reply
+        end = len(self._clean)
+        if end > MAX_REPLY_LENGTH:
+            try:
+                _log(self.bot).info('Grok reply truncated (len>%d, nick=%s)', MAX_REPLY_LENGTH, self.trigger.nick)
+            except Exception:
+                pass
+            self._clean = self._clean[:TRUNCATED_REPLY_LENGTH] + " […]"
+            end = len(self._clean)
+            self.closed = True
+        elif end > TRUNCATED_REPLY_LENGTH and not final:
+            end = max(self._clean.rfind(' ', 0, TRUNCATED_REPLY_LENGTH + 1), self._taken)
+        words = self._clean[self._taken:end].split()
+        self._taken = end
+        self._words.extend(words)
+        if self._addressed:
+            self._record.extend(words)
+
+    def _take_lines(self, final):
+        lines = []
+        if not self._addressed:
+            # Address the reply once its first line is full (or it is complete)
+            text = ' '.join(self._words)
+            if not text or (not final and len(text) <= MAX_SEND_LEN):
+                return lines
+            self._addressed = True
+            addressed = _address_reply(self.bot, self.trigger, text, self.review_mode, self.bot_nick)
+            if addressed is None:
+                self.closed = True
+                self._words = []
+                return lines
+            self._words = addressed[0].split()
+            self._record = addressed[1].split()
+        while self._words:
+            line, n = self._words[0], 1
+            while n < len(self._words) and len(line) + 1 + len(self._words[n]) <= MAX_SEND_LEN:
+                line = line + ' ' + self._words[n]
+                n += 1
+            if n == len(self._words) and not final:
+                # The next word may still fit on this line
+                break
+            lines.append(line)
+            del self._words[:n]
+        return lines
+
+    async def _send(self, lines):
+        for line in lines:
+            # Same spacing as send(), but only waited out if the lines come faster
+            wait = self._last_send + SEND_DELAY - time.monotonic()
+            if self.lines and wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                await _in_thread(self.bot.say, line, self.trigger.sender)
+            except Exception:
+                _log(self.bot).exception('Failed sending part to %s', self.trigger.sender)
+            self._last_send = time.monotonic()
+            if not self.lines:
+                self._first_line = time.perf_counter() - self.started
+            self.lines += 1
+
 
 def _db_get_recent(bot, nick, limit=MAX_HISTORY_PER_USER):
+    key = nick.lower()
+    cache = bot.memory.get('grok_db_cache')
     try:
-        conn = _db_conn(bot)
-        c = conn.cursor()
-        c.execute(
-            'SELECT role, text FROM grok_user_history WHERE nick = ? ORDER BY id DESC LIMIT ?',
-            (nick.lower(), limit),
-        )
-        rows = c.fetchall()
-        conn.close()
-        # rows are newest-first; return chronological (oldest-first)
-        return list(reversed([(r[0], r[1]) for r in rows]))
+        if cache is None or limit > MAX_HISTORY_PER_USER:
+            _db_flush(bot, pending_only=True)
+            return _db_read_recent(bot, key, limit)
+        with cache.lock:
+            turns = cache.turns.get(key)
+            if turns is None:
+                cache.turn_misses += 1
+                # Queued turns must be in the DB before we load (and cache) its view
+                _db_flush(bot, pending_only=True)
+                turns = deque(_db_read_recent(bot, key, MAX_HISTORY_PER_USER), maxlen=MAX_HISTORY_PER_USER)
+                cache.turns[key] = turns
+            else:
+                cache.turn_hits += 1
+            return list(turns)[-limit:] if limit > 0 else []
     except Exception:
         return []
 
 
-def _db_clear_user(bot, nick):
+def _db_select_turns(bot, nick, question):
+    """Return the nick's stored turns to send with `question`, oldest first.
+
+    With history_retrieval on (and numpy installed) that is the history_retrieval_k
+    turns most relevant to the question, always including the last two; otherwise
+    the newest MAX_HISTORY_PER_USER.
+    """
+    cfg = bot.config.grok
+    if numpy is None or not getattr(cfg, 'history_retrieval', True):
+        return _db_get_recent(bot, nick, limit=MAX_HISTORY_PER_USER)
+    k = getattr(cfg, 'history_retrieval_k', None) or HISTORY_RETRIEVAL_K
+    key = nick.lower()
+    cache = bot.memory.get('grok_db_cache')
+    stats = bot.memory.setdefault('grok_retrieval_stats', {'queries': 0, 'pool': 0, 'selected': 0, 'seconds': 0.0})
+    start = time.perf_counter()
     try:
-        conn = _db_conn(bot)
-        c = conn.cursor()
-        c.execute('DELETE FROM grok_user_history WHERE nick = ?', (nick.lower(),))
-        conn.commit()
-        conn.close()
+        with cache.lock if cache is not None else contextlib.nullcontext():
+            index = cache.vectors.get(key) if cache is not None else None
+            if index is None:
+                _db_flush(bot, pending_only=True)
+                index = _TurnIndex(_db_read_recent(bot, key, HISTORY_RETRIEVAL_POOL))
+                if cache is not None:
+                    cache.vectors[key] = index
+            pool = len(index.rows)
+            turns = index.select(question, k)
     except Exception:
-        _log(bot).exception('Failed to clear grok DB for %s', nick)
+        _log(bot).exception('History retrieval failed for %s', nick)
+        return _db_get_recent(bot, nick, limit=MAX_HISTORY_PER_USER)
+    stats['queries'] += 1
+    stats['pool'] += pool
+    stats['selected'] += len(turns)
+    stats['seconds'] += time.perf_counter() - start
+    return turns
+
+
+def _db_read_recent(bot, key, limit):
+    with _db_conn(bot) as conn:
+        rows = conn.execute(
+            'SELECT role, text, codec FROM grok_user_history WHERE nick = ? ORDER BY id DESC LIMIT ?',
+            (key, limit),
+        ).fetchall()
+    codec = bot.memory.get('grok_codec')
+    # rows are newest-first; return chronological (oldest-first)
+    return [
+        (role, codec.decode(text, codec_id) if codec is not None else text)
+        for role, text, codec_id in reversed(rows)
+    ]
+
+
+def _db_clear_user(bot, nick):
+    cache = bot.memory.get('grok_db_cache')
+    with cache.lock if cache is not None else contextlib.nullcontext():
+        # Queued turns would otherwise be committed after the delete
+        _db_flush(bot)
+        try:
+            with _db_conn(bot) as conn:
+                conn.execute('DELETE FROM grok_user_history WHERE nick = ?', (nick.lower(),))
+                conn.commit()
+        except Exception:
+            _log(bot).exception('Failed to clear grok DB for %s', nick)
+        if cache is not None:
+            cache.turns.pop(nick.lower())
+            cache.vectors.pop(nick.lower())
 
 
 def _db_get_admin_ignored(bot):
     try:
-        conn = _db_conn(bot)
-        c = conn.cursor()
-        c.execute('SELECT nick FROM grok_admin_ignored_nicks')
-        rows = c.fetchall()
-        conn.close()
+        with _db_conn(bot) as conn:
+            rows = conn.execute('SELECT nick FROM grok_admin_ignored_nicks').fetchall()
         return {r[0].lower() for r in rows if r and r[0]}
     except Exception:
         return set()
@@ -749,25 +3148,21 @@ def _db_get_admin_ignored(bot):
 
 def _db_add_admin_ignored(bot, nick, added_by=None):
     try:
-        conn = _db_conn(bot)
-        c = conn.cursor()
-        c.execute(
-            'INSERT OR REPLACE INTO grok_admin_ignored_nicks (nick, added_by, ts) VALUES (?, ?, ?)',
-            (nick.lower(), (added_by or '').lower(), datetime.datetime.utcnow().isoformat()),
-        )
-        conn.commit()
-        conn.close()
+        with _db_conn(bot) as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO grok_admin_ignored_nicks (nick, added_by, ts) VALUES (?, ?, ?)',
+                (nick.lower(), (added_by or '').lower(), datetime.datetime.utcnow().isoformat()),
+            )
+            conn.commit()
     except Exception:
         _log(bot).exception('Failed to add ignored nick: %s', nick)
 
 
 def _db_remove_admin_ignored(bot, nick):
     try:
-        conn = _db_conn(bot)
-        c = conn.cursor()
-        c.execute('DELETE FROM grok_admin_ignored_nicks WHERE nick = ?', (nick.lower(),))
-        conn.commit()
-        conn.close()
+        with _db_conn(bot) as conn:
+            conn.execute('DELETE FROM grok_admin_ignored_nicks WHERE nick = ?', (nick.lower(),))
+            conn.commit()
     except Exception:
         _log(bot).exception('Failed to remove ignored nick: %s', nick)
 
@@ -778,61 +3173,350 @@ def _load_admin_ignored_into_memory(bot):
 
 def _db_get_user_pref(bot, nick):
     """Return dict with keys tz_iana, tz_label, time_fmt for nick, or {} if not set."""
+    key = nick.lower()
+    cache = bot.memory.get('grok_db_cache')
     try:
-        conn = _db_conn(bot)
-        c = conn.cursor()
-        c.execute(
-            'SELECT tz_iana, tz_label, time_fmt FROM grok_user_prefs WHERE nick = ?',
-            (nick.lower(),),
-        )
-        row = c.fetchone()
-        conn.close()
-        if row:
-            return {'tz_iana': row[0], 'tz_label': row[1], 'time_fmt': row[2]}
-        return {}
+        if cache is None:
+            return _db_read_pref(bot, key)
+        with cache.lock:
+            prefs = cache.prefs.get(key)
+            if prefs is None:
+                cache.pref_misses += 1
+                prefs = cache.prefs[key] = _db_read_pref(bot, key)
+            else:
+                cache.pref_hits += 1
+            return dict(prefs)
     except Exception:
         return {}
 
 
+def _db_read_pref(bot, key):
+    with _db_conn(bot) as conn:
+        row = conn.execute(
+            'SELECT tz_iana, tz_label, time_fmt FROM grok_user_prefs WHERE nick = ?',
+            (key,),
+        ).fetchone()
+    if row:
+        return {'tz_iana': row[0], 'tz_label': row[1], 'time_fmt': row[2]}
+    return {}
+
+
 def _db_set_user_pref(bot, nick, tz=None, fmt=None):
     """Upsert per-user timezone and/or format preference.
     Pass tz=None or fmt=None to leave that field unchanged.
     """
+    cache = bot.memory.get('grok_db_cache')
     try:
-        conn = _db_conn(bot)
-        c = conn.cursor()
-        # Read existing values so we only overwrite what was provided
-        c.execute(
-            'SELECT tz_iana, tz_label, time_fmt FROM grok_user_prefs WHERE nick = ?',
-            (nick.lower(),),
-        )
-        row = c.fetchone()
-        cur_iana  = row[0] if row else None
-        cur_label = row[1] if row else None
-        cur_fmt   = row[2] if row else None
+        with cache.lock if cache is not None else contextlib.nullcontext(), _db_conn(bot) as conn:
+            c = conn.cursor()
+            # Read existing values so we only overwrite what was provided
+            c.execute(
+                'SELECT tz_iana, tz_label, time_fmt FROM grok_user_prefs WHERE nick = ?',
+                (nick.lower(),),
+            )
+            row = c.fetchone()
+            cur_iana  = row[0] if row else None
+            cur_label = row[1] if row else None
+            cur_fmt   = row[2] if row else None
 
-        new_iana  = tz if tz is not None else cur_iana
-        new_fmt   = fmt if fmt is not None else cur_fmt
+            new_iana  = tz if tz is not None else cur_iana
+            new_fmt   = fmt if fmt is not None else cur_fmt
 
-        # Derive a short label from iana if we have one (e.g. 'America/Chicago' -> stored as-is;
-        # the actual abbreviation like CST/CDT is computed at query time via strftime)
-        new_label = new_iana  # just store the IANA name; label resolved at runtime
+            # Derive a short label from iana if we have one (e.g. 'America/Chicago' -> stored as-is;
+            # the actual abbreviation like CST/CDT is computed at query time via strftime)
+            new_label = new_iana  # just store the IANA name; label resolved at runtime
 
-        c.execute(
-            'INSERT OR REPLACE INTO grok_user_prefs (nick, tz_iana, tz_label, time_fmt) VALUES (?, ?, ?, ?)',
-            (nick.lower(), new_iana, new_label, new_fmt),
-        )
-        conn.commit()
-        conn.close()
+            c.execute(
+                'INSERT OR REPLACE INTO grok_user_prefs (nick, tz_iana, tz_label, time_fmt) VALUES (?, ?, ?, ?)',
+                (nick.lower(), new_iana, new_label, new_fmt),
+            )
+            conn.commit()
+            if cache is not None:
+                cache.prefs[nick.lower()] = {'tz_iana': new_iana, 'tz_label': new_label, 'time_fmt': new_fmt}
     except Exception:
         _log(bot).exception('Failed to set user pref for %s', nick)
 
 
-def _start_api_workers():
-    """Start API worker threads. Called from setup() to ensure thread safety."""
-    for _ in range(API_WORKER_COUNT):
-        t = threading.Thread(target=_api_worker_loop, daemon=True)
-        t.start()
+@plugin.interval(RETENTION_INTERVAL)
+def prune_history(bot):
+    """Apply the history retention policy, then hand freed pages back to the OS."""
+    if bot.memory.get('grok_db_pool') is None:
+        return
+    try:
+        _prune_history(bot)
+    except Exception:
+        _log(bot).exception('Grok history retention run failed')
+
+
+def _prune_history(bot):
+    cfg = bot.config.grok
+    stats = bot.memory.setdefault('grok_retention', {
+        'runs': 0, 'per_nick': 0, 'age': 0, 'size': 0, 'channel_index': 0, 'vacuum_pages': 0, 'seconds': 0.0,
+    })
+    started = time.time()
+    stale = set()   # nicks whose cached turns may include deleted rows
+
+    # 1) Rows beyond the newest `keep` per nick. After one full scan, only nicks that
+    #    got new rows since the previous run can be over the limit. Excess rows from
+    #    several nicks are collected into each RETENTION_BATCH-row transaction.
+    keep = max(getattr(cfg, 'history_keep_per_nick', None) or RETENTION_KEEP_PER_NICK, MAX_HISTORY_PER_USER)
+    dirty = bot.memory.get('grok_prune_nicks')
+    bot.memory['grok_prune_nicks'] = set()
+    if dirty is None:
+        with _db_conn(bot) as conn:
+            nicks = [r[0] for r in conn.execute(
+                'SELECT nick FROM grok_user_history GROUP BY nick HAVING COUNT(*) > ?', (keep,))]
+    else:
+        nicks = list(dirty)
+    batches = 0
+    ids = []
+    for i, nick in enumerate(nicks):
+        if batches >= RETENTION_MAX_BATCHES:
+            # Out of batches: check the rest next run
+            bot.memory['grok_prune_nicks'].update(nicks[i:])
+            break
+        with _db_conn(bot) as conn:
+            excess = [r[0] for r in conn.execute(
+                'SELECT id FROM grok_user_history WHERE nick = ? ORDER BY id DESC LIMIT ? OFFSET ?',
+                (nick, RETENTION_BATCH, keep),
+            )]
+        if len(excess) == RETENTION_BATCH:
+            # Possibly more than a batch over; look again next run
+            bot.memory['grok_prune_nicks'].add(nick)
+        if excess:
+            # The nick's relevance index can hold up to HISTORY_RETRIEVAL_POOL rows
+            stale.add(nick)
+        ids.extend(excess)
+        if ids and (len(ids) >= RETENTION_BATCH or i == len(nicks) - 1):
+            stats['per_nick'] += _delete_rows(bot, ids)
+            ids = []
+            batches += 1
+            time.sleep(RETENTION_PAUSE)
+
+    # 2) Rows older than the age limit. ts grows with id, so only the oldest rows are
+    #    examined, a batch at a time, rather than scanning for old timestamps.
+    max_age = getattr(cfg, 'history_max_age_days', None) or 0
+    if max_age > 0:
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=max_age)
+        deleted = _prune_batches(
+            bot,
+            'SELECT id, nick FROM (SELECT id, nick, ts FROM grok_user_history ORDER BY id LIMIT ?) WHERE ts < ?',
+            (cutoff.isoformat(),),
+        )
+        stats['age'] += len(deleted)
+        stale.update(deleted)
+        try:
+            with _db_conn(bot) as conn:
+                conn.execute(
+                    'DELETE FROM grok_history_spill WHERE id IN '
+                    '(SELECT id FROM grok_history_spill WHERE ts < ? ORDER BY id LIMIT ?)',
+                    (cutoff.timestamp(), RETENTION_BATCH),
+                )
+                conn.commit()
+        except Exception:
+            _log(bot).exception('Failed to prune spilled grok history')
+
+    # 3) Oldest rows while the live data is over the size limit
+    max_mb = getattr(cfg, 'history_max_db_mb', None) or 0
+    batches = 0
+    while max_mb > 0 and batches < RETENTION_MAX_BATCHES and _db_live_bytes(bot) > max_mb * 1024 * 1024:
+        deleted = _prune_batches(bot, 'SELECT id, nick FROM grok_user_history ORDER BY id LIMIT ?', (), max_batches=1)
+        batches += 1
+        if not deleted:
+            break
+        stats['size'] += len(deleted)
+        stale.update(deleted)
+
+    # 4) Channel index lines older than channel_index_days
+    index_days = getattr(cfg, 'channel_index_days', None)
+    if index_days is None:
+        index_days = CHANNEL_INDEX_DAYS
+    if index_days > 0 and bot.memory.get('grok_channel_index'):
+        stats['channel_index'] += _prune_channel_index(bot, time.time() - index_days * 86400)
+
+    cache = bot.memory.get('grok_db_cache')
+    if cache is not None and stale:
+        with cache.lock:
+            for nick in stale:
+                cache.turns.pop(nick)
+                cache.vectors.pop(nick)
+
+    stats['vacuum_pages'] += _incremental_vacuum(bot)
+    _train_codec(bot)
+    stats['runs'] += 1
+    stats['seconds'] = time.time() - started
+
+
+def _train_codec(bot):
+    """Train the zstd dictionary once enough history is stored (zstd codec only)."""
+    codec = bot.memory.get('grok_codec')
+    if codec is None or not codec.needs_dictionary:
+        return
+    try:
+        with _db_conn(bot) as conn:
+            if codec.train(conn):
+                _log(bot).info('Trained a zstd dictionary for stored Grok history')
+    except Exception:
+        _log(bot).exception('Failed to train zstd dictionary')
+
+
+def _prune_batches(bot, select_sql, params, max_batches=RETENTION_MAX_BATCHES):
+    """Delete grok_user_history rows picked by `select_sql` (id, nick; its first
+    parameter is the LIMIT) one RETENTION_BATCH transaction at a time, until it
+    picks fewer than a full batch. Returns the nick of every deleted row."""
+    deleted = []
+    for _ in range(max_batches):
+        with _db_conn(bot) as conn:
+            rows = conn.execute(select_sql, (RETENTION_BATCH,) + params).fetchall()
+        _delete_rows(bot, [r[0] for r in rows])
+        deleted.extend(r[1] for r in rows)
+        if len(rows) < RETENTION_BATCH:
+            break
+        # Let the writer and readers in between batches
+        time.sleep(RETENTION_PAUSE)
+    return deleted
+
+
+def _delete_rows(bot, ids):
+    """Delete grok_user_history rows by id in one transaction; returns the count."""
+    if ids:
+        with _db_conn(bot) as conn:
+            conn.executemany('DELETE FROM grok_user_history WHERE id = ?', [(i,) for i in ids])
+            conn.commit()
+    return len(ids)
+
+
+def _prune_channel_index(bot, cutoff):
+    """Delete indexed channel lines logged before `cutoff` (oldest rows first, in batches)."""
+    total = 0
+    for _ in range(RETENTION_MAX_BATCHES):
+        with _db_conn(bot) as conn:
+            ids = [r[0] for r in conn.execute(
+                'SELECT rowid FROM (SELECT rowid, ts FROM grok_channel_fts ORDER BY rowid LIMIT ?) WHERE ts < ?',
+                (RETENTION_BATCH, cutoff),
+            )]
+            if ids:
+                conn.executemany('DELETE FROM grok_channel_fts WHERE rowid = ?', [(i,) for i in ids])
+                conn.commit()
+        total += len(ids)
+        if len(ids) < RETENTION_BATCH:
+            break
+        time.sleep(RETENTION_PAUSE)
+    return total
+
+
+def _db_live_bytes(bot):
+    with _db_conn(bot) as conn:
+        pages = conn.execute('PRAGMA page_count').fetchone()[0]
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        size = conn.execute('PRAGMA page_size').fetchone()[0]
+    return (pages - free) * size
+
+
+def _incremental_vacuum(bot):
+    """Release free pages a step at a time; returns how many were released."""
+    released = 0
+    with _db_conn(bot) as conn:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return 0
+        for _ in range(RETENTION_MAX_BATCHES):
+            free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not free:
+                break
+            step = min(free, VACUUM_STEP_PAGES)
+            conn.execute(f'PRAGMA incremental_vacuum({step})').fetchall()
+            released += step
+            time.sleep(RETENTION_PAUSE)
+    return released
+
+
+_CHANNEL_INDEX_SQL = 'INSERT INTO grok_channel_fts (nick, text, channel, ts) VALUES (?, ?, ?, ?)'
+
+
+def _index_channel_line(bot, channel, nick, text):
+    """Queue a channel line for the full-text index (dropped if the writer is backed up)."""
+    if not bot.memory.get('grok_channel_index'):
+        return
+    stats = bot.memory['grok_channel_index_stats']
+    writer = bot.memory.get('grok_db_writer')
+    if writer is not None and writer.put(_CHANNEL_INDEX_SQL, (nick, text, channel.lower(), time.time())):
+        stats['indexed'] += 1
+    else:
+        stats['dropped'] += 1
+
+
+def _fts_quote(word):
+    return '"' + word.replace('"', '""') + '"'
+
+
+def _db_search_channel(bot, channel, nicks, terms, before, limit=CHANNEL_INDEX_TOP_K, question=None):
+    """Return up to `limit` (ts, nick, text) lines from `channel`, oldest first.
+
+    Tries lines by one of `nicks` that match any of `terms` (ranked by bm25),
+    then the newest lines by `nicks`, then `terms` from anyone. Only lines
+    logged before `before` are considered, so the question itself is skipped.
+    Lines by the bot, recall questions ("who said ...") and earlier copies of
+    `question` are left out: they would only echo the question back.
+    """
+    nick_q = ' OR '.join(f'nick:{_fts_quote(n)}' for n in nicks)
+    term_q = ' OR '.join(_fts_quote(t) for t in terms)
+    queries = []
+    if nicks and terms:
+        queries.append((f'({nick_q}) AND ({term_q})', 'bm25(grok_channel_fts)'))
+    if nicks:
+        queries.append((nick_q, 'rowid DESC'))
+    if terms:
+        queries.append((term_q, 'bm25(grok_channel_fts)'))
+    asked = _dedupe_key(question) if question else None
+    # Lines still queued in the writer are part of the answer
+    _db_flush(bot, pending_only=True)
+    rows = []
+    with _db_conn(bot) as conn:
+        for match, order in queries:
+            found = conn.execute(
+                'SELECT ts, nick, text FROM grok_channel_fts '
+                'WHERE grok_channel_fts MATCH ? AND channel = ? AND ts < ? AND lower(nick) != ? '
+                f'ORDER BY {order} LIMIT ?',
+                (match, channel.lower(), before, bot.nick.lower(), limit * 4),
+            ).fetchall()
+            rows = [
+                r for r in found
+                if not _RECALL_RE.search(r[2]) and _dedupe_key(r[2]) != asked
+            ][:limit]
+            if rows:
+                break
+    return sorted(rows)
+
+
+def _db_indexed_nicks(bot, channel, candidates):
+    """Return the candidates (case-folded) that have indexed lines in `channel`."""
+    match = ' OR '.join(f'nick:{_fts_quote(n)}' for n in candidates)
+    with _db_conn(bot) as conn:
+        found = {r[0].lower() for r in conn.execute(
+            'SELECT DISTINCT nick FROM grok_channel_fts WHERE grok_channel_fts MATCH ? AND channel = ?',
+            (match, channel.lower()),
+        )}
+    return [n for n in candidates if n in found]
+
+
+def _db_drop_channel_index(bot, channel, nick=None):
+    """Delete indexed lines for `channel` (only `nick`'s, if given)."""
+    if not bot.memory.get('grok_channel_index'):
+        return
+    _db_flush(bot)
+    try:
+        with _db_conn(bot) as conn:
+            if nick is None:
+                conn.execute('DELETE FROM grok_channel_fts WHERE channel = ?', (channel.lower(),))
+            else:
+                conn.execute(
+                    'DELETE FROM grok_channel_fts WHERE rowid IN (SELECT rowid FROM grok_channel_fts '
+                    'WHERE grok_channel_fts MATCH ? AND channel = ? AND nick = ? COLLATE NOCASE)',
+                    (f'nick:{_fts_quote(nick)}', channel.lower(), nick),
+                )
+            conn.commit()
+    except Exception:
+        _log(bot).exception('Failed to delete indexed channel lines for %s', channel)
 
 
 def _get_emote_reply(verb, trigger_nick, bot_memory):
@@ -985,7 +3669,57 @@ def _handle_admin_pm_commands(bot, trigger, user_message):
     return True
 
 
-def _heuristic_intent_check(bot, trigger, line, bot_nick):
+# Verbs accepted by the secondary (non-CTCP) emote detection
+_EMOTE_VERBS = r'(pet|pets|pat|pats|hug|hugs|poke|pokes|kiss|kisses|stroke|strokes|smack|smacks|slap|slaps|bonk|bonks|kick|kicks|punch|punches|boop|boops|nuzzle|nuzzles|snuggle|snuggles|cuddle|cuddles|highfive|highfives|twirl|twirls|wave|waves|wink|winks|dance|dances)'
+
+
+class _NickMatcher:
+    """Every regex that depends on the bot's nick, compiled once per nick.
+
+    Instances are immutable; when the nick changes a new matcher is built and
+    swapped into bot.memory['grok_nick_matcher'] in one assignment, so a line
+    that grabbed the old matcher keeps using a consistent set of patterns.
+    """
+
+    def __init__(self, nick):
+        self.nick = nick
+        self.lower = nick.lower()
+        n = re.escape(nick)
+        i = re.IGNORECASE
+        # "glitchy: $help" -> group(1) is the command candidate
+        self.addressed_command = re.compile(rf'^\s*{n}\s*[:,>]\s*(.+)$', i)
+        # Nick as a whole word (emotes, heuristic checks)
+        self.word = re.compile(rf'\b{n}\b', i)
+        # Secondary emote: "pets glitchy", "* End3r hugs @glitchy"
+        self.emote_target = re.compile(rf'\b{_EMOTE_VERBS}\b(?:\W+\w+){{0,2}}\W+@?{n}(?:\W|$)', i)
+        # Match nick boundaries more robustly than \b to allow non-word chars in nicks
+        self.mention = re.compile(rf'(^|[^A-Za-z0-9_]){n}([^A-Za-z0-9_]|$)', i)
+        # Heuristic intent patterns (see _heuristic_intent_check); linear-time when RE2 is available
+        self.in_url = _linear_compile(rf'https?://[^\s]*{n}', i)
+        self.predicative = _linear_compile(rf'\b(?:is|are|was|were|be|being|looks|feels|seems)\b\s+{n}\b', i)
+        self.possessive = _linear_compile(rf"\b{n}(?:'s|’s)\b", i)
+        self.quoted_use = _linear_compile(
+            rf"\b(?:if|when|you|we|they|people|someone)\b(?:\W+\w+){{0,8}}\W+"
+            rf"\b(?:say|call|mention|use|type|write|spell|invoke)\b\W+{n}",
+            i,
+        )
+        self.vocative = _linear_compile(rf'^\s*{n}[,:>\s]', i)
+        self.trailing = _linear_compile(rf'{n}\s*\W*$', i)
+        self.leading = _linear_compile(rf'^\s*{n}', i)
+        # Leading "glitchy: " on user lines (history) and model replies
+        self.address_prefix = re.compile(rf'^\s*{n}[,:>\s]+', i)
+
+
+def _nick_matcher(bot):
+    """Return the _NickMatcher for the bot's current nick, rebuilding it if stale."""
+    matcher = bot.memory.get('grok_nick_matcher')
+    if matcher is None or matcher.nick != bot.nick:
+        matcher = _NickMatcher(bot.nick)
+        bot.memory['grok_nick_matcher'] = matcher
+    return matcher
+
+
+def _heuristic_intent_check(bot, trigger, line, matcher):
     """Return True if our heuristics think the bot was intended to be addressed.
 
     Heuristics used (best-effort):
@@ -995,84 +3729,114 @@ def _heuristic_intent_check(bot, trigger, line, bot_nick):
     - Short direct messages (<=6 words) mentioning the bot are allowed.
     - Do not respond if the mention appears inside a URL, code fence, or quoted text.
     - Do not respond if multiple distinct nick-like tokens are present and bot is not first.
+
+    Long lines are cut to HEURISTIC_MAX_LINE_LEN chars before any regex runs (the
+    end-of-line check looks at the last HEURISTIC_MAX_LINE_LEN chars instead), so
+    a pasted wall of text costs bounded time on the handler thread.
     """
-    s = line.strip()
+    full = line.strip()
+    s = full[:HEURISTIC_MAX_LINE_LEN]
+    tail = full[-HEURISTIC_MAX_LINE_LEN:]
     lower = s.lower()
-    nick = bot_nick.lower()
 
     # Avoid quoted lines or code blocks
-    if s.startswith('>') or '```' in s:
+    if s.startswith('>') or '```' in full:
         return False
 
     # Avoid URLs containing the nick
-    if re.search(r'https?://[^\s]*' + re.escape(nick), lower):
+    if matcher.in_url.search(lower):
         return False
 
     # Avoid predicative/adjectival uses like "my code is glitchy" or "it's glitchy"
     # where the nick is being used to describe something rather than addressing the bot.
-    if re.search(rf'\b(?:is|are|was|were|be|being|looks|feels|seems)\b\s+{re.escape(nick)}\b', lower):
+    if matcher.predicative.search(lower):
         return False
 
     # Possessive forms: "glitchy's output" or "glitchy’s output"
-    if re.search(rf"\b{re.escape(nick)}(?:'s|’s)\b", lower):
+    if matcher.possessive.search(lower):
         return False
 
     # Phrases that refer to saying/using the word rather than addressing the bot,
     # e.g. "if you say glitchy now", "when we call glitchy", "they'll mention glitchy".
-    if re.search(rf"\b(?:if|when|you|we|they|people|someone)\b(?:\W+\w+){{0,8}}\W+\b(?:say|call|mention|use|type|write|spell|invoke)\b\W+{re.escape(nick)}", lower):
+    if matcher.quoted_use.search(lower):
         return False
 
     # Vocative at start: "glitchy: do this"
-    if re.match(rf'^\s*{re.escape(bot_nick)}[,:>\s]', s, re.IGNORECASE):
+    if matcher.vocative.match(s):
         return True
 
     # Nick at end: "can you help glitchy" or "thanks glitchy"
-    if re.search(rf'{re.escape(bot_nick)}\s*\W*$', s, re.IGNORECASE):
+    if matcher.trailing.search(tail):
         return True
 
     # If it's a clear question and mentions the nick anywhere, respond
-    if '?' in s and re.search(rf'\b{re.escape(bot_nick)}\b', s, re.IGNORECASE):
+    if '?' in s and matcher.word.search(s):
         return True
 
     # Count words and nick-like tokens
-    words = s.split()
-    if len(words) <= 6 and re.search(rf'\b{re.escape(bot_nick)}\b', s, re.IGNORECASE):
+    words = full.split()
+    if len(words) <= 6 and matcher.word.search(s):
         return True
 
     # If multiple capitalized tokens or comma-separated names exist and bot isn't first, don't respond
     # Simple heuristic for lists of nicks: look for commas or ' and '
-    if re.search(r'[,@]|\band\b', s) and re.search(rf'\b{re.escape(bot_nick)}\b', s, re.IGNORECASE):
+    if re.search(r'[,@]|\band\b', s) and matcher.word.search(s):
         # If bot nick not near start, assume it's being referenced among others
-        if not re.match(rf'^\s*{re.escape(bot_nick)}', s, re.IGNORECASE):
+        if not matcher.leading.match(s):
             return False
 
     # Default: be permissive and respond
     return True
 
 
-@plugin.event('PRIVMSG')
-@plugin.rule('.*')
-@plugin.priority('high')
-def handle(bot, trigger):
-    # Detect whether this is a private message (PM) or a channel message
-    is_pm = _is_pm(trigger)
+# Commands other scripts respond to; lines starting with these are not for Grok
+_COMMAND_PREFIXES = ('!', '$', '.', ':', '/', '\\')
 
-    # If PM: allow private conversations unless the user is banned
-    if is_pm:
-        # Gather banned nicks from config and any runtime memory key
-        cfg_banned = {n.lower() for n in getattr(bot.config.grok, 'banned_nicks', [])}
+# Grok's own commands, allowed through the foreign-command filter for everyone
+_ALLOWLISTED_COMMANDS = {'grokreset', 'testemote', 'grokstats'}
+
+# Genuine IRC noise (but keep ACTION/emote lines!): mode changes and join/quit spam
+_NOISE_RE = re.compile(r'^MODE |has (joined|quit|left|parted)', re.IGNORECASE)
+
+
+class _LineContext:
+    """Per-line state threaded through the filter pipeline stages."""
+
+    __slots__ = ('trigger', 'line', 'lower', 'is_pm', 'matcher', 'bot_nick', 'mentioned', 'history')
+
+    def __init__(self, bot, trigger, line, is_pm):
+        self.trigger = trigger
+        self.line = line
+        self.lower = line.lower()
+        self.is_pm = is_pm
+        self.matcher = _nick_matcher(bot)
+        self.bot_nick = self.matcher.nick
+        self.mentioned = is_pm
+        self.history = None     # the conversation log, pinned while an addressed line is handled
+
+
+def _stage_banned(bot, ctx):
+    """PMs only: stop (after telling the user) if the sender is banned from Grok."""
+    trigger = ctx.trigger
+    # Gather banned nicks from config and any runtime memory key
+    cfg_banned = {n.lower() for n in getattr(bot.config.grok, 'banned_nicks', [])}
+    mem_banned = set()
+    try:
+        mem_banned = {n.lower() for n in bot.memory.get('grok_banned', [])}
+    except Exception:
         mem_banned = set()
+    if trigger.nick.lower() in cfg_banned or trigger.nick.lower() in mem_banned:
         try:
-            mem_banned = {n.lower() for n in bot.memory.get('grok_banned', [])}
+            bot.reply('You are banned from using Grok.')
         except Exception:
-            mem_banned = set()
-        if trigger.nick.lower() in cfg_banned or trigger.nick.lower() in mem_banned:
-            try:
-                bot.reply('You are banned from using Grok.')
-            except Exception:
-                pass
-            return
+            pass
+        return False
+    return True
+
 
+def _stage_ignored(bot, ctx):
+    """Stop lines from ignored nicks or from the bot itself."""
+    trigger = ctx.trigger
     # Ignore messages originating from other automated bots/scripts
     try:
         cfg_ignored = {n.lower() for n in getattr(bot.config.grok, 'ignored_nicks', [])}
@@ -1083,14 +3847,14 @@ def handle(bot, trigger):
             _log(bot).info('Ignoring message from configured ignored nick: %s', trigger.nick)
         except Exception:
             pass
-        return
+        return False
 
     # Admin ignore list: ignored from Grok in PMs and channels.
     # Owner/admins are allowed through so they can manage the ignore list (and avoid self-lockout).
     try:
         if trigger.nick.lower() in bot.memory.get('grok_admin_ignored', set()):
             if not _is_admin(bot, trigger):
-                return
+                return False
     except Exception:
         pass
 
@@ -1099,7 +3863,7 @@ def handle(bot, trigger):
         cfg_core_nick = getattr(bot.config.core, 'nick', None)
     except Exception:
         cfg_core_nick = None
-    own_nicks = {bot.nick.lower()}
+    own_nicks = {ctx.bot_nick.lower()}
     if cfg_core_nick:
         own_nicks.add(cfg_core_nick.lower())
     try:
@@ -1108,70 +3872,76 @@ def handle(bot, trigger):
                 _log(bot).info('Ignoring message from self nick: %s', trigger.nick)
             except Exception:
                 pass
-            return
+            return False
     except Exception:
         # If anything goes wrong determining self-nick, continue normally
         pass
+    return True
 
-    # Block-list channels from config; no logging, no replies (only applies to channels)
-    blocked = {c.lower() for c in bot.config.grok.blocked_channels}
-    if (not is_pm) and (trigger.sender.lower() in blocked):
-        return
 
-    line = trigger.group(0).strip()
+def _stage_blocked(bot, ctx):
+    """Block-list channels from config; no logging, no replies (only applies to channels)."""
+    if ctx.is_pm:
+        return True
+    blocked = {c.lower() for c in bot.config.grok.blocked_channels}
+    return ctx.trigger.sender.lower() not in blocked
 
-    # Ignore messages that look like bot commands for other scripts (or unknown commands).
-    # This prevents Grok from replying in PMs/channels when a user is trying to run a
-    # different script's command.
-    #
-    # Exception: bot admins/owners are allowed through (so they can test/admin), and
-    # we allow-list Grok's own commands so non-admins can still use them.
-    try:
-        bot_nick = bot.nick
-        allowlisted_commands = {'grokreset', 'testemote'}
-        command_prefixes = ('!', '$', '.', ':', '/', '\\')
 
-        candidate = line.lstrip()
-        # If user addresses the bot then runs a command, e.g. "glitchy: $help"
-        m_addr = re.match(rf'^\s*{re.escape(bot_nick)}\s*[:,>]\s*(.+)$', line, re.IGNORECASE)
-        if m_addr:
-            candidate = (m_addr.group(1) or '').lstrip()
+def _stage_command(bot, ctx):
+    """Stop lines that look like commands meant for other scripts.
 
-        if candidate and candidate.startswith(command_prefixes):
+    This prevents Grok from replying in PMs/channels when a user is trying to run a
+    different script's command. Bot admins/owners are allowed through (so they can
+    test/admin), and Grok's own commands are allow-listed so non-admins can still
+    use them. "$mug glitchy"-style invocations from other bots are always dropped.
+    """
+    line = ctx.line
+    try:
+        candidate = line
+        # If user addresses the bot then runs a command, e.g. "glitchy: $help".
+        # Only worth a regex when the nick is actually in the line.
+        if ctx.matcher.lower in ctx.lower:
+            m_addr = ctx.matcher.addressed_command.match(line)
+            if m_addr:
+                candidate = (m_addr.group(1) or '').lstrip()
+
+        if candidate and candidate.startswith(_COMMAND_PREFIXES):
             # Parse command name after the prefix, e.g. "$grokreset" -> "grokreset"
             cmd = (candidate[1:].split(None, 1)[0] if len(candidate) > 1 else '').strip().lower()
-            if (not _is_admin(bot, trigger)) and (cmd not in allowlisted_commands):
-                return
+            if (not _is_admin(bot, ctx.trigger)) and (cmd not in _ALLOWLISTED_COMMANDS):
+                return False
     except Exception:
         # If anything goes wrong parsing prefixes, don't break normal chat handling
         pass
 
     # Ignore other bot command invocations that target a nick, e.g. "$mug glitchy".
-    # This prevents Grok from replying when another bot runs a command that mentions
-    # a nick. Adjust or extend the pattern if you have other command names to ignore.
-    try:
-        if re.match(r'^\$mug\b', line, re.IGNORECASE):
-            try:
-                _log(bot).info('Ignoring $mug invocation: %s', line)
-            except Exception:
-                pass
-            return
-    except Exception:
-        pass
-    bot_nick = bot.nick
+    # Adjust or extend the pattern if you have other command names to ignore.
+    if ctx.lower.startswith('$mug') and re.match(r'^\$mug\b', ctx.lower):
+        try:
+            _log(bot).info('Ignoring $mug invocation: %s', line)
+        except Exception:
+            pass
+        return False
+    return True
 
-    # --- Filter genuine IRC noise (but keep ACTION/emote lines!) ---
-    noise_patterns = [
-        r'^MODE ',                         # mode changes
-        r'has (joined|quit|left|parted)',  # join/quit spam
-    ]
-    if any(re.search(p, line, re.IGNORECASE) for p in noise_patterns):
-        return
 
-    # --- Handle CTCP ACTION (/me) or simple emote lines locally ---
+def _stage_noise(bot, ctx):
+    """Stop genuine IRC noise such as mode changes and join/quit spam."""
+    return not _NOISE_RE.search(ctx.line)
+
+
+def _stage_nick(bot, ctx):
+    """Cheap substring check: lines without the bot's nick are context only."""
+    return ctx.matcher.lower in ctx.lower
+
+
+def _stage_ctcp_emote(bot, ctx):
+    """Answer CTCP ACTION (/me) lines aimed at the bot locally and stop."""
+    trigger = ctx.trigger
+    line = ctx.line
     # CTCP ACTION messages are wrapped like: \x01ACTION pets glitchy\x01
     # Also accept conventional '/me pets glitchy' text.
-    _log(bot).debug('Checking emote for line: %r, bot_nick: %s', line, bot.nick)
+    _log(bot).debug('Checking emote for line: %r, bot_nick: %s', line, ctx.bot_nick)
     try:
         action_text = None
         m = re.match(r'^\x01ACTION\s+(.+?)\x01$', line)
@@ -1182,8 +3952,8 @@ def handle(bot, trigger):
 
         if action_text:
             # If the action targets this bot (mentions bot nick), respond locally
-            bot_nick = bot.nick
-            if re.search(rf'\b{re.escape(bot_nick)}\b', action_text, re.IGNORECASE) or re.search(rf'\b{re.escape(bot_nick)}\b', line, re.IGNORECASE):
+            word_re = ctx.matcher.word
+            if word_re.search(action_text) or word_re.search(line):
                 verb = action_text.split()[0].lower()
                 short = _get_emote_reply(verb, trigger.nick, bot.memory)
                 if short:
@@ -1193,7 +3963,7 @@ def handle(bot, trigger):
                         bot.action(f"{short} {trigger.nick}", trigger.sender)
                     except Exception:
                         pass
-                    return
+                    return False
                 else:
                     # Generic friendly emote
                     _log(bot).debug('CTCP emote: generic acknowledge')
@@ -1201,25 +3971,26 @@ def handle(bot, trigger):
                         bot.action(f"acknowledges {trigger.nick} with a smile 😊", trigger.sender)
                     except Exception:
                         pass
-                    return
+                    return False
     except Exception:
         # If emote handling fails, continue to normal flow
         pass
-    # Secondary emote detection: sometimes clients print emotes without CTCP
-    # e.g., "* <nick> pets glitchy" or plain text "@End3r pets glitchy".
+    return True
+
+
+def _stage_emote(bot, ctx):
+    """Secondary emote detection: sometimes clients print emotes without CTCP.
+
+    e.g., "* <nick> pets glitchy" or plain text "@End3r pets glitchy".
+    """
+    trigger = ctx.trigger
     try:
-        bot_nick = bot.nick
         # Normalize: strip leading '* ' often used by clients to show emotes
-        stripped = re.sub(r'^\*\s*', '', line)
+        stripped = re.sub(r'^\*\s*', '', ctx.line)
         # Match only *directed* actions at the bot, e.g. "pets glitchy".
         # Avoid false positives like "glitchy ... talking smack ..." where the
         # nick is present but the verb isn't targeting the bot.
-        verbs = r'(pet|pets|pat|pats|hug|hugs|poke|pokes|kiss|kisses|stroke|strokes|smack|smacks|slap|slaps|bonk|bonks|kick|kicks|punch|punches|boop|boops|nuzzle|nuzzles|snuggle|snuggles|cuddle|cuddles|highfive|highfives|twirl|twirls|wave|waves|wink|winks|dance|dances)'
-        target_re = re.compile(
-            rf'\b{verbs}\b(?:\W+\w+){{0,2}}\W+@?{re.escape(bot_nick)}(?:\W|$)',
-            re.IGNORECASE,
-        )
-        m2 = target_re.search(stripped)
+        m2 = ctx.matcher.emote_target.search(stripped)
         if m2:
             verb = m2.group(1).lower()
             short = _get_emote_reply(verb, trigger.nick, bot.memory) or 'acknowledges with a smile 😊'
@@ -1228,90 +3999,419 @@ def handle(bot, trigger):
                 bot.action(f"{short} {trigger.nick}", trigger.sender)
             except Exception:
                 pass
-            return
+            return False
     except Exception:
         pass
+    return True
 
-    # --- Detect whether the bot is explicitly mentioned ---
-    # In PMs we treat the user message as an implicit mention (they're talking to the bot)
-    if is_pm:
-        mentioned = True
-    else:
-        # Match nick boundaries more robustly than \b to allow non-word chars in nicks
-        mentioned = bool(
-            re.search(
-                rf'(^|[^A-Za-z0-9_]){re.escape(bot_nick)}([^A-Za-z0-9_]|$)',
-                line,
-                re.IGNORECASE,
-            )
-        )
 
-    # Intent detection: if configured to use heuristics, perform a lightweight
-    # acceptance test to avoid responding to incidental mentions.
-    if (not is_pm) and mentioned and getattr(bot.config.grok, 'intent_check', 'heuristic') == 'heuristic':
-        try:
-            if not _heuristic_intent_check(bot, trigger, line, bot_nick):
-                return
-        except Exception:
-            # on error, be permissive and continue
-            pass
+def _stage_mention(bot, ctx):
+    """Detect whether the bot is explicitly mentioned.
 
-    # --- Prepare text for history ---
-    # If they addressed the bot, strip a leading "grok: ", "grok," etc from history text.
-    if mentioned:
-        text_for_history = re.sub(
-            rf'^{re.escape(bot_nick)}[,:>\s]+',
-            '',
-            line,
-            flags=re.IGNORECASE,
-        ).strip()
-    else:
-        # No mention: store the line as-is so Grok still has channel context
-        text_for_history = line.strip()
+    In PMs we treat the user message as an implicit mention (they're talking to
+    the bot). Channel lines that merely contain the nick inside another word are
+    recorded as context and stop here.
+    """
+    if not ctx.is_pm:
+        ctx.mentioned = bool(ctx.matcher.mention.search(ctx.line))
+    if not ctx.mentioned:
+        log = bot.memory['grok_history'].log(_conversation_key(ctx.trigger, ctx.is_pm))
+        _record_line(bot, ctx.trigger, log, ctx.line, False, ctx.is_pm)
+        return False
+    return True
 
-    # Initialize per-conversation history and append this message (thread-safe)
-    # Use distinct keys/locks for PMs so each user's private convo is isolated
+
+def _stage_intent(bot, ctx):
+    """Heuristic acceptance test to avoid responding to incidental mentions."""
+    if ctx.is_pm or getattr(bot.config.grok, 'intent_check', 'heuristic') != 'heuristic':
+        return True
+    try:
+        return _heuristic_intent_check(bot, ctx.trigger, ctx.line, ctx.matcher)
+    except Exception:
+        # on error, be permissive and continue
+        return True
+
+
+# Filter pipelines, cheapest rejections first. Each stage takes (bot, ctx) and
+# returns True to pass the line on or False to stop it; `_run_stages` counts
+# both outcomes and the time spent per stage in bot.memory['grok_pipeline_stats'].
+#
+# Channel lines run _CHANNEL_STAGES inline on the dispatch thread; a line stopped
+# by 'nick' is recorded as context only. PMs run _PM_STAGES instead. Both then
+# continue with _ADDRESSED_STAGES on their own thread.
+_CHANNEL_STAGES = (
+    ('ignored', _stage_ignored),
+    ('blocked', _stage_blocked),
+    ('command', _stage_command),
+    ('noise', _stage_noise),
+    ('nick', _stage_nick),
+)
+_PM_STAGES = (
+    ('banned', _stage_banned),
+    ('ignored', _stage_ignored),
+    ('command', _stage_command),
+    ('noise', _stage_noise),
+)
+_ADDRESSED_STAGES = (
+    ('ctcp_emote', _stage_ctcp_emote),
+    ('emote', _stage_emote),
+    ('mention', _stage_mention),
+    ('intent', _stage_intent),
+)
+
+
+def _run_stages(bot, stages, ctx):
+    """Run `stages` in order; return the name of the stage that stopped the line,
+    or None if it passed all of them."""
+    stats = bot.memory.setdefault('grok_pipeline_stats', {})
+    for name, stage in stages:
+        t0 = time.perf_counter()
+        ok = stage(bot, ctx)
+        elapsed = time.perf_counter() - t0
+        st = stats.get(name)
+        if st is None:
+            st = stats.setdefault(name, {'passed': 0, 'stopped': 0, 'seconds': 0.0})
+        st['passed' if ok else 'stopped'] += 1
+        st['seconds'] += elapsed
+        if not ok:
+            return name
+    return None
+
+
+def _conversation_key(trigger, is_pm):
+    """Return the history/lock key for a trigger: the channel, or "PM:<nick>".
+
+    Use distinct keys/locks for PMs so each user's private convo is isolated.
+    """
     if is_pm:
-        lock_name = f"PM:{trigger.nick.lower()}"
-        chan_lock = _get_channel_lock(bot, lock_name)
-        per_conv_key = ("PM", trigger.nick.lower())
-    else:
-        chan_lock = _get_channel_lock(bot, trigger.sender)
-        per_conv_key = (trigger.sender, trigger.nick)
-    with chan_lock:
-        history = bot.memory['grok_history'].setdefault(
-            per_conv_key,
-            deque(maxlen=MAX_HISTORY_ENTRIES),
-        )
+        return f"PM:{trigger.nick.lower()}"
+    return trigger.sender
+
+
+def _record_line(bot, trigger, log, text_for_history, mentioned, is_pm):
+    """Append a line to the conversation's _ChannelLog (thread-safe) and return the log.
+
+    Channel lines that are kept are also queued for the full-text channel index.
+    """
+    with log.lock:
         if text_for_history:
             # If this line did not address the bot, avoid storing noisy lines
             # (URLs, single tiny tokens, or pure punctuation) which often pollute
             # future replies for simple user prompts.
-            skip = False
-            if not mentioned:
-                if re.search(r'https?://|\S+\.(com|net|org|io|gg)\b', text_for_history, re.IGNORECASE):
-                    skip = True
-                if len(text_for_history.split()) <= 1 and len(text_for_history) <= 3:
-                    skip = True
-                if re.match(r'^[^\w\s]+$', text_for_history):
-                    skip = True
-            if not skip:
-                # Coalesce consecutive messages from the same nick to reduce noise
-                if history and history[-1].startswith(f"{trigger.nick}:"):
-                    try:
-                        _, last_text = history.pop().split(": ", 1)
-                    except Exception:
-                        last_text = ''
-                    new = f"{trigger.nick}: {last_text} / {text_for_history}" if last_text else f"{trigger.nick}: {text_for_history}"
-                    if len(new) > 400:
-                        new = new[:390] + " […]"
-                    history.append(new)
-                else:
-                    history.append(f"{trigger.nick}: {text_for_history}")
+            if not mentioned and _is_noisy_text(text_for_history):
+                return log
+            # Coalesce consecutive messages from the same nick to reduce noise
+            log.add_line(trigger.nick, text_for_history)
+    if text_for_history and not is_pm:
+        _index_channel_line(bot, trigger.sender, trigger.nick, text_for_history)
+    return log
+
+
+# "who said ...", "who mentioned ..." and friends: search the channel index
+_RECALL_RE = re.compile(
+    r"\bwho(?:'s| has| had| was)?\s+(?:said|says|say|mentioned|mentions|talked|asked|wrote|posted|brought up|was talking)\b",
+    re.IGNORECASE,
+)
+_IRC_NICK_RE = re.compile(r'[A-Za-z\[\]\\`_^{|}][A-Za-z0-9\[\]\\`_^{|}-]*')
+# Words that carry no search value in a recall question
+_RECALL_STOPWORDS = frozenset(
+    'a about after all also am an and any anyone anything are as at be been before but by can could did do '
+    'does earlier for from had has have he her him his how i if in into is it its just last me mention '
+    'mentioned mentions my of on or our over recently said say says she so some someone something tell than '
+    'that the their them then there they this to told talk talked talking up us was we were what when where '
+    'which who whom why will with wrote you your asked posted brought'.split()
+)
+
+
+def _channel_recall(bot, trigger, history, question, before):
+    """Search the channel index for a question naming a known nick or asking "who said".
+
+    Returns matching (ts, nick, text) rows (oldest first), or None when the
+    question is not a recall question or nothing matched.
+    """
+    if not bot.memory.get('grok_channel_index'):
+        return None
+    with history.lock:
+        known = set(history.nicks())
+    try:
+        chan = bot.channels.get(trigger.sender)
+        if chan is not None:
+            known.update(str(n).lower() for n in chan.users)
+    except Exception:
+        pass
+    known.discard(bot.nick.lower())
+    nicks = []
+    unknown = []
+    for word in _IRC_NICK_RE.findall(question):
+        key = word.lower()
+        if key in known:
+            if key not in nicks:
+                nicks.append(key)
+        elif key not in _RECALL_STOPWORDS and key != bot.nick.lower() and key not in unknown:
+            unknown.append(key)
+    if unknown:
+        # Nicks that spoke before a restart (or left) are only known to the index
+        try:
+            nicks.extend(_db_indexed_nicks(bot, trigger.sender, unknown[:12]))
+        except Exception:
+            _log(bot).exception('Channel index nick lookup failed')
+    if not nicks and not _RECALL_RE.search(question):
+        return None
+    skip = _RECALL_STOPWORDS | set(nicks) | {bot.nick.lower()}
+    terms = []
+    for word in _INTENT_WORD_RE.findall(question.lower()):
+        if len(word) > 1 and word not in skip and word not in terms:
+            terms.append(word)
+    terms = terms[:12]
+    if not nicks and not terms:
+        return None
+    stats = bot.memory['grok_channel_index_stats']
+    stats['searches'] += 1
+    try:
+        rows = _db_search_channel(bot, trigger.sender, nicks, terms, before, question=question)
+    except Exception:
+        _log(bot).exception('Channel index search failed')
+        return None
+    if not rows:
+        return None
+    stats['hits'] += 1
+    return rows
+
+
+def _recall_line(ts, nick, text):
+    when = datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M')
+    return f"[{when}] {nick}: {text}"
+
+
+_TOKEN_PIECE_RE = re.compile(r'\w+|[^\w\s]')
+
+
+@functools.lru_cache(maxsize=TOKEN_ESTIMATE_CACHE_SIZE)
+def _estimate_tokens(text):
+    """Rough BPE token count: one per punctuation mark, one per 6 chars of each word."""
+    return sum((len(piece) + 5) // 6 for piece in _TOKEN_PIECE_RE.findall(text))
+
+
+def _dedupe_key(text):
+    return ' '.join(text.casefold().split())
+
+
+class _PromptBudget:
+    """Token budget for one request's prompt, shared by all of its context sources.
+
+    Fixed messages are `reserve`d first; each source then `fill`s what is left, in
+    priority order. A line whose text an earlier source already included (the same
+    turn in the DB history and the channel background, say) is skipped.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.deduped = 0
+        self.dropped = 0
+        self._seen = set()
+
+    def reserve(self, text, key=None, overhead=PROMPT_MESSAGE_OVERHEAD):
+        """Count text that is always sent; `key` marks it as already included."""
+        self.used += _estimate_tokens(text) + overhead
+        if key is not None:
+            self._seen.add(_dedupe_key(key))
+
+    def fill(self, items, overhead=PROMPT_MESSAGE_OVERHEAD):
+        """Keep the (key, text, item) entries, given newest first, that fit and are new.
+
+        `key` is compared across sources, `text` is what gets sent. Returns the
+        kept items oldest first.
+        """
+        kept = []
+        for key, text, item in items:
+            key = _dedupe_key(key)
+            if key in self._seen:
+                self.deduped += 1
+                continue
+            cost = _estimate_tokens(text) + overhead
+            if self.used + cost > self.limit:
+                self.dropped += 1
+                continue
+            self._seen.add(key)
+            self.used += cost
+            kept.append(item)
+        kept.reverse()
+        return kept
+
+
+def _record_prompt_stats(bot, nick, mode, budget):
+    stats = bot.memory.setdefault(
+        'grok_prompt_stats', {'requests': 0, 'tokens': 0, 'max': 0, 'deduped': 0, 'dropped': 0},
+    )
+    stats['requests'] += 1
+    stats['tokens'] += budget.used
+    stats['max'] = max(stats['max'], budget.used)
+    stats['deduped'] += budget.deduped
+    stats['dropped'] += budget.dropped
+    _log(bot).info(
+        'Prompt for %s: ~%d/%d tokens (%s), %d duplicate and %d over-budget lines left out',
+        nick, budget.used, budget.limit, mode, budget.deduped, budget.dropped,
+    )
+
+
+def _is_noisy_text(text):
+    """Return True for URLs, single tiny tokens and pure punctuation."""
+    if re.search(r'https?://|\S+\.(com|net|org|io|gg)\b', text, re.IGNORECASE):
+        return True
+    if len(text.split()) <= 1 and len(text) <= 3:
+        return True
+    if re.match(r'^[^\w\s]+$', text):
+        return True
+    return False
+
+
+@plugin.event('PRIVMSG')
+@plugin.rule('.*')
+@plugin.priority('high')
+@plugin.thread(False)
+def handle(bot, trigger):
+    """Record every line and dispatch addressed ones.
+
+    This runs inline on Sopel's dispatch thread for every PRIVMSG, so it must stay
+    cheap: channel lines go through the inline filter stages, and those that do
+    not contain the bot's nick can only ever end up as background context, so they
+    are appended to history right here. Anything that might need a reply (PMs,
+    lines containing the nick) is handed to ``_handle_addressed`` on its own thread.
+    """
+    # Detect whether this is a private message (PM) or a channel message
+    is_pm = _is_pm(trigger)
+    ctx = _LineContext(bot, trigger, trigger.group(0).strip(), is_pm)
+
+    if is_pm:
+        _dispatch_addressed(bot, ctx)
+        return
+
+    stopped_at = _run_stages(bot, _CHANNEL_STAGES, ctx)
+    if stopped_at is None:
+        _dispatch_addressed(bot, ctx)
+        return
+
+    # Passive path: a line stopped by the 'nick' stage has no mention, so store it
+    # as-is so Grok still has channel context. Lines stopped earlier are dropped.
+    if stopped_at == 'nick':
+        log = bot.memory['grok_history'].log(_conversation_key(trigger, is_pm))
+        _record_line(bot, trigger, log, ctx.line, False, is_pm)
+
+
+@plugin.event('NICK', '001')
+@plugin.rule('.*')
+@plugin.priority('low')
+@plugin.thread(False)
+def refresh_nick_matcher(bot, trigger):
+    """Rebuild the nick regex cache after a NICK change or (re)connect.
+
+    Runs at low priority so Sopel's core has already updated ``bot.nick``;
+    `_nick_matcher` also rebuilds lazily if a change slips past this hook.
+    """
+    _nick_matcher(bot)
+
+
+@plugin.event('JOIN', '353')
+@plugin.rule('.*')
+@plugin.priority('low')
+def prewarm_db_cache(bot, trigger):
+    """Load cached turns/prefs for nicks joining a channel or listed in NAMES (353).
+
+    Only runs with `db_cache_prewarm` on; Sopel runs this on its own thread, so
+    the DB reads stay off the dispatch thread.
+    """
+    if not getattr(bot.config.grok, 'db_cache_prewarm', False):
+        return
+    if trigger.event == 'JOIN':
+        if trigger.nick == bot.nick:
+            return  # our own join; the NAMES reply that follows lists everyone
+        nicks = [trigger.nick]
+    else:
+        nicks = [n.lstrip('~&@%+') for n in (trigger.args[-1] or '').split()]
+    try:
+        _db_prewarm(bot, nicks)
+    except Exception:
+        _log(bot).exception('Failed to prewarm Grok DB cache')
+
+
+def _db_prewarm(bot, nicks):
+    cache = bot.memory.get('grok_db_cache')
+    if cache is None:
+        return
+    keys = [n.lower() for n in nicks if n and n.lower() not in cache.turns]
+    # Never let one big channel push more than half the cache's regulars out
+    keys = keys[:cache.turns.maxsize // 2]
+    found = []
+    prefs = {}
+    with _db_conn(bot) as conn:
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            marks = ','.join('?' * len(chunk))
+            found.extend(r[0] for r in conn.execute(
+                f'SELECT DISTINCT nick FROM grok_user_history WHERE nick IN ({marks})', chunk))
+            for row in conn.execute(
+                f'SELECT nick, tz_iana, tz_label, time_fmt FROM grok_user_prefs WHERE nick IN ({marks})', chunk):
+                prefs[row[0]] = {'tz_iana': row[1], 'tz_label': row[2], 'time_fmt': row[3]}
+    # Load under the cache lock, exactly like a miss, so queued writes are not lost
+    for key in found:
+        with cache.lock:
+            if key in cache.turns:
+                continue
+            _db_flush(bot, pending_only=True)
+            cache.turns[key] = deque(_db_read_recent(bot, key, MAX_HISTORY_PER_USER), maxlen=MAX_HISTORY_PER_USER)
+            cache.prewarmed += 1
+    with cache.lock:
+        for key, value in prefs.items():
+            if key not in cache.prefs:
+                cache.prefs[key] = value
+
+
+def _dispatch_addressed(bot, ctx):
+    """Run ``_handle_addressed`` off the dispatch thread."""
+    t = threading.Thread(
+        target=_handle_addressed,
+        args=(bot, ctx),
+        name='grok-addressed',
+        daemon=True,
+    )
+    t.start()
+
 
-    # If they didn't mention the bot, don't wake it up — just keep the context
-    if not mentioned:
+def _handle_addressed(bot, ctx):
+    """Handle a PM or a channel line containing the bot's nick."""
+    try:
+        _handle_addressed_line(bot, ctx)
+    except Exception:
+        _log(bot).exception('Grok handler failed for %s', ctx.trigger.sender)
+    finally:
+        if ctx.history is not None:
+            ctx.history.unpin()
+
+
+def _handle_addressed_line(bot, ctx):
+    # Channel lines were already filtered by `handle`; PMs get their own stages here
+    if ctx.is_pm and _run_stages(bot, _PM_STAGES, ctx):
         return
+    if _run_stages(bot, _ADDRESSED_STAGES, ctx):
+        return
+
+    trigger = ctx.trigger
+    line = ctx.line
+    is_pm = ctx.is_pm
+    bot_nick = ctx.bot_nick
+
+    # --- Prepare text for history ---
+    # They addressed the bot, so strip a leading "grok: ", "grok," etc from history text.
+    text_for_history = ctx.matcher.address_prefix.sub('', line, count=1).strip()
+
+    # Initialize per-conversation history and append this message (thread-safe)
+    history = bot.memory['grok_history'].log(_conversation_key(trigger, is_pm))
+    history.pin()
+    ctx.history = history
+    chan_lock = history.lock
+    asked_at = time.time()
+    _record_line(bot, trigger, history, text_for_history, True, is_pm)
 
     # This is the text we treat as the "current user message" to Grok
     user_message = text_for_history
@@ -1324,41 +4424,31 @@ def handle(bot, trigger):
         _log(bot).exception('Admin PM command handler failed')
         return
 
+    # Classify the message once: search / time / review / tz-set / fmt-set / command
+    intent = _classify_intent(user_message)
+
     # --- Silently detect and persist per-user timezone / format preferences ---
     # This runs as a side-effect; the model's normal reply handles acknowledgement.
     try:
-        _pref_tz = None
-        _pref_fmt = None
-        _mtz = _TZ_SET_RE.search(user_message)
-        if _mtz:
-            _abbr = _mtz.group(1).upper()
-            _iana = _TZ_ABBR_MAP.get(_abbr)
-            if _iana:
-                _pref_tz = _iana
-        _mfmt = _FMT_SET_RE.search(user_message)
-        if _mfmt:
-            _raw = _mfmt.group(1).lower().replace(' ', '').replace('-', '')
-            _pref_fmt = '12' if _raw.startswith('12') else '24'
-        if _pref_tz or _pref_fmt:
-            _db_set_user_pref(bot, trigger.nick, tz=_pref_tz, fmt=_pref_fmt)
-            _log(bot).info('Saved pref for %s: tz=%s fmt=%s', trigger.nick, _pref_tz, _pref_fmt)
+        if intent.tz or intent.fmt:
+            _db_set_user_pref(bot, trigger.nick, tz=intent.tz, fmt=intent.fmt)
+            _log(bot).info('Saved pref for %s: tz=%s fmt=%s', trigger.nick, intent.tz, intent.fmt)
     except Exception:
         pass
 
     # Detect review trigger early so cooldowns can reference it
-    review_re = re.compile(r"\b(thoughts?|opinion|what do you think|summarize|give (me )?(your )?(take|opinion)|opine)\b", re.IGNORECASE)
-    review_mode = bool(review_re.search(user_message)) or (user_message.strip() == '^^')
+    review_mode = intent.review
 
     # Ignore empty messages after cleaning
     if not user_message:
         return
 
     # Ignore bot commands like ".help", "/whatever", "!foo"
-    if re.match(r'^[.!/]', user_message):
+    if intent.command:
         return
 
     # Detect time-only queries early so we can bypass rate-limiting for them
-    time_mode = bool(_TIME_INTENT_RE.search(user_message))
+    time_mode = intent.time
 
     # --- Rate limit: 4 seconds per channel (thread-safe) ---
     # Time/date queries are exempt: repeated asks should always get the current time.
@@ -1376,7 +4466,7 @@ def handle(bot, trigger):
 
     # Review-mode cooldown (longer): once per 30s per channel
     if review_mode:
-        review_last = bot.memory.setdefault('grok_review_last', {})
+        review_last = bot.memory['grok_review_last']
         last_review = review_last.get(trigger.sender, 0)
         if now - last_review < 30:
             # ignore rapid repeated review requests
@@ -1384,16 +4474,16 @@ def handle(bot, trigger):
         review_last[trigger.sender] = now
 
     # --- Build Grok conversation messages from history ---
-    # Inject current date/time so Grok is never "stuck in the past"
-    now_str = datetime.datetime.now(datetime.timezone.utc).strftime('%A, %B %d, %Y at %H:%M UTC')
-
+    # Messages run from the most static to the most volatile, so consecutive requests
+    # share the longest possible prefix for the API's prompt cache: system prompt and
+    # mode instructions, this user's turns, channel context, then the current time and
+    # the question.
     messages = [
         {"role": "system", "content": bot.config.grok.system_prompt},
         {
             "role": "system",
             "content": (
-                f"Current date/time: {now_str}. "
-                f"Your IRC nick is '{bot_nick}'. You are replying to {trigger.nick}. "
+                f"Your IRC nick is '{bot_nick}'. "
                 f"If the user asks about news, current events, or anything time-sensitive, "
                 f"search the web and give a substantive answer with real details. "
                 f"All responses must be single-line (no newlines — this is IRC)."
@@ -1401,171 +4491,128 @@ def handle(bot, trigger):
         },
     ]
 
+    # Detect if this query needs live web search
+    search_mode = intent.search
+    if search_mode:
+        _log(bot).info('Search intent detected for query from %s: %s', trigger.nick, user_message[:80])
+        # Tell the model to stop after delivering the factual result —
+        # no trailing commentary, quips, or emoji taglines.
+        messages.append({
+            "role": "system",
+            "content": (
+                "You are performing a web search. Output ONLY the factual search result. "
+                "Do NOT add any commentary, follow-up remarks, emoji taglines, or reactions "
+                "after the result. End your response immediately after the last factual sentence."
+            ),
+        })
+    if review_mode:
+        # Review mode: give Grok an explicit review instruction and a compact background
+        messages.append({
+            "role": "system",
+            "content": (
+                "You are Grok, a conversational, human-like assistant. For review requests, "
+                "produce a short, opinionated response in 2-3 sentences, mention one highlight, "
+                "and give one concise suggestion. Be casual and friendly. Keep it brief. "
+                "Never use newlines or line breaks - keep everything in a single line."
+            ),
+        })
+
+    # Volatile instructions, sent just before the question.
+    # Inject current date/time so Grok is never "stuck in the past"
+    now_str = datetime.datetime.now(datetime.timezone.utc).strftime('%A, %B %d, %Y at %H:%M UTC')
+    tail = [{"role": "system", "content": f"Current date/time: {now_str}. You are replying to {trigger.nick}."}]
+    if time_mode:
+        _log(bot).info('Time/date query detected for %s', trigger.nick)
+        tail.append({"role": "system", "content": _time_instruction(bot, trigger.nick)})
+
+    # Context is fitted to a per-mode token budget: the fixed messages are reserved,
+    # then each source fills what is left in priority order, skipping lines an
+    # earlier source already included. Search wins over time, so a question that is
+    # both keeps the search headroom for citation markup.
+    mode = 'review' if review_mode else 'search' if search_mode else 'time' if time_mode else 'chat'
+    budget = _PromptBudget(PROMPT_TOKEN_BUDGETS[mode])
+    for msg in messages + tail:
+        budget.reserve(msg['content'])
+
     # Decide whether this mention is a simple user prompt (default behavior)
     # or a channel-wide review/opinion request. If the user asks for "thoughts",
     # "opinion", "what do you think", "summarize", etc., we switch to review mode
     # and gather recent messages from the whole channel (subject to filters/budget).
 
-    relevant_turns = []
-
     if not review_mode:
-        # Prefer DB-backed per-user history (persists across restarts). Fall back to
-        # in-memory history if DB empty.
-        db_entries = _db_get_recent(bot, trigger.nick, limit=20)
+        budget.reserve(user_message, key=f"{trigger.nick}: {user_message}")
+        # Prefer DB-backed per-user history (persists across restarts), ranked by
+        # relevance to this question. Fall back to in-memory history if DB empty.
+        relevant_turns = []
+        db_entries = _db_select_turns(bot, trigger.nick, user_message)
         if db_entries:
             for role, text in db_entries:
                 nick = bot_nick if role == 'assistant' else trigger.nick
                 relevant_turns.append((nick, text))
         else:
-            # Per-(channel,nick) history only (default): keep turns between this user and the bot
-            # Snapshot history under lock to avoid races while we build messages
+            # This user's view of the log: their lines plus the bot's replies to them.
+            # Snapshot under lock to avoid races while we build messages
             with chan_lock:
-                history_snapshot = list(history)
+                relevant_turns = [
+                    (rec.nick, rec.text) for rec in history.view(trigger.nick)
+                    if rec.nick in (trigger.nick, bot_nick)
+                ]
+        turns = relevant_turns[-MAX_HISTORY_PER_USER:]
+        split = max(len(turns) - HISTORY_RETRIEVAL_KEEP_LAST, 0)
+
+        # --- Channel-wide lines as background context ---
+        # Lines from ALL nicks in this channel (not just this user/bot pair) so Grok
+        # can answer questions like "what did KnownSyntax say?" or "what beer did
+        # End3r have?". The log keeps this block rendered as lines come in.
+        # Questions naming a nick or asking "who said ..." get the best-matching lines
+        # from the persistent channel index instead of the recency window.
+        recalled = None if is_pm else _channel_recall(bot, trigger, history, user_message, asked_at)
+        recall_header = (
+            "Channel log search results for this question, oldest first "
+            "(each line is '[UTC time] nick: message'). When asked who said something "
+            "or what a specific user said, answer accurately from these lines and name "
+            "the correct nick. Do not invent or attribute statements to yourself or the "
+            "wrong person.\n\n"
+        )
+        bg_header = (
+            "Recent channel conversation log (each line is 'nick: message'). "
+            "When asked who said something or what a specific user said, "
+            "always answer accurately based on this log — name the correct nick. "
+            "Do not invent or attribute statements to yourself or the wrong person.\n\n"
+        )
 
-            for entry in history_snapshot:
-                # Each entry is "nick: text"
-                try:
-                    nick, text = entry.split(": ", 1)
-                except ValueError:
-                    continue
-                if nick not in (trigger.nick, bot_nick):
-                    continue
-                relevant_turns.append((nick, text))
-    else:
-        # Channel review mode: collect recent lines from all per-(channel,nick) histories
-        # and any channel-only keys (backwards-compat). We'll merge them into a
-        # chronological list and then apply a simple char budget.
-        channel_entries = []  # (timestamp_approx, nick, text)
-        # We don't store timestamps per-entry, so we treat deque order as chronological.
-        # For PM review requests, only gather the PM-specific history
-        if is_pm:
-            with chan_lock:
-                dq = bot.memory.get('grok_history', {}).get(per_conv_key, None)
-                if dq:
-                    for item in list(dq):
-                        try:
-                            nick, text = item.split(": ", 1)
-                        except Exception:
-                            continue
-                        channel_entries.append((nick, text))
-        else:
+        # Priority: the last exchange, recalled lines, older turns, then the background.
+        # Lines are keyed on nick and text, so the same words from two nicks both stay.
+        last_turns = budget.fill([(f"{nick}: {text}", text, (nick, text)) for nick, text in reversed(turns[split:])])
+        if recalled:
+            budget.reserve(recall_header)
+            recalled = budget.fill(
+                [(f"{nick}: {text}", _recall_line(ts, nick, text), _recall_line(ts, nick, text))
+                 for ts, nick, text in reversed(recalled)],
+                overhead=1,
+            )
+        older_turns = budget.fill([(f"{nick}: {text}", text, (nick, text)) for nick, text in reversed(turns[:split])])
+        # The recency window stands in when recall found nothing new to send
+        bg_lines = []
+        if not is_pm and not recalled:
             with chan_lock:
-                for k, dq in bot.memory.get('grok_history', {}).items():
-                    try:
-                        if isinstance(k, tuple) and k[0] == trigger.sender:
-                            for item in list(dq):
-                                try:
-                                    nick, text = item.split(": ", 1)
-                                except Exception:
-                                    continue
-                                channel_entries.append((nick, text))
-                        elif k == trigger.sender:
-                            for item in list(dq):
-                                try:
-                                    nick, text = item.split(": ", 1)
-                                except Exception:
-                                    continue
-                                channel_entries.append((nick, text))
-                    except Exception:
-                        continue
-
-        # Filter and keep most recent entries (already chronological by collection order)
-        # Apply same noise filters as when storing: skip URLs / tiny tokens / punctuation
-        filtered = []
-        for nick, text in channel_entries:
-            t = text.strip()
-            if not t:
-                continue
-            if re.search(r'https?://|\S+\.(com|net|org|io|gg)\b', t, re.IGNORECASE):
-                continue
-            if len(t.split()) <= 1 and len(t) <= 3:
-                continue
-            if re.match(r'^[^\w\s]+$', t):
-                continue
-            filtered.append((nick, t))
-
-        # Build a chronological list but enforce a character budget
-        char_budget = REVIEW_CHAR_BUDGET
-        collected = []
-        total_chars = 0
-        # iterate from the end (most recent) backwards to collect newest first
-        for nick, text in reversed(filtered):
-            l = len(text) + len(nick) + 3
-            if total_chars + l > char_budget and collected:
-                break
-            collected.append((nick, text))
-            total_chars += l
-
-        # collected is newest-first; reverse to chronological
-        collected.reverse()
-        relevant_turns = collected
-
-    if not review_mode:
-        # --- Inject recent channel-wide lines as background context ---
-        # Collect lines from ALL nicks in this channel (not just this user/bot pair)
-        # so Grok can answer questions like "what did KnownSyntax say?" or
-        # "what beer did End3r have?".
-        if not is_pm:
-            try:
-                channel_bg = []
-                with chan_lock:
-                    for k, dq in bot.memory.get('grok_history', {}).items():
-                        try:
-                            if isinstance(k, tuple) and k[0] == trigger.sender:
-                                for item in list(dq):
-                                    try:
-                                        n, t = item.split(": ", 1)
-                                        channel_bg.append((n, t))
-                                    except Exception:
-                                        continue
-                        except Exception:
-                            continue
-
-                # Deduplicate while preserving order (multiple per-user deques overlap)
-                seen_bg = set()
-                unique_bg = []
-                for n, t in channel_bg:
-                    key = (n.lower(), t)
-                    if key not in seen_bg:
-                        seen_bg.add(key)
-                        unique_bg.append((n, t))
-
-                # Keep the most recent lines within a character budget
-                BG_CHAR_BUDGET = 1500
-                BG_MAX_LINES = 40
-                bg_collected = []
-                bg_chars = 0
-                for n, t in reversed(unique_bg):
-                    l = len(n) + len(t) + 3
-                    if bg_chars + l > BG_CHAR_BUDGET and bg_collected:
-                        break
-                    if len(bg_collected) >= BG_MAX_LINES:
-                        break
-                    bg_collected.append((n, t))
-                    bg_chars += l
-                bg_collected.reverse()  # back to chronological order
-
-                if bg_collected:
-                    bg_lines = [f"{n}: {t}" for n, t in bg_collected]
-                    messages.append({
-                        "role": "system",
-                        "content": (
-                            "Recent channel conversation log (each line is 'nick: message'). "
-                            "When asked who said something or what a specific user said, "
-                            "always answer accurately based on this log — name the correct nick. "
-                            "Do not invent or attribute statements to yourself or the wrong person.\n\n"
-                            + "\n".join(bg_lines)
-                        ),
-                    })
-            except Exception:
-                pass
+                bg_lines = history.background_lines()
+        if bg_lines:
+            budget.reserve(bg_header)
+            bg_lines = budget.fill([(line, line, line) for line in reversed(bg_lines)], overhead=1)
 
-        # Keep only the last N turns for this user/bot pair
-        for nick, text in relevant_turns[-MAX_HISTORY_PER_USER:]:
+        for nick, text in older_turns + last_turns:
             role = "assistant" if nick == bot_nick else "user"
             messages.append({"role": role, "content": text})
 
+        # Channel lines change with every message, so they follow the user's turns
+        if recalled:
+            messages.append({"role": "system", "content": recall_header + '\n'.join(recalled)})
+        elif bg_lines:
+            messages.append({"role": "system", "content": bg_header + '\n'.join(bg_lines)})
+
         # Add the current user message at the end
+        messages.extend(tail)
         messages.append({"role": "user", "content": user_message})
         # Persist this user turn to DB for future cross-channel context
         try:
@@ -1573,91 +4620,204 @@ def handle(bot, trigger):
         except Exception:
             pass
     else:
-        # Review mode: give Grok an explicit review instruction and a compact background
-        review_sys = (
-            "You are Grok, a conversational, human-like assistant. For review requests, "
-            "produce a short, opinionated response in 2-3 sentences, mention one highlight, "
-            "and give one concise suggestion. Be casual and friendly. Keep it brief. "
-            "Never use newlines or line breaks - keep everything in a single line."
+        question = (
+            "\n\nUser question: " + user_message + "\n\n"
+            + "Instruction: Provide a brief, human-like opinion (2-3 sentences), one highlight, and one short suggestion."
         )
-        messages.append({"role": "system", "content": review_sys})
+        budget.reserve("Background conversation (most recent last):\n" + question, key=f"{trigger.nick}: {user_message}")
 
-        # Build a compact background text (chronological)
-        bg_lines = []
-        for nick, text in relevant_turns[-REVIEW_MAX_ENTRIES:]:
-            bg_lines.append(f"{nick}: {text}")
-        background = "\n".join(bg_lines)
+        # Walk the conversation's log newest-first, applying the same noise filters
+        # as when storing (URLs / tiny tokens / punctuation); the budget keeps the
+        # newest lines that fit. For PM review requests the log is the PM's own.
+        candidates = []
+        with chan_lock:
+            for rec in history.recent():
+                t = rec.text.strip()
+                if not t or _is_noisy_text(t):
+                    continue
+                candidates.append(f"{rec.nick}: {t}")
+                if len(candidates) >= REVIEW_MAX_ENTRIES:
+                    break
+        bg_lines = budget.fill([(line, line, line) for line in candidates], overhead=1)
 
-        combined = (
-            "Background conversation (most recent last):\n" + background + "\n\n"
-            + "User question: " + user_message + "\n\n"
-            + "Instruction: Provide a brief, human-like opinion (2-3 sentences), one highlight, and one short suggestion."
-        )
+        combined = "Background conversation (most recent last):\n" + "\n".join(bg_lines) + question
+        messages.extend(tail)
         messages.append({"role": "user", "content": combined})
 
+    _record_prompt_stats(bot, trigger.nick, mode, budget)
+
     # --- Call x.ai API asynchronously to avoid blocking the handler ---
-    # Enqueue work for the API worker pool; fail gracefully if queue is full
-    try:
-        # Detect if this query needs live web search
-        search_mode = bool(_SEARCH_INTENT_RE.search(user_message))
-        if search_mode:
-            _log(bot).info('Search intent detected for query from %s: %s', trigger.nick, user_message[:80])
-            # Tell the model to stop after delivering the factual result —
-            # no trailing commentary, quips, or emoji taglines.
-            messages.append({
-                "role": "system",
-                "content": (
-                    "You are performing a web search. Output ONLY the factual search result. "
-                    "Do NOT add any commentary, follow-up remarks, emoji taglines, or reactions "
-                    "after the result. End your response immediately after the last factual sentence."
-                ),
-            })
-        if time_mode:
-            _log(bot).info('Time/date query detected for %s', trigger.nick)
-            # Load this user's saved preferences (tz + format), defaulting to UTC / 24hr.
-            _uprefs = _db_get_user_pref(bot, trigger.nick)
-            _pref_iana = (_uprefs.get('tz_iana') or 'UTC') if _uprefs else 'UTC'
-            _pref_fmt  = (_uprefs.get('time_fmt') or '24')  if _uprefs else '24'
-            _now_utc = datetime.datetime.now(datetime.timezone.utc)
-            try:
-                import zoneinfo
-                _tz_obj = zoneinfo.ZoneInfo(_pref_iana)
-            except Exception:
-                _tz_obj = datetime.timezone.utc
-            _dt_local = _now_utc.astimezone(_tz_obj)
-            try:
-                _tz_label = _dt_local.strftime('%Z')
-            except Exception:
-                _tz_label = _pref_iana
-            if _pref_fmt == '12':
-                _time_str = _dt_local.strftime('%-I:%M %p')  # e.g. 8:42 PM
-                _full_str = _dt_local.strftime('%A, %B %-d, %Y %-I:%M %p') + f' {_tz_label}'
-            else:
-                _time_str = _dt_local.strftime('%H:%M')       # e.g. 20:42
-                _full_str = _dt_local.strftime('%A, %B %-d, %Y %H:%M') + f' {_tz_label}'
-            messages.append({
-                "role": "system",
-                "content": (
-                    f"The current date and time RIGHT NOW is: {_full_str}. "
-                    f"The user's preferred timezone is {_tz_label} and format is {'12-hour' if _pref_fmt == '12' else '24-hour'}. "
-                    "State ONLY the requested date/time fact using the user's preferred timezone and format. "
-                    "Do NOT add any commentary, emoji, or follow-up after giving it."
-                ),
-            })
-        API_TASK_QUEUE.put_nowait((bot, trigger, messages, review_mode, is_pm, bot_nick, chan_lock, search_mode))
-    except queue.Full:
+    # Hand the request to the API engine; fail gracefully if its backlog is full
+    engine = bot.memory.get('grok_engine')
+    args = (bot, trigger, messages, review_mode, is_pm, bot_nick, search_mode, mode, history)
+    # The worker holds its own pin on the log until the reply is recorded
+    history.pin()
+    if engine is None or not engine.submit(_api_worker, *args):
+        history.unpin()
         try:
-            _log(bot).warning('API task queue full; rejecting request from %s', trigger.nick)
+            _log(bot).warning('API engine busy; rejecting request from %s', trigger.nick)
             bot.say('Grok is currently busy; please try again in a moment.', trigger.sender)
         except Exception:
             pass
 
 
+def _time_instruction(bot, nick):
+    """Return the system instruction stating the current time in the nick's saved zone/format."""
+    # Load this user's saved preferences (tz + format), defaulting to UTC / 24hr.
+    _uprefs = _db_get_user_pref(bot, nick)
+    _pref_iana = (_uprefs.get('tz_iana') or 'UTC') if _uprefs else 'UTC'
+    _pref_fmt  = (_uprefs.get('time_fmt') or '24')  if _uprefs else '24'
+    _now_utc = datetime.datetime.now(datetime.timezone.utc)
+    try:
+        import zoneinfo
+        _tz_obj = zoneinfo.ZoneInfo(_pref_iana)
+    except Exception:
+        _tz_obj = datetime.timezone.utc
+    _dt_local = _now_utc.astimezone(_tz_obj)
+    try:
+        _tz_label = _dt_local.strftime('%Z')
+    except Exception:
+        _tz_label = _pref_iana
+    if _pref_fmt == '12':
+        _full_str = _dt_local.strftime('%A, %B %-d, %Y %-I:%M %p') + f' {_tz_label}'
+    else:
+        _full_str = _dt_local.strftime('%A, %B %-d, %Y %H:%M') + f' {_tz_label}'
+    return (
+        f"The current date and time RIGHT NOW is: {_full_str}. "
+        f"The user's preferred timezone is {_tz_label} and format is {'12-hour' if _pref_fmt == '12' else '24-hour'}. "
+        "State ONLY the requested date/time fact using the user's preferred timezone and format. "
+        "Do NOT add any commentary, emoji, or follow-up after giving it."
+    )
+
+
 @plugin.command('testemote')
 def testemote(bot, trigger):
     bot.say('Emote plugin loaded, bot nick: ' + bot.nick)
 
 
+def _stats_lines(bot):
+    """Return human-readable runtime counters, one IRC line per section."""
+    lines = []
+    metrics = bot.memory.get('grok_metrics') or {}
+    if metrics:
+        lines.append('API: ' + ', '.join(f'{k}={v}' for k, v in sorted(metrics.items())))
+    stages = []
+    for name, st in (bot.memory.get('grok_pipeline_stats') or {}).items():
+        total = st['passed'] + st['stopped']
+        avg_us = (st['seconds'] / total * 1e6) if total else 0.0
+        stages.append(f"{name} {st['passed']}/{st['stopped']} {avg_us:.1f}us")
+    if stages:
+        lines.append('Pipeline (passed/stopped avg): ' + ' | '.join(stages))
+    state = []
+    store = bot.memory.get('grok_history')
+    if store is not None:
+        state.append(store.stats())
+    for name in _STATE_MAPS:
+        m = bot.memory.get(name)
+        if m is not None:
+            state.append(f"{name[5:]} {len(m)}/{m.maxsize} evicted={m.evicted} expired={m.expired}")
+    if state:
+        lines.append('State: ' + ' | '.join(state))
+    writer = bot.memory.get('grok_db_writer')
+    if writer is not None:
+        lines.append(writer.stats())
+    cache = bot.memory.get('grok_db_cache')
+    if cache is not None:
+        lines.append(cache.stats())
+    index = bot.memory.get('grok_channel_index_stats')
+    if index and bot.memory.get('grok_channel_index'):
+        lines.append(
+            f"Channel index: indexed={index['indexed']} dropped={index['dropped']} "
+            f"searches={index['searches']} hits={index['hits']}"
+        )
+    prompt = bot.memory.get('grok_prompt_stats')
+    if prompt and prompt['requests']:
+        info = _estimate_tokens.cache_info()
+        lookups = info.hits + info.misses
+        lines.append(
+            f"Prompt: requests={prompt['requests']} avg tokens={prompt['tokens'] / prompt['requests']:.0f} "
+            f"max={prompt['max']} deduped={prompt['deduped']} over budget={prompt['dropped']} "
+            f"estimator cache={info.hits}/{lookups}"
+        )
+    usage = bot.memory.get('grok_cache_stats')
+    if usage and usage['calls']:
+        hits, misses = usage['hit_calls'], usage['calls'] - usage['hit_calls']
+        hit_ms = usage['hit_seconds'] / hits * 1e3 if hits else 0.0
+        miss_ms = usage['miss_seconds'] / misses * 1e3 if misses else 0.0
+        rate = usage['cached_tokens'] / usage['prompt_tokens'] * 100 if usage['prompt_tokens'] else 0.0
+        saved = max(miss_ms - hit_ms, 0.0) * hits / 1e3 if hits and misses else 0.0
+        lines.append(
+            f"Prompt cache: cached tokens={usage['cached_tokens']}/{usage['prompt_tokens']} ({rate:.1f}%) "
+            f"calls with hits={hits}/{usage['calls']} avg latency hit={hit_ms:.0f}ms miss={miss_ms:.0f}ms "
+            f"saved~{saved:.1f}s output tokens={usage['output_tokens']}"
+        )
+    engine = bot.memory.get('grok_engine')
+    if engine is not None and engine.submitted:
+        lines.append(engine.stats())
+    http = bot.memory.get('grok_http')
+    if http is not None and http.requests:
+        lines.append(http.stats())
+    replies = bot.memory.get('grok_reply_stats')
+    if replies:
+        parts = []
+        for kind in ('streamed', 'buffered'):
+            n = replies[kind]
+            if n:
+                parts.append(
+                    f"{kind}={n} avg first line={replies[kind + '_first'] / n * 1e3:.0f}ms "
+                    f"last line={replies[kind + '_last'] / n * 1e3:.0f}ms"
+                )
+        lines.append('Replies: ' + ' | '.join(parts))
+    output = bot.memory.get('grok_output_stats')
+    if output and output['replies']:
+        share = output['discarded'] / output['tokens'] * 100 if output['tokens'] else 0.0
+        lines.append(
+            f"Reply output: replies={output['replies']} est tokens={output['tokens']} "
+            f"discarded={output['discarded']} ({share:.1f}%) streams stopped at display limit={output['stopped']} "
+            f"hit token cap={output['capped']}"
+        )
+    chain = bot.memory.get('grok_chain_stats')
+    if chain and chain['bytes_full']:
+        saved = (1 - chain['bytes_sent'] / chain['bytes_full']) * 100
+        lines.append(
+            f"Response chains: active={len(bot.memory.get('grok_chains') or ())} chained={chain['chained']} "
+            f"full={chain['full']} resets={chain['resets']} "
+            f"payload bytes={chain['bytes_sent']}/{chain['bytes_full']} (saved {saved:.1f}%) "
+            f"avg input tokens chained={chain['tokens_chained'] / max(chain['chained'], 1):.0f} "
+            f"full={chain['tokens_full'] / max(chain['full'], 1):.0f}"
+        )
+    retrieval = bot.memory.get('grok_retrieval_stats')
+    if retrieval and retrieval['queries']:
+        q = retrieval['queries']
+        lines.append(
+            f"History retrieval: queries={q} avg pool={retrieval['pool'] / q:.1f} "
+            f"avg selected={retrieval['selected'] / q:.1f} avg={retrieval['seconds'] / q * 1e3:.2f}ms"
+        )
+    retention = bot.memory.get('grok_retention')
+    if retention:
+        lines.append(
+            f"Retention: runs={retention['runs']} pruned per-nick={retention['per_nick']} "
+            f"age={retention['age']} size={retention['size']} channel index={retention['channel_index']} "
+            f"vacuumed pages={retention['vacuum_pages']} "
+            f"last run={retention['seconds']:.2f}s"
+        )
+    return lines
+
+
+@plugin.command('grokstats')
+def grokstats(bot, trigger):
+    """Show Grok runtime counters (bot admin/owner only)."""
+    if not _is_admin(bot, trigger):
+        try:
+            bot.reply('You are not authorized to use admin commands.')
+        except Exception:
+            pass
+        return
+    lines = _stats_lines(bot) or ['No stats collected yet.']
+    for text in lines:
+        send(bot, trigger.sender, text)
+
+
 @plugin.command('grokreset')
 def grokreset(bot, trigger):
     """Reset Grok history.
@@ -1675,13 +4835,12 @@ def grokreset(bot, trigger):
 
     # PM: always treat as self-reset
     if is_pm:
-        key = ('PM', trigger.nick.lower())
+        key = _conversation_key(trigger, is_pm)
         try:
-            gh = bot.memory.get('grok_history', {})
-            if key in gh:
-                del gh[key]
+            bot.memory['grok_history'].pop(key)
         except Exception:
             pass
+        _drop_chains(bot, key)
         try:
             _db_clear_user(bot, trigger.nick)
         except Exception:
@@ -1705,14 +4864,13 @@ def grokreset(bot, trigger):
                 pass
             return
 
-        # Remove per-(channel,nick) entries and any channel-only legacy keys
-        keys = list(bot.memory.get('grok_history', {}).keys())
-        for k in keys:
-            try:
-                if (isinstance(k, tuple) and k[0] == trigger.sender) or (k == trigger.sender):
-                    del bot.memory['grok_history'][k]
-            except Exception:
-                continue
+        # Drop the channel's whole log, in memory and in the channel index
+        try:
+            bot.memory['grok_history'].pop(trigger.sender)
+        except Exception:
+            pass
+        _db_drop_channel_index(bot, trigger.sender)
+        _drop_chains(bot, trigger.sender)
         try:
             bot.say('Grok history reset for this channel.', trigger.sender)
         except Exception:
@@ -1720,17 +4878,13 @@ def grokreset(bot, trigger):
         return
 
     # Default: self reset (works for non-ops)
-    # Clear per-(channel,nick) in-memory context
+    # Clear this user's lines (and the bot's replies to them) from the channel log
     try:
-        keys = list(bot.memory.get('grok_history', {}).keys())
-        for k in keys:
-            try:
-                if isinstance(k, tuple) and k[0] == trigger.sender and str(k[1]).lower() == trigger.nick.lower():
-                    del bot.memory['grok_history'][k]
-            except Exception:
-                continue
+        bot.memory['grok_history'].drop_view(trigger.sender, trigger.nick)
     except Exception:
         pass
+    _db_drop_channel_index(bot, trigger.sender, trigger.nick)
+    _drop_chains(bot, trigger.sender, trigger.nick)
     # Clear DB-backed per-user history too, otherwise the bot may still use stored context
     try:
         _db_clear_user(bot, trigger.nick)
@@ -0,0 +1,126 @@
+# Shared helpers for the benchmark scripts: load the plugin outside Sopel and drive
+# it with a minimal stand-in for the bot and its triggers.
+import argparse
+import asyncio
+import importlib.util
+import logging
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PLUGIN = os.path.join(os.path.dirname(HERE), 'ai-grok.py')
+
+
+def parser(description):
+    """Argument parser with the --plugin option every script takes."""
+    ap = argparse.ArgumentParser(description=description)
+    ap.add_argument(
+        '--plugin', default=PLUGIN,
+        help='plugin file to load (default: this tree); use `git show REV:ai-grok.py` '
+             'output to measure an older revision',
+    )
+    return ap
+
+
+def load(path=PLUGIN, name='ai_grok'):
+    """Import the plugin file as a module, with its SQLite DB in a fresh temp dir."""
+    os.environ['AI_GROK_DIR'] = tempfile.mkdtemp(prefix='grok-bench-')
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class _Section:
+    """[grok] config section: attribute defaults come from the plugin's code."""
+
+    def __init__(self, **settings):
+        self.api_key = 'bench'
+        self.model = 'grok-3'
+        self.system_prompt = 'You are a helpful IRC bot.'
+        self.blocked_channels = []
+        self.banned_nicks = []
+        self.ignored_nicks = []
+        self.intent_check = 'heuristic'
+        self.http_prewarm = False
+        self.__dict__.update(settings)
+
+    def __getattr__(self, name):
+        raise AttributeError(name)
+
+
+class _Namespace:
+    pass
+
+
+class Bot:
+    """Just enough of sopel.bot.Sopel for setup(), handle() and the API engine."""
+
+    def __init__(self, nick='glitchy', **settings):
+        self.nick = nick
+        self.memory = {}
+        self.channels = {}
+        self.logger = logging.getLogger('grok-bench')
+        self.config = _Namespace()
+        self.config.core = _Namespace()
+        self.config.core.nick = nick
+        self.config.core.owner = 'owner'
+        self.config.core.admins = []
+        self.config.grok = _Section(**settings)
+        self.config.define_section = lambda *args, **kwargs: None
+        self.said = []
+        self.said_at = []
+
+    def say(self, text, recipient=None):
+        self.said.append((recipient, text))
+        self.said_at.append(time.perf_counter())
+
+    def action(self, text, recipient=None):
+        self.said.append((recipient, '* ' + text))
+
+    def reply(self, text):
+        self.say(text)
+
+
+class Trigger:
+    """A PRIVMSG from `nick` to `sender` (a channel, or the nick itself for a PM)."""
+
+    def __init__(self, nick, sender, text):
+        self.nick = nick
+        self.sender = sender
+        self.is_privmsg = not sender.startswith('#')
+        self.owner = False
+        self.admin = False
+        self._text = text
+
+    def group(self, n=0):
+        return self._text if n == 0 else None
+
+
+def wait_idle(bot, timeout=60):
+    """Wait until the API engine has no request queued or in flight."""
+    end = time.time() + timeout
+    # handle() dispatches addressed lines on their own thread first
+    time.sleep(0.2)
+    while time.time() < end:
+        engine = bot.memory.get('grok_engine')
+        if engine is None or engine.pending == 0:
+            return
+        time.sleep(0.01)
+    raise TimeoutError('API engine still busy after %ss' % timeout)
+
+
+def allow_next(bot, trigger):
+    """Clear the rate limits so the next line from the trigger's nick is answered."""
+    bot.memory['grok_last'].pop(trigger.sender, None)
+    bot.memory['grok_user_last'].pop((trigger.sender, trigger.nick), None)
+
+
+def stop(m, bot):
+    """Call the plugin's shutdown hook (revisions before the DB pool have none)."""
+    shutdown = getattr(m, 'shutdown', None)
+    if shutdown is not None:
+        shutdown(bot)
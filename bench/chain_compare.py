@@ -0,0 +1,74 @@
+"""Chained vs full requests (response_chaining) against bench/mock_api.py.
+
+Runs the same PM conversation with response_chaining off and on and reports, from
+the mock's request log, the request bytes sent and the input tokens billed (the
+mock bills a follow-up for its whole stored chain, as the API does). A third run
+streams replies long enough to be stopped at the display limit: those responses
+never complete, so no follow-up may chain from them. A last run checks that channel
+questions are sent in full even with chaining on.
+
+    python bench/chain_compare.py [--plugin PATH] [--turns N]
+"""
+import sys
+
+import _plugin
+from mock_api import MockAPI
+
+QUESTIONS = [
+    'tell me about stouts', 'and porters?', 'which is darker?', 'what food goes with them?', 'recommend a brand',
+    'how cold should I serve it?', 'what glass?', 'how long does it keep?', 'can I cook with it?', 'anything else?',
+]
+
+
+def _converse(m, api, sender, turns, **settings):
+    bot = _plugin.Bot(
+        api_base=api.base, system_prompt='You are a helpful IRC bot with a long, detailed persona. ' * 20,
+        **settings,
+    )
+    m.setup(bot)
+    try:
+        for i in range(turns):
+            trigger = _plugin.Trigger('dave', sender, '%s%s (%d)' % (
+                '' if sender == 'dave' else 'glitchy: ', QUESTIONS[i % len(QUESTIONS)], i))
+            _plugin.allow_next(bot, trigger)
+            m.handle(bot, trigger)
+            _plugin.wait_idle(bot)
+        stats = [line for line in m._stats_lines(bot) if line.startswith('Response chains')]
+    finally:
+        m.shutdown(bot)
+    return api.log(), stats
+
+
+def _report(name, log, stats):
+    chained = sum(1 for r in log if r['previous_response_id'])
+    print('%-26s requests=%d chained=%d request bytes=%d input tokens billed=%d' % (
+        name, len(log), chained, sum(r['request_bytes'] for r in log), sum(r['input_tokens'] for r in log)))
+    for line in stats:
+        print('    ' + line)
+
+
+def main():
+    ap = _plugin.parser(__doc__.splitlines()[0])
+    ap.add_argument('--turns', type=int, default=20, help='questions per conversation')
+    args = ap.parse_args()
+    m = _plugin.load(args.plugin)
+    ok = True
+    with MockAPI(words=40) as api:
+        log, stats = _converse(m, api, 'dave', args.turns, response_chaining=False, stream_replies=False)
+        _report('PM, full', log, stats)
+        log, stats = _converse(m, api, 'dave', args.turns, response_chaining=True, stream_replies=False)
+        _report('PM, chained', log, stats)
+        ok &= sum(1 for r in log if r['previous_response_id']) == args.turns - 1
+        log, stats = _converse(m, api, '#beer', args.turns, response_chaining=True, stream_replies=False)
+        _report('channel, chaining on', log, stats)
+        ok &= not any(r['previous_response_id'] for r in log)
+    with MockAPI(words=600) as api:
+        log, stats = _converse(m, api, 'dave', args.turns // 2, response_chaining=True, stream_replies=True)
+        _report('PM, streams cut short', log, stats)
+        ok &= not any(r['previous_response_id'] for r in log)
+    print('OK' if ok else 'FAILED: chaining did not behave as described')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
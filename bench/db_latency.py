@@ -0,0 +1,42 @@
+"""DB latency of one mention, as handle() and the API worker pay it.
+
+Seeds the history table, then times the DB calls one addressed line makes:
+_db_get_recent and _db_get_user_pref on the handler, _db_add_turn for the user's
+turn and for the reply. Reports mean, p50 and p99 over the iterations.
+
+    python bench/db_latency.py [--plugin PATH] [--iterations N]
+"""
+import statistics
+import time
+
+import _plugin
+
+
+def main():
+    ap = _plugin.parser(__doc__.splitlines()[0])
+    ap.add_argument('--iterations', type=int, default=2000)
+    ap.add_argument('--seed-rows', type=int, default=5000)
+    args = ap.parse_args()
+    m = _plugin.load(args.plugin)
+    bot = _plugin.Bot()
+    m.setup(bot)
+    for i in range(args.seed_rows):
+        m._db_add_turn(bot, 'nick%d' % (i % 50), 'user', 'seed line %d' % i, '#a')
+    m._db_set_user_pref(bot, 'nick1', tz='Europe/Berlin')
+    samples = []
+    for i in range(args.iterations):
+        started = time.perf_counter()
+        m._db_get_recent(bot, 'nick1', limit=20)
+        m._db_get_user_pref(bot, 'nick1')
+        m._db_add_turn(bot, 'nick1', 'user', 'question %d' % i, '#a')
+        m._db_add_turn(bot, 'nick1', 'assistant', 'answer %d' % i, '#a')
+        samples.append(time.perf_counter() - started)
+    _plugin.stop(m, bot)
+    samples.sort()
+    print('mention-path DB time over %d mentions: mean %.3f ms, p50 %.3f ms, p99 %.3f ms' % (
+        len(samples), statistics.mean(samples) * 1e3, samples[len(samples) // 2] * 1e3,
+        samples[int(len(samples) * 0.99)] * 1e3))
+
+
+if __name__ == '__main__':
+    main()
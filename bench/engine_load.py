@@ -0,0 +1,74 @@
+"""API engine throughput under load against bench/mock_api.py.
+
+Submits a burst of requests straight to the API workers (bypassing handle()'s rate
+limits) while the mock answers each after a fixed delay, and reports, per
+api_concurrency setting, the replies per second, the most requests the mock saw in
+flight at once, the peak thread count and the process max RSS. Revisions before the
+asyncio engine run their fixed pool of worker threads instead.
+
+    python bench/engine_load.py [--plugin PATH] [--requests N] [--delay S] [--concurrency 3 16 64]
+"""
+import inspect
+import resource
+import threading
+import time
+
+import _plugin
+from mock_api import MockAPI
+
+
+def _args(m, bot, i):
+    """Positional arguments for _api_worker, whatever its revision takes."""
+    values = {
+        'bot': bot, 'trigger': _plugin.Trigger('n%d' % i, '#load', 'glitchy: hi'),
+        'messages': [{'role': 'system', 'content': 'sys'}, {'role': 'user', 'content': 'hello there'}],
+        'review_mode': False, 'is_pm': False, 'bot_nick': 'glitchy', 'chan_lock': threading.Lock(),
+        'search_mode': False,
+    }
+    params = inspect.signature(m._api_worker).parameters
+    return tuple(values[name] for name in params if name in values)
+
+
+def _run(m, api, concurrency, requests):
+    sent = []
+    m.send = lambda bot, channel, text: sent.append(text)
+    bot = _plugin.Bot(api_base=api.base, api_concurrency=concurrency, stream_replies=False)
+    m.setup(bot)
+    engine = bot.memory.get('grok_engine')
+    api.peak()
+    started = time.perf_counter()
+    for i in range(requests):
+        args = _args(m, bot, i)
+        if engine is None:
+            m.API_TASK_QUEUE.put(args)
+        else:
+            while not engine.submit(m._api_worker, *args):
+                time.sleep(0.001)
+    threads = threading.active_count()
+    while len(sent) < requests and time.perf_counter() - started < 300:
+        threads = max(threads, threading.active_count())
+        time.sleep(0.005)
+    wall = time.perf_counter() - started
+    label = 'api_concurrency=%d' % concurrency if engine is not None else 'worker threads=%d' % m.API_WORKER_COUNT
+    print('%-20s %d replies in %.2fs = %6.1f req/s, mock peak in flight %3d, threads %3d, max RSS %d MB' % (
+        label, len(sent), wall, len(sent) / wall, api.peak(), threads,
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024))
+    _plugin.stop(m, bot)
+    return engine is not None
+
+
+def main():
+    ap = _plugin.parser(__doc__.splitlines()[0])
+    ap.add_argument('--requests', type=int, default=200)
+    ap.add_argument('--delay', type=float, default=0.5, help='seconds the mock takes per request')
+    ap.add_argument('--concurrency', type=int, nargs='+', default=[3, 16, 64])
+    args = ap.parse_args()
+    m = _plugin.load(args.plugin)
+    with MockAPI(think=args.delay, words=2) as api:
+        for concurrency in args.concurrency:
+            if not _run(m, api, concurrency, args.requests):
+                break
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""HTTPS connection reuse of the API client against a local TLS stand-in.
+
+Starts a threaded HTTPS server with a throwaway self-signed certificate (made with
+the openssl CLI) that answers chat completions and counts the TLS connections it
+accepts. Three threads then make the chat completions call repeatedly, and the
+script reports the wall time, the latency p50/p95 and how many connections were
+opened. Finally one 503 is injected to show the transport retry.
+
+    python bench/http_reuse.py [--plugin PATH] [--calls N]
+"""
+import asyncio
+import json
+import os
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import _plugin
+
+CONNECTIONS = [0]
+FAIL_NEXT = [0]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        CONNECTIONS[0] += 1
+        super().setup()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        if FAIL_NEXT[0]:
+            FAIL_NEXT[0] -= 1
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+        data = json.dumps({'choices': [{'message': {'content': 'ok'}}], 'usage': {'prompt_tokens': 10}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _serve_tls():
+    tmp = tempfile.mkdtemp(prefix='grok-bench-tls-')
+    cert, key = os.path.join(tmp, 'cert.pem'), os.path.join(tmp, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=127.0.0.1',
+         '-addext', 'subjectAltName=IP:127.0.0.1', '-keyout', key, '-out', cert],
+        check=True, capture_output=True,
+    )
+    # Both requests and httpx pick the CA bundle up from the environment
+    os.environ['REQUESTS_CA_BUNDLE'] = os.environ['SSL_CERT_FILE'] = cert
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _call(m, bot, messages):
+    args = (bot, messages, 'grok-3', 0.9, 100)
+    if asyncio.iscoroutinefunction(m._call_chat_completions_api):
+        return bot.memory['grok_engine'].run(m._call_chat_completions_api(*args))
+    return m._call_chat_completions_api(*args)
+
+
+def main():
+    ap = _plugin.parser(__doc__.splitlines()[0])
+    ap.add_argument('--calls', type=int, default=100, help='calls per thread (3 threads)')
+    args = ap.parse_args()
+    server = _serve_tls()
+    base = 'https://127.0.0.1:%d/v1' % server.server_port
+    m = _plugin.load(args.plugin)
+    bot = _plugin.Bot(api_base=base)
+    m.setup(bot)
+    if not hasattr(m, '_api_url'):
+        # Revisions before api_base post to the hard-coded xAI URL
+        post = m.requests.post
+        m.requests.post = lambda url, **kw: post(url.replace('https://api.x.ai/v1', base), **kw)
+    messages = [{'role': 'user', 'content': 'hi ' * 200}]
+    latencies = []
+
+    def worker():
+        for _ in range(args.calls):
+            started = time.perf_counter()
+            _call(m, bot, messages)
+            latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    latencies.sort()
+    print('%d calls from 3 threads: wall %.2fs, p50 %.1f ms, p95 %.1f ms, TLS connections opened %d' % (
+        len(latencies), wall, latencies[len(latencies) // 2] * 1e3, latencies[int(len(latencies) * 0.95)] * 1e3,
+        CONNECTIONS[0]))
+    http = bot.memory.get('grok_http')
+    if http is not None:
+        FAIL_NEXT[0] = 1
+        print('after one 503:', _call(m, bot, messages))
+        print(http.stats())
+    _plugin.stop(m, bot)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
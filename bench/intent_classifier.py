@@ -0,0 +1,87 @@
+"""One-pass intent classifier vs the separate regex scans it replaced.
+
+Builds a corpus of typical IRC lines and runs, per line, the scans handle() used
+to make before _classify_intent (search, time, review recompiled per call, tz-set,
+fmt-set, command), then _classify_intent. Checks the two agree on every line and
+reports the cost per line on the mixed corpus and on lines with no intent.
+
+    python bench/intent_classifier.py [--plugin PATH] [--lines N]
+"""
+import random
+import re
+import sys
+import time
+
+import _plugin
+
+BASE = [
+    "lol", "anyone know why my build is failing", "what's the weather like in chicago today",
+    "I'm in CST btw", "i prefer 12-hour time", "thoughts on rust vs go?", "what time is it",
+    "who won the game last night", "brb coffee", "has anyone tried the new kernel update",
+    "git push --force is fine right", "^^", ".help", "my timezone is pacific", "is elvis dead",
+    "summarize this convo", "the score was 3-2", "nah that's wrong", "can you explain how tcp handshakes work",
+    "lmao", "ok", "did the deploy happen yet", "what day is it", "ping", "good morning everyone",
+    "i use 24h clocks", "latest news on openai", "tell me a joke", "how do i exit vim", "sudo rm -rf / (jk)",
+]
+NO_INTENT = ["lol", "brb coffee", "git push --force is fine right", "lmao", "ok", "ping", "good morning everyone"]
+
+
+def _separate_scans(m, text):
+    """The per-message regex passes handle() made before the classifier."""
+    review_re = re.compile(
+        r"\b(thoughts?|opinion|what do you think|summarize|give (me )?(your )?(take|opinion)|opine)\b", re.IGNORECASE)
+    review = bool(review_re.search(text)) or text.strip() == '^^'
+    command = bool(re.match(r'^[.!/]', text))
+    time_q = bool(m._TIME_INTENT_RE.search(text))
+    search = bool(m._SEARCH_INTENT_RE.search(text))
+    tz_match = m._TZ_SET_RE.search(text)
+    tz = m._TZ_ABBR_MAP.get(tz_match.group(1).upper()) if tz_match else None
+    fmt_match = m._FMT_SET_RE.search(text)
+    fmt = None
+    if fmt_match:
+        raw = fmt_match.group(1).lower().replace(' ', '').replace('-', '')
+        fmt = '12' if raw.startswith('12') else '24'
+    return search, time_q, review, tz, fmt, command
+
+
+def _classifier(m, text):
+    intent = m._classify_intent(text)
+    return intent.search, intent.time, intent.review, intent.tz, intent.fmt, intent.command
+
+
+def _per_line_us(fn, m, corpus, repeat=3):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for text in corpus:
+            fn(m, text)
+    return (time.perf_counter() - started) / len(corpus) / repeat * 1e6
+
+
+def main():
+    ap = _plugin.parser(__doc__.splitlines()[0])
+    ap.add_argument('--lines', type=int, default=20000)
+    args = ap.parse_args()
+    m = _plugin.load(args.plugin)
+    rnd = random.Random(7)
+    corpus = [
+        rnd.choice(BASE) + ('' if rnd.random() < 0.7 else ' ' + rnd.choice(BASE))
+        for _ in range(args.lines)
+    ]
+    quiet = [rnd.choice(NO_INTENT) for _ in range(args.lines)]
+    # Revisions since the linear-time work confirm anchors with RE2 when installed
+    engines = ['re'] + (['re2'] if getattr(m, 're2', None) is not None else [])
+    mismatches = 0
+    for engine in engines if hasattr(m, '_set_regex_engine') else ['re']:
+        if hasattr(m, '_set_regex_engine'):
+            m._set_regex_engine(engine)
+        differ = sum(_separate_scans(m, text) != _classifier(m, text) for text in corpus)
+        mismatches += differ
+        print('%s: %d lines, %d mismatches between the two' % (engine, len(corpus), differ))
+        for name, lines in (('mixed corpus', corpus), ('no-intent lines', quiet)):
+            print('  %-16s separate scans %.1f us/line, classifier %.1f us/line' % (
+                name + ':', _per_line_us(_separate_scans, m, lines), _per_line_us(_classifier, m, lines)))
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
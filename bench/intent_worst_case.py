@@ -0,0 +1,69 @@
+"""Worst-case cost of the intent heuristics on adversarial long lines.
+
+Each line shape repeats a filler that the heuristic patterns ("if a ... glitchy",
+"i'm ... <tz>", "use ... 12h", "is ... dead") can backtrack over, padded to the
+given length and ending with the bot's nick. Reports the time per line of
+_heuristic_intent_check plus _classify_intent, for each regex engine available
+and with the HEURISTIC_MAX_LINE_LEN cap on and off.
+
+    python bench/intent_worst_case.py [--plugin PATH] [--lengths 400 4000]
+"""
+import time
+
+import _plugin
+
+SHAPES = {
+    'quoted_use': 'if ' + 'a ' * 199 + 'glitchy',
+    'quoted_use2': 'you ' * 100 + 'glitchy',
+    'tz_set': "i'm " * 100,
+    'fmt_set': 'use ' * 100 + '12',
+    'search_dead': 'is ' * 133 + 'today',
+    'predicative': 'is ' * 133 + 'glitchy',
+    'mixed': ("i'm in you say if when is did " * 20)[:390] + ' glitchy today 12',
+}
+
+
+def _line(shape, length):
+    return (shape * (length // len(shape) + 1))[:length - 8] + ' glitchy'
+
+
+def _worst(m, bot, lengths, repeat=20):
+    bot.memory.pop('grok_nick_matcher', None)
+    matcher = m._nick_matcher(bot)
+    times = {}
+    for name, shape in SHAPES.items():
+        for length in lengths:
+            line = _line(shape, length)
+            started = time.perf_counter()
+            for _ in range(repeat):
+                m._heuristic_intent_check(bot, None, line, matcher)
+                m._classify_intent(line)
+            times[(name, length)] = (time.perf_counter() - started) / repeat * 1e3
+    return times
+
+
+def main():
+    ap = _plugin.parser(__doc__.splitlines()[0])
+    ap.add_argument('--lengths', type=int, nargs='+', default=[400, 4000])
+    args = ap.parse_args()
+    m = _plugin.load(args.plugin)
+    bot = _plugin.Bot()
+    # Revisions before the linear-time work have neither the engine switch nor the cap
+    runs = [('re', None)]
+    if hasattr(m, '_set_regex_engine'):
+        engines = ['re'] + (['re2'] if m.re2 is not None else [])
+        runs = [(engine, cap) for engine in engines for cap in (None, m.HEURISTIC_MAX_LINE_LEN)]
+    for engine, cap in runs:
+        if hasattr(m, '_set_regex_engine'):
+            m._set_regex_engine(engine)
+            m.HEURISTIC_MAX_LINE_LEN = cap or 10 ** 9
+        times = _worst(m, bot, args.lengths)
+        label = 'engine=%-3s cap=%-4s' % (engine, cap or 'none')
+        for length in args.lengths:
+            row = {name: t for (name, n), t in times.items() if n == length}
+            worst = max(row, key=row.get)
+            print('%s %5d chars: worst %.2f ms/line (%s)' % (label, length, row[worst], worst))
+
+
+if __name__ == '__main__':
+    main()
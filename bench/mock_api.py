@@ -0,0 +1,238 @@
+# Local stand-in for the xAI API, for the benchmark scripts.
+#
+# Serves POST /v1/chat/completions and /v1/responses, buffered or as SSE streams
+# (stream: true), with a fixed think time and a per-token delay, and GET /v1/models.
+# Responses sent with store: true are kept, so previous_response_id works: a follow-up
+# is billed input tokens for the whole stored chain plus its own input, the way the
+# real API bills it. Unknown ids get a 404.
+#
+# Test hooks: GET /v1/log returns (and clears) one record per API request, GET /peak
+# the most POSTs in flight at once since the last read, and POST /v1/control updates
+# the settings below (e.g. {"fail_after": 150} drops the next stream after 150 tokens).
+#
+#   python bench/mock_api.py PORT [--think S] [--token S] [--words N]
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+WORDS = 'the quick brown fox jumps over lazy dogs while servers deploy kernels and alice drinks stout'.split()
+
+
+def _tokens(text):
+    """Rough token count of request text (about 4 chars per token)."""
+    return max(1, len(text) // 4)
+
+
+class _Server:
+    def __init__(self, think, token, words):
+        self.settings = {'think': think, 'token': token, 'words': words, 'fail_after': None}
+        self.ids = itertools.count(1)
+        self.stored = {}
+        self.log = []
+        self.live = 0
+        self.peak = 0
+
+    def reply_text(self, rid):
+        rnd = random.Random(rid)
+        return ' '.join(rnd.choice(WORDS) for _ in range(self.settings['words'])) + ' [1].'
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                length = 0
+                for line in head.split(b'\r\n'):
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':')[1])
+                body = json.loads(await reader.readexactly(length)) if length else {}
+                method, path = head.split(b' ')[:2]
+                path = path.decode()
+                if path.endswith('/control'):
+                    self.settings.update(body)
+                    await self.send_json(writer, {'ok': True})
+                elif path.endswith('/log'):
+                    await self.send_json(writer, self.log)
+                    self.log = []
+                elif path.endswith('/peak'):
+                    await self.send_json(writer, self.peak)
+                    self.peak = 0
+                elif method == b'GET':
+                    await self.send_json(writer, {'data': []})
+                else:
+                    self.live += 1
+                    self.peak = max(self.peak, self.live)
+                    try:
+                        if not await self.complete(writer, path, body):
+                            return
+                    finally:
+                        self.live -= 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        writer.close()
+
+    async def complete(self, writer, path, body):
+        """Answer one API request; False if the connection was dropped."""
+        rid = next(self.ids)
+        is_responses = path.endswith('/responses')
+        prev = body.get('previous_response_id')
+        if prev and prev not in self.stored:
+            await self.send_json(writer, {'error': 'response not found'}, status=b'404 Not Found')
+            return True
+        sent = json.dumps(body.get('input') or body.get('messages') or []) + (body.get('instructions') or '')
+        input_tokens = self.stored.get(prev, 0) + _tokens(sent)
+        cap = body.get('max_tokens') or body.get('max_output_tokens')
+        tokens = [word + ' ' for word in self.reply_text(rid).split(' ')]
+        capped = bool(cap) and len(tokens) > cap
+        if capped:
+            tokens = tokens[:cap]
+        tokens[-1] = tokens[-1].rstrip()
+        text = ''.join(tokens)
+        record = {
+            'path': path, 'stream': bool(body.get('stream')), 'max_tokens': cap, 'previous_response_id': prev,
+            'request_bytes': len(json.dumps(body)), 'input_tokens': input_tokens, 'generated': 0,
+        }
+        self.log.append(record)
+        started = time.monotonic()
+        status = 'incomplete' if capped else 'completed'
+        response = {
+            'id': 'resp_%d' % rid, 'status': status,
+            'incomplete_details': {'reason': 'max_output_tokens'} if capped else None,
+            'usage': {'input_tokens': input_tokens, 'output_tokens': len(tokens), 'input_tokens_details': {'cached_tokens': 0}},
+            'output': [{'type': 'message', 'role': 'assistant', 'content': [{
+                'type': 'output_text', 'text': text,
+                'annotations': [{'type': 'url_citation', 'url': 'https://example.com/%d' % rid}],
+            }]}],
+        }
+        chat_usage = {'prompt_tokens': input_tokens, 'completion_tokens': len(tokens), 'prompt_tokens_details': {'cached_tokens': 0}}
+        finish = 'length' if capped else 'stop'
+        if is_responses and body.get('store') and not capped:
+            # The stored chain grows by this request's input and the reply
+            self.stored[response['id']] = input_tokens + len(tokens)
+
+        if not body.get('stream'):
+            await asyncio.sleep(self.settings['think'] + self.settings['token'] * len(tokens))
+            record.update(generated=len(tokens), seconds=round(time.monotonic() - started, 2))
+            if is_responses:
+                await self.send_json(writer, response)
+            else:
+                await self.send_json(writer, {
+                    'choices': [{'message': {'content': text}, 'finish_reason': finish}], 'usage': chat_usage,
+                })
+            return True
+
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n')
+
+        async def event(data, name=None):
+            chunk = ('event: %s\n' % name if name else '') + 'data: %s\n\n' % (data if isinstance(data, str) else json.dumps(data))
+            chunk = chunk.encode()
+            writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            await writer.drain()
+
+        if is_responses:
+            created = {'id': response['id'], 'status': 'in_progress', 'output': []}
+            await event({'type': 'response.created', 'response': created}, 'response.created')
+        await asyncio.sleep(self.settings['think'])
+        for i, token in enumerate(tokens):
+            if self.settings['fail_after'] is not None and i == self.settings['fail_after']:
+                self.settings['fail_after'] = None
+                self.stored.pop(response['id'], None)
+                writer.close()
+                return False
+            await asyncio.sleep(self.settings['token'])
+            if writer.is_closing():
+                # The client stopped reading: the response never completes
+                self.stored.pop(response['id'], None)
+                return False
+            record.update(generated=i + 1, seconds=round(time.monotonic() - started, 2))
+            if is_responses:
+                await event({'type': 'response.output_text.delta', 'delta': token}, 'response.output_text.delta')
+            else:
+                await event({'choices': [{'index': 0, 'delta': {'content': token}}]})
+        if is_responses:
+            kind = 'response.incomplete' if capped else 'response.completed'
+            await event({'type': kind, 'response': response}, kind)
+        else:
+            await event({'choices': [{'index': 0, 'delta': {}, 'finish_reason': finish}]})
+            await event({'choices': [], 'usage': chat_usage})
+            await event('[DONE]')
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+        return True
+
+    @staticmethod
+    async def send_json(writer, obj, status=b'200 OK'):
+        data = json.dumps(obj).encode()
+        writer.write(
+            b'HTTP/1.1 %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n' % (status, len(data)) + data
+        )
+        await writer.drain()
+
+
+class MockAPI:
+    """Run the mock in a subprocess (so it does not share the bot's GIL) while in use."""
+
+    def __init__(self, think=0.0, token=0.0, words=60):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.port = sock.getsockname()[1]
+        sock.close()
+        self.base = 'http://127.0.0.1:%d/v1' % self.port
+        self._proc = subprocess.Popen([
+            sys.executable, __file__, str(self.port),
+            '--think', str(think), '--token', str(token), '--words', str(words),
+        ])
+        for _ in range(200):
+            try:
+                socket.create_connection(('127.0.0.1', self.port)).close()
+                break
+            except OSError:
+                time.sleep(0.025)
+
+    def _call(self, path, obj=None):
+        data = json.dumps(obj).encode() if obj is not None else None
+        req = urllib.request.Request(self.base + path, data=data, method='POST' if data else 'GET')
+        with urllib.request.urlopen(req) as r:
+            return json.loads(r.read())
+
+    def control(self, **settings):
+        self._call('/control', settings)
+
+    def log(self):
+        return self._call('/log')
+
+    def peak(self):
+        return self._call('/peak')
+
+    def close(self):
+        self._proc.kill()
+        self._proc.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+async def _serve(port, think, token, words):
+    server = _Server(think, token, words)
+    srv = await asyncio.start_server(server.handle, '127.0.0.1', port, backlog=1024)
+    async with srv:
+        await srv.serve_forever()
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Local stand-in for the xAI API')
+    ap.add_argument('port', type=int)
+    ap.add_argument('--think', type=float, default=0.0, help='seconds before the first token')
+    ap.add_argument('--token', type=float, default=0.0, help='seconds per generated token')
+    ap.add_argument('--words', type=int, default=60, help='words per reply (one token each)')
+    args = ap.parse_args()
+    asyncio.run(_serve(args.port, args.think, args.token, args.words))
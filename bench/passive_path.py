@@ -0,0 +1,47 @@
+"""Passive channel logging throughput through handle().
+
+Feeds synthetic channel lines that do not address the bot through handle() the
+way Sopel dispatches it: on a new thread per line unless the rule is registered
+with thread=False, inline otherwise. Reports lines per second.
+
+    python bench/passive_path.py [--plugin PATH] [--lines N]
+"""
+import random
+import threading
+import time
+
+import _plugin
+
+WORDS = 'the beer lime corona rust python build deploy broken lol yeah nah idk server down again why is this'.split()
+
+
+def main():
+    ap = _plugin.parser(__doc__.splitlines()[0])
+    ap.add_argument('--lines', type=int, default=20000)
+    args = ap.parse_args()
+    m = _plugin.load(args.plugin)
+    bot = _plugin.Bot()
+    m.setup(bot)
+    rnd = random.Random(1)
+    nicks = ['nick%d' % i for i in range(40)]
+    lines = [
+        _plugin.Trigger(rnd.choice(nicks), rnd.choice(['#a', '#b', '#c']),
+                        ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 14))))
+        for _ in range(args.lines)
+    ]
+    threaded = getattr(m.handle, 'thread', True)
+    started = time.perf_counter()
+    for trigger in lines:
+        if threaded:
+            worker = threading.Thread(target=m.handle, args=(bot, trigger))
+            worker.start()
+            worker.join()
+        else:
+            m.handle(bot, trigger)
+    rate = len(lines) / (time.perf_counter() - started)
+    _plugin.stop(m, bot)
+    print('handle thread=%s: %d passive lines, %.0f lines/sec' % (threaded, len(lines), rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Streamed vs buffered replies (stream_replies).
+
+1. Lines: feeds a set of replies to _ReplyStream in random-sized deltas and checks
+   the IRC lines against what _deliver_reply sends for the same reply. They must
+   match, except for two documented differences: a streamed reply is addressed on
+   its first line (so a nick named only later still gets the prefix), and ASCII art
+   found after the first line went out is replaced by the notice on a line of its
+   own, after the lines already sent and not recorded as part of the reply.
+2. Latency: sends questions through handle() to bench/mock_api.py, streamed and
+   buffered, over chat completions and the Responses API, and reports the time to
+   the first and last IRC line.
+
+    python bench/stream_compare.py [--plugin PATH] [--seeds N] [--rounds N]
+"""
+import asyncio
+import random
+import sys
+import time
+
+import _plugin
+from mock_api import MockAPI
+
+NOTICE = 'I was gonna draw something cool'
+ART = '\n╔══════╗\n║ hi   ║\n║ there║\n╚══════╝\n'
+
+
+def _cases(rnd):
+    words = 'the quick brown fox jumps over lazy dogs while servers deploy kernels and alice drinks stout'.split()
+
+    def para(n):
+        return ' '.join(rnd.choice(words) for _ in range(n))
+
+    return [
+        ('greeting', 'Hello there!'),
+        ('own nick prefix', 'glitchy: hi bob, nice to see you'),
+        ('citations', para(30) + ' [1] and more [2]. ' + para(10) + '[3].'),
+        ('code fence', 'Here is code:\n```python\nprint("hi there")\nx = 1\n```\nDone ' + para(20)),
+        ('three lines', para(200)),
+        ('over the display limit', para(400)),
+        ('pings', 'Ping @everyone and @here now ' + para(5)),
+        ('newlines', 'line one\nline two\n\nline three ' + para(100)),
+        ('art only', 'Art:' + ART),
+        ('art after 50 words', para(50) + ' Art:' + ART + para(10)),
+        ('art after the first line', para(120) + ' Art:' + ART + para(10)),
+        ('block shading', '▀▀▀▀▀▀▀ shading ' + para(8)),
+        ('unclosed fence', 'unclosed ``` fence ' + para(12)),
+        ('nick named late', para(90) + ' bob ' + para(10)),
+    ]
+
+
+async def _stream(m, bot, trigger, review, text, rnd):
+    stream = m._ReplyStream(bot, trigger, review, 'glitchy', time.perf_counter())
+    i = 0
+    while i < len(text):
+        n = rnd.choice([1, 2, 3, 5, 8, 13])
+        if not await stream.feed(text[i:i + n]):
+            break
+        i += n
+    return await stream.finish()
+
+
+def _allowed(name, nick, buffered, streamed, recorded):
+    """Whether a difference between the two is one the streamed path documents."""
+    if name == 'nick named late':
+        # Same words; the prefix may move where the lines wrap
+        prefix = nick + ': '
+        text = ' '.join(streamed)
+        return text.startswith(prefix) and text[len(prefix):] == ' '.join(buffered)
+    if name == 'art after the first line':
+        *lines, last = streamed
+        return (
+            last.startswith(NOTICE)
+            and not any(NOTICE in line for line in lines)
+            and NOTICE not in recorded
+            and buffered == [nick + ': ' + last]
+        )
+    return False
+
+
+def compare_lines(m, seeds):
+    delay, m.SEND_DELAY = m.SEND_DELAY, 0
+    bot = _plugin.Bot()
+    m.setup(bot)
+    same = allowed = failed = 0
+    try:
+        for seed in range(seeds):
+            for ci, (name, text) in enumerate(_cases(random.Random(seed))):
+                for nick in ('bob', 'carol'):
+                    trigger = _plugin.Trigger(nick, '#c', 'x')
+                    review = ci % 3 == 0
+                    bot.said.clear()
+                    _plugin.allow_next(bot, trigger)
+                    m.random.seed(seed)
+                    m._deliver_reply(bot, trigger, text, review, False, 'glitchy', time.perf_counter())
+                    buffered = [line for _, line in bot.said]
+                    bot.said.clear()
+                    _plugin.allow_next(bot, trigger)
+                    m.random.seed(seed)
+                    recorded = asyncio.run(
+                        _stream(m, bot, trigger, review, text, random.Random(seed * 100 + ci)))
+                    streamed = [line for _, line in bot.said]
+                    if streamed == buffered:
+                        same += 1
+                    elif _allowed(name, nick, buffered, streamed, recorded):
+                        allowed += 1
+                    else:
+                        failed += 1
+                        print('MISMATCH %r (%s, seed %d)\n  buffered %r\n  streamed %r' % (name, nick, seed, buffered, streamed))
+    finally:
+        m.shutdown(bot)
+        m.SEND_DELAY = delay
+    print('lines: %d identical, %d documented differences, %d mismatches' % (same, allowed, failed))
+    return failed == 0
+
+
+def compare_latency(m, rounds):
+    with MockAPI(think=0.8, token=0.02, words=200) as api:
+        for api_name, chaining in (('chat', False), ('responses', True)):
+            for streaming in (True, False):
+                bot = _plugin.Bot(api_base=api.base, stream_replies=streaming, response_chaining=chaining)
+                m.setup(bot)
+                first, last = [], []
+                try:
+                    for i in range(rounds):
+                        # PMs, so response_chaining sends them through the Responses API
+                        trigger = _plugin.Trigger('bob', 'bob', 'tell me a long story %d' % i)
+                        _plugin.allow_next(bot, trigger)
+                        bot.said_at.clear()
+                        started = time.perf_counter()
+                        m.handle(bot, trigger)
+                        _plugin.wait_idle(bot)
+                        if bot.said_at:
+                            first.append(bot.said_at[0] - started)
+                            last.append(bot.said_at[-1] - started)
+                finally:
+                    m.shutdown(bot)
+                print('latency %-9s %-8s first line %.2fs, last line %.2fs (avg of %d)' % (
+                    api_name, 'streamed' if streaming else 'buffered',
+                    sum(first) / max(len(first), 1), sum(last) / max(len(last), 1), len(first)))
+
+
+def main():
+    ap = _plugin.parser(__doc__.splitlines()[0])
+    ap.add_argument('--seeds', type=int, default=20, help='random delta splits per case')
+    ap.add_argument('--rounds', type=int, default=3, help='questions per latency run')
+    args = ap.parse_args()
+    m = _plugin.load(args.plugin)
+    ok = compare_lines(m, args.seeds)
+    compare_latency(m, args.rounds)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()